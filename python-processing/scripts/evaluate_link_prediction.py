@@ -7,94 +7,389 @@ logging.basicConfig(level=logging.INFO,
 _log = logging.getLogger()
 
 import os
+import copy
 import argparse
+import multiprocessing
 
 import numpy as np
-from scipy.sparse import lil_matrix
+from scipy.sparse import csr_matrix
 from time import strftime
-from tools.tensor_utils import connection_indices, read_input_tensor, SparseTensor
+from tools.tensor_utils import connection_indices, read_input_tensor, need_pair_indices, need_degrees, need_mask, \
+    remove_needs, subset_tensor, offer_want_pair_indices, fold_pair_numbers, SparseTensor
+from tools.minhash_lsh import MinHashLSH
+from tools.artefact_writer import ArtefactWriter
+from tools.fold_cache import FoldCache
+from tools.evaluation_utils import FoldContext
+from tools.evaluation_checkpoint import checkpoint_folder, write_run_state, read_run_state, write_fold_checkpoint, \
+    read_fold_checkpoint, write_fold_factors
+from tools.fold_spec import FOLD_PARAMETERS, read_fold_spec, write_fold_spec, fold_spec_differences, \
+    read_fold_connections, write_fold_connections
 from scripts.evaluation_algorithms import CosineEvaluation, RescalEvaluation, \
     RescalSimilarityEvaluation, PredictionMatrixFileEvaluation, CombineCosineRescalEvaluation, \
-    IntersectionCosineRescalEvaluation
+    IntersectionCosineRescalEvaluation, BM25Evaluation, BM25TopKEvaluation
 
-# for all test_needs return all indices (shuffeld) to all other needs in the connection slice
+# for all test_needs return all indices to all other needs in the connection slice as two int32 arrays
 def need_connection_indices(all_needs, test_needs):
-    allindices = ([],[])
-    for row in test_needs:
-        fromneeds = [row] * len(all_needs)
-        toneeds = all_needs
-        allindices[0].extend(fromneeds)
-        allindices[1].extend(toneeds)
-    indices = range(len(allindices[0]))
-    np.random.shuffle(indices)
-    ret0 = [allindices[0][i] for i in indices]
-    ret1 = [allindices[1][i] for i in indices]
-    return (ret0, ret1)
-
-# mask all connections at specified indices in the tensor
+    return need_pair_indices(test_needs, all_needs)
+
+# for all test_needs return the indices to all needs of the opposite need type (offers to wants and wants to offers)
+# as two int32 arrays, together with the number of left out pairs to the other needs for each of the test needs
+def offer_want_connection_indices(all_needs, test_needs, offers, wants):
+    test_needs = np.asarray(test_needs, dtype=np.int32)
+    is_offer = np.isin(test_needs, offers)
+    is_want = np.isin(test_needs, wants) & ~is_offer
+    indices = offer_want_pair_indices(offers, wants, test_needs)
+    excluded = len(all_needs) - np.where(is_offer, len(wants), np.where(is_want, len(offers), 0))
+    return indices, excluded
+
+# return the index pairs (two int32 arrays) of pair numbers (position of the from need * number of needs + position
+# of the to need), e.g. the masked connection pairs of a fold of fold_pair_numbers()
+def connection_pair_indices(all_needs, pairs):
+    all_needs = np.asarray(all_needs, dtype=np.int32)
+    return (all_needs[pairs // len(all_needs)], all_needs[pairs % len(all_needs)])
+
+# mask all connections at specified indices in the tensor. The returned tensor is a view of the tensor that only
+# replaces the connection slice
 def mask_idx_connections(tensor, indices):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for idx in range(len(indices[0])):
-        conSlice[indices[0][idx],indices[1][idx]] = 0
-        conSlice[indices[1][idx],indices[0][idx]] = 0
-    masked_tensor = tensor.copy()
-    masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
+    conSlice = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocoo()
+    n = conSlice.shape[0]
+    rows = np.asarray(indices[0], dtype=np.int64)
+    cols = np.asarray(indices[1], dtype=np.int64)
+    masked = np.concatenate((rows * n + cols, cols * n + rows))
+    keep = ~np.isin(conSlice.row.astype(np.int64) * n + conSlice.col, masked)
+    masked_tensor = tensor.view()
+    masked_tensor.addSliceMatrix(csr_matrix((conSlice.data[keep], (conSlice.row[keep], conSlice.col[keep])),
+                                            shape=conSlice.shape), SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
-# mask all connections of some needs to all other needs
+# mask all connections of some needs to all other needs. The returned tensor is a view of the tensor that only
+# replaces the connection slice
 def mask_need_connections(tensor, needs):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for need in needs:
-        conSlice[need,:] = lil_matrix(np.zeros(conSlice.shape[0]))
-        conSlice[:,need] = lil_matrix(np.zeros(conSlice.shape[0])).transpose()
-    masked_tensor = tensor.copy()
-    masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
+    conSlice = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocoo()
+    masked = np.zeros(conSlice.shape[0], dtype=bool)
+    masked[np.asarray(needs, dtype=np.int64)] = True
+    keep = ~(masked[conSlice.row] | masked[conSlice.col])
+    masked_tensor = tensor.view()
+    masked_tensor.addSliceMatrix(csr_matrix((conSlice.data[keep], (conSlice.row[keep], conSlice.col[keep])),
+                                            shape=conSlice.shape), SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
-# mask all connections but a number of X for each need
-def mask_all_but_X_connections_per_need(tensor, keep_x):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for row in set(conSlice.nonzero()[0]):
-        if conSlice[row,:].getnnz() > keep_x:
-            mask_idx = conSlice.nonzero()[1][np.where(conSlice.nonzero()[0]==row)]
-            np.random.shuffle(mask_idx)
-            for col in mask_idx[keep_x:]:
-                conSlice[row,col] = 0
-                conSlice[col,row] = 0
-    masked_tensor = tensor.copy()
-    masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
+# mask all connections but a number of X for each need. The (undirected) connections are ordered randomly by one
+# random key each. In every round each need proposes its first connections (by key) up to its remaining number of
+# connections to keep and the connections proposed by both needs are kept. This is repeated until every remaining
+# connection has a need that can not keep more connections, these connections are masked in both directions.
+# Every round keeps at least the remaining connection with the smallest key, with random keys only a few rounds are
+# needed (every need keeps at most X connections, the result is symmetric, see tests/test_evaluate_link_prediction.py).
+# The random keys are drawn from "random_state" (e.g. a seeded numpy RandomState).
+def mask_all_but_X_connections_per_need(tensor, keep_x, random_state=np.random):
+    conSlice = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocoo()
+    nonzero = conSlice.data != 0
+    rows, cols, data = conSlice.row[nonzero], conSlice.col[nonzero], conSlice.data[nonzero]
+    n = conSlice.shape[0]
+    connections, entry_connection = np.unique(np.minimum(rows, cols).astype(np.int64) * n + np.maximum(rows, cols),
+                                              return_inverse=True)
+    need1, need2 = connections // n, connections % n
+    # connections of a need to itself only need to be proposed (and counted) once
+    required = np.where(need1 == need2, 1, 2)
+    key = random_state.permutation(len(connections))
+    capacity = np.full(n, max(keep_x, 0), dtype=np.int64)
+    kept = np.zeros(len(connections), dtype=bool)
+    undecided = np.ones(len(connections), dtype=bool)
+    while True:
+        candidates = np.flatnonzero(undecided & (capacity[need1] > 0) & (capacity[need2] > 0))
+        if len(candidates) == 0:
+            break
+        other = candidates[need1[candidates] != need2[candidates]]
+        needs = np.concatenate((need1[candidates], need2[other]))
+        ids = np.concatenate((candidates, other))
+        order = np.argsort(needs * len(connections) + key[ids])
+        counts = np.bincount(needs, minlength=n)
+        position = np.empty(len(ids), dtype=np.int64)
+        position[order] = np.arange(len(ids)) - (np.cumsum(counts) - counts)[needs[order]]
+        proposed = ids[position < capacity[needs]]
+        accepted = np.flatnonzero(np.bincount(proposed, minlength=len(connections)) == required)
+        kept[accepted] = True
+        undecided[accepted] = False
+        capacity -= np.bincount(need1[accepted], minlength=n) + \
+                    np.bincount(need2[accepted][need1[accepted] != need2[accepted]], minlength=n)
+    keep = kept[np.asarray(entry_connection).ravel()]
+    masked_tensor = tensor.view()
+    masked_tensor.addSliceMatrix(csr_matrix((data[keep], (rows[keep], cols[keep])), shape=conSlice.shape),
+                                 SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
-# choose number of x needs to keep and remove all other needs that exceed this number
+# choose number of x needs to keep and remove all other needs that exceed this number. Return the compacted tensor
+# and the indices of its entities in the original tensor.
 def keep_x_random_needs(tensor, keep_x):
     rand_needs = tensor.getNeedIndices()
     np.random.shuffle(rand_needs)
-    remove_needs = rand_needs[keep_x:]
-    return mask_needs(tensor, remove_needs)
+    return remove_needs(tensor, rand_needs[keep_x:])
 
-# mask all needs with have more than X connections
+# remove all needs with have more than X connections. Return the compacted tensor and the indices of its entities in
+# the original tensor.
 def mask_needs_with_more_than_X_connections(tensor, x_connections):
-    remove_needs = []
-    for need in range(tensor.shape[0]):
-        if (tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)[need,].sum() > x_connections):
-            remove_needs.append(need)
-    return mask_needs(tensor, remove_needs)
-
-# mask complete needs (including references to attributes, connections, etc)
-def mask_needs(tensor, needs):
-    if (len(needs) == 0):
-        return tensor
-    slices = [lil_matrix(slice) for slice in tensor.getSliceMatrixList()]
-    idx = 0
-    newHeaders = ["NULL" if i in needs else tensor.getHeaders()[i] for i in range(len(tensor.getHeaders()))]
-    masked_tensor = SparseTensor(newHeaders)
-    for slice in slices:
-        for need in needs:
-            slice[need,:] = lil_matrix(np.zeros(slice.shape[0]))
-            slice[:,need] = lil_matrix(np.zeros(slice.shape[0])).transpose()
-        masked_tensor.addSliceMatrix(slice, idx)
-        idx += 1
-    return masked_tensor
+    return remove_needs(tensor, np.flatnonzero(need_mask(tensor) & (need_degrees(tensor) > x_connections)))
+
+# read the input tensor of the evaluation from the input folder (headers, connection, need type and additional slices)
+def read_evaluation_tensor(args):
+    folder = args.inputfolder
+    data_input = [folder + "/" + args.connection_slice,
+                  folder + "/" + args.needtype_slice]
+    for slice in args.additional_slices:
+        data_input.append(folder + "/" + slice)
+    header_input = folder + "/" + args.headers
+    slices = SparseTensor.defaultSlices + [SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
+    return read_input_tensor(header_input, data_input, slices, True)
+
+# read the fold specification of a run (option "-foldspec") and check that it was created with the same fold
+# parameters and input tensor, otherwise error(message) is called, or the specification is created again by the run
+# if "args.rebuildfoldspec" is set (e.g. after the input tensor was recreated by a workflow). If the specification
+# does not exist yet the random choices of the run are seeded (with a random seed if none is given) so the seed can be
+# recorded in the new specification. Return the specification (None if it is created by the run) and the seed of the
+# random choices.
+def load_fold_spec(args, input_tensor, error, logger):
+    fold_parameters = dict([(name, vars(args)[name]) for name in FOLD_PARAMETERS])
+    if args.seed is not None:
+        fold_parameters['seed'] = args.seed
+    fold_spec = read_fold_spec(args.foldspec)
+    if fold_spec:
+        differences = fold_spec_differences(fold_spec, fold_parameters, input_tensor.fingerprint())
+        if not differences:
+            logger.info('Use the folds of the fold specification %s (seed %d)' % (args.foldspec, fold_spec['seed']))
+            return fold_spec, fold_spec['seed']
+        if not args.rebuildfoldspec:
+            error('-foldspec: the fold specification %s was created with other %s' %
+                  (args.foldspec, ", ".join(differences)))
+        logger.warning('The fold specification %s was created with other %s, it is created again' %
+                       (args.foldspec, ", ".join(differences)))
+    fold_seed = args.seed if args.seed is not None else np.random.randint(np.iinfo(np.int32).max)
+    np.random.seed(fold_seed)
+    return None, fold_seed
+
+# test setup of a N-fold cross validation: the needs of the input tensor that are used for the evaluation (ground
+# truth), the training tensor with a maximum number of connections per need and the test needs (or the masked
+# connections) of every fold. The random choices are taken from a fold specification (see tools/fold_spec.py) or are
+# made with the random state of numpy, in this case they are written to a new fold specification if "args.foldspec"
+# is given. create_fold() returns the test data of a fold, entity_ids maps the entities of the evaluation to the
+# entities of the input tensor.
+class CrossValidationFolds:
+
+    def __init__(self, args, input_tensor, logger, fold_spec=None, fold_seed=None):
+        self.args = args
+        self.logger = logger
+        self.fold_spec = fold_spec
+
+        # TEST-PARAMETERS:
+        # ===================
+
+        # (10-)fold cross validation
+        self.folds = args.folds
+
+        # True means: for testing mask all connections of random test needs (Test Case: Predict connections for new
+        # need without connections)
+        # False means: for testing mask random connections (Test Case: Predict connections for existing need which
+        # may already have connections)
+        self.mask_all_connections_of_test_need = not args.maskrandom
+
+        # by changing this parameter the number of training connections per need can be set. Choose a high value (e.g.
+        # 100) to use all connection in the connections file. Choose a low number to restrict the number of training
+        # connections (e.g. to 1 or even 0). This way tests are possible that describe situation where initially not
+        # many connection are available to learn from.
+        self.max_connections_per_need = args.maxconnections
+
+        logger.info('------------------------------')
+        logger.info('Test Setup:')
+        logger.info('------------------------------')
+
+        # the needs that are not used are removed from the tensor (together with their attributes), entity_ids maps
+        # the entities of the compacted tensor to the entities of the input tensor
+        input_fingerprint = input_tensor.fingerprint() if args.foldspec and not fold_spec else None
+        num_entities = input_tensor.shape[0]
+        if fold_spec:
+            keep = np.zeros(num_entities, dtype=bool)
+            keep[fold_spec['entity_ids']] = True
+            input_tensor, entity_ids = subset_tensor(input_tensor, keep)
+        else:
+            entity_ids = np.arange(num_entities)
+            if (args.numneeds < len(input_tensor.getNeedIndices())):
+                input_tensor, ids = keep_x_random_needs(input_tensor, args.numneeds)
+                entity_ids = entity_ids[ids]
+
+            input_tensor, ids = mask_needs_with_more_than_X_connections(input_tensor, args.maxhubsize)
+            entity_ids = entity_ids[ids]
+        logger.info('Use only needs that do not have more than %d connections' % args.maxhubsize)
+        logger.info('Use %d of %d entities (needs and attributes) of the input tensor' %
+                    (len(entity_ids), num_entities))
+        self.entity_ids = entity_ids
+
+        self.ground_truth = input_tensor.copy()
+        self.num_connection_pairs = len(input_tensor.getNeedIndices()) ** 2
+        if fold_spec:
+            self.needs = fold_spec['needs']
+        else:
+            self.needs = input_tensor.getNeedIndices()
+            np.random.shuffle(self.needs)
+
+        # with -maskrandom every (need, need) pair is assigned to a random fold by a hash of its pair number and this
+        # seed, the masked pairs of a fold are drawn when the fold is created (see fold_pair_numbers())
+        if fold_spec:
+            self.pair_seed = fold_spec.get('pair_seed')
+        elif not self.mask_all_connections_of_test_need:
+            self.pair_seed = np.random.randint(np.iinfo(np.int32).max)
+        else:
+            self.pair_seed = None
+
+        if self.mask_all_connections_of_test_need:
+            logger.info('Mask all connections of random test needs (Test Case: Predict connections for new need '
+                        'without connections)')
+        else:
+            logger.info('Mask random connections (Test Case: Predict connections for existing need which may '
+                        'already have connections)')
+
+        logger.info('Use a maximum number of %d connections per need' % self.max_connections_per_need)
+        if fold_spec:
+            input_tensor = input_tensor.view()
+            input_tensor.addSliceMatrix(fold_spec['train_connections'], SparseTensor.CONNECTION_SLICE)
+        else:
+            input_tensor = mask_all_but_X_connections_per_need(input_tensor, self.max_connections_per_need)
+        self.tensor = input_tensor
+        self.offers = input_tensor.getOfferIndices()
+        self.wants = input_tensor.getWantIndices()
+        self.offer_mask = np.zeros(input_tensor.shape[0], dtype=bool)
+        self.offer_mask[self.offers] = True
+        self.want_mask = np.zeros(input_tensor.shape[0], dtype=bool)
+        self.want_mask[self.wants] = True
+
+        # the test needs of every fold, with -maskrandom the masked connection pairs are not kept for all folds (fold
+        # specifications of earlier versions contain the numbers of the masked connection pairs of every fold)
+        if fold_spec:
+            self.fold_tests = fold_spec['fold_tests']
+        elif self.mask_all_connections_of_test_need:
+            need_fold_size = int(len(self.needs) / self.folds)
+            self.fold_tests = [self.needs[f * need_fold_size:(f + 1) * need_fold_size] for f in range(self.folds)]
+        else:
+            self.fold_tests = []
+
+        needs = self.needs
+        logger.info('Number of test needs: %d (OFFERS: %d, WANTS: %d)' %
+                    (len(needs), len(set(needs) & set(self.offers)), len(set(needs) & set(self.wants))))
+        logger.info('Number of total needs: %d (OFFERS: %d, WANTS: %d)' %
+                    (len(input_tensor.getNeedIndices()), len(self.offers), len(self.wants)))
+        logger.info('Number of test and train connections: %d' % len(connection_indices(input_tensor)[0]))
+        logger.info('Number of total connections (for evaluation): %d' %
+                    len(connection_indices(self.ground_truth)[0]))
+        logger.info('Number of attributes: %d' % len(input_tensor.getAttributeIndices()))
+        logger.info('Starting %d-fold cross validation' % self.folds)
+
+        # the random seeds of the folds, each fold uses its own random seed so the folds can be evaluated in any order
+        # or in parallel. The folds are written to a new fold specification, with an existing specification the
+        # random state after the folds were created is restored (e.g. for the LSH index).
+        if fold_spec:
+            self.fold_seeds = fold_spec['fold_seeds']
+            np.random.set_state(fold_spec['random_state'])
+        else:
+            self.fold_seeds = np.random.randint(0, np.iinfo(np.int32).max, self.folds)
+            if args.foldspec:
+                self.fold_spec = {'seed': fold_seed, 'fingerprint': input_fingerprint,
+                                  'parameters': dict([(name, vars(args)[name]) for name in FOLD_PARAMETERS]),
+                                  'entity_ids': entity_ids,
+                                  'train_connections': input_tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
+                                  'needs': self.needs, 'fold_seeds': self.fold_seeds, 'fold_tests': self.fold_tests,
+                                  'pair_seed': self.pair_seed,
+                                  'random_state': np.random.get_state()}
+                self.fold_spec['id'] = write_fold_spec(args.foldspec, self.fold_spec)
+                logger.info('Write the folds to the fold specification %s (seed %d)' % (args.foldspec, fold_seed))
+
+    # mask the test connections of a fold in the tensor (mask(tensor, test)). With a fold specification the masked
+    # connection slice of the fold is loaded from its cache, or added to the cache if it is not cached yet.
+    def fold_tensor(self, f, mask, test):
+        foldspec = self.args.foldspec
+        connection_slice = read_fold_connections(foldspec, self.fold_spec, f) if foldspec else None
+        if connection_slice is not None:
+            test_tensor = self.tensor.view()
+            test_tensor.addSliceMatrix(connection_slice, SparseTensor.CONNECTION_SLICE)
+            return test_tensor
+        test_tensor = mask(self.tensor, test)
+        if foldspec:
+            write_fold_connections(foldspec, self.fold_spec, f,
+                                   test_tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
+        return test_tensor
+
+    # create the test data of a fold (FoldContext): the test needs, the test index pairs and the tensor with masked
+    # test connections
+    def create_fold(self, f):
+        np.random.seed(self.fold_seeds[f])
+        self.logger.info('------------------------------')
+        # define test set of connections indices
+        excluded = None
+        all_needs = self.tensor.getNeedIndices()
+        if self.mask_all_connections_of_test_need:
+            # choose the test needs for the fold and mask all connections of them to other needs
+            test_needs = self.fold_tests[f]
+            self.logger.info('Fold %d, fold size %d needs (out of %d)' % (f, len(test_needs), len(self.needs)))
+            test_tensor = self.fold_tensor(f, mask_need_connections, test_needs)
+            if self.args.offerwantpairs:
+                idx_test, excluded = offer_want_connection_indices(all_needs, test_needs, self.offers, self.wants)
+                self.logger.info('Test %d offer/want pairs, count %d other pairs as true negatives' %
+                                 (len(idx_test[0]), np.sum(excluded)))
+            else:
+                idx_test = need_connection_indices(all_needs, test_needs)
+        else:
+            # choose test connections to mask independently of needs
+            if len(self.fold_tests) > 0:
+                pairs = self.fold_tests[f]
+            else:
+                pairs = fold_pair_numbers(self.num_connection_pairs, self.folds, f, self.pair_seed)
+            self.logger.info('Fold %d, fold size %d connection indices (out of %d)' %
+                             (f, len(pairs), self.num_connection_pairs))
+            idx_test = connection_pair_indices(all_needs, pairs)
+            test_tensor = self.fold_tensor(f, mask_idx_connections, idx_test)
+            test_needs = self.needs
+        self.logger.info('------------------------------')
+        return FoldContext(f, test_tensor, test_needs, idx_test, self.ground_truth, self.offer_mask, self.want_mask,
+                           excluded)
+
+# function that evaluates a fold of the cross validation and returns its results, the worker processes of a parallel
+# cross validation inherit it from the main process
+_cross_validation = None
+_blas_limits = None
+
+# limit the threads of the BLAS/OpenMP libraries (numpy, scipy) in a worker process so that the parallel folds do not
+# oversubscribe the cpus. This needs the (optional) threadpoolctl package, otherwise set e.g. OMP_NUM_THREADS before
+# starting the evaluation.
+def init_fold_worker(blas_threads):
+    global _blas_limits
+    try:
+        from threadpoolctl import threadpool_limits
+        _blas_limits = threadpool_limits(limits=blas_threads)
+    except ImportError:
+        pass
+
+# evaluate one fold in a worker process and return the per fold results of all evaluation algorithms
+def evaluate_worker_fold(f):
+    return _cross_validation(f)
+
+# evaluate a fold (FoldContext) with copies of the evaluation algorithms that only collect the results of this fold
+# and return these per fold results of all algorithms (see EvaluationAlgorithm.fold_results()). The algorithms are
+# not changed, the results are merged into them in fold order afterwards.
+def evaluate_fold_results(evaluation_algorithms, fold):
+    fold_results = []
+    for algorithm in evaluation_algorithms:
+        fold_algorithm = copy.copy(algorithm)
+        fold_algorithm.start_fold_results(fold)
+        fold_algorithm.evaluate_fold(fold)
+        fold_results.append(fold_algorithm.fold_results())
+    return fold_results
+
+# return a pool of worker processes for the parallel evaluation of folds. The workers are forked from the main process
+# so they share the (read only) tensors and evaluation algorithms with it instead of copying them.
+def fold_worker_pool(workers, blas_threads):
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    return context.Pool(workers, init_fold_worker, (blas_threads,))
+
+# options that do not change the results of a run, they can be changed when a run is resumed
+EXECUTION_OPTIONS = ['outputfolder', 'resume', 'workers', 'blasthreads', 'writequeue', 'writebuffer',
+                     'checkpointfactors']
 
 # This program executes a N-fold cross validation on rescal tensor data.
 # For each fold test needs are randomly chosen and all their connections to
@@ -144,34 +439,88 @@ if __name__ == '__main__':
                         type=int, help="number of needs used for the evaluation")
     parser.add_argument('-statistics', action="store_true", dest="statistics",
                         help="write detailed statistics for the evaluation")
+    parser.add_argument('-statistics_format', action="store", dest="statistics_format", default='files',
+                        choices=['files', 'columnar'],
+                        help="write the detailed statistics as one file per tested need or as one compressed "
+                             "columnar file per algorithm (see scripts/print_statistic_details.py)")
+    parser.add_argument('-writequeue', action="store", dest="writequeue", default=8, type=int,
+                        help="write the statistics files in a background thread with at most this number of files "
+                             "waiting to be written (0 means write the files synchronously)")
+    parser.add_argument('-writebuffer', action="store", dest="writebuffer", default=256, type=int,
+                        help="maximum memory in MB of the statistics data waiting to be written in the background")
+    parser.add_argument('-seed', action="store", dest="seed", default=None, type=int,
+                        help="seed of the random choices of the evaluation (test needs, masked connections)")
+    parser.add_argument('-foldspec', action="store", dest="foldspec", default=None,
+                        help="fold specification file of the dataset (see tools/fold_spec.py): if it exists the "
+                             "folds are loaded from it, otherwise the folds of this run are written to it")
+    parser.add_argument('-rebuildfoldspec', action="store_true", dest="rebuildfoldspec",
+                        help="create the fold specification again if it was created with other fold parameters or "
+                             "another input tensor (instead of stopping with an error)")
     parser.add_argument('-maxhubsize', action="store", dest="maxhubsize", default=10000,
                         type=int, help="use only needs for the evaluation that do not exceed a number X of connections")
-
-    # algorithm parameters
+    parser.add_argument('-offerwantpairs', action="store_true", dest="offerwantpairs",
+                        help="only test the pairs of test needs to needs of the opposite type (offer/want), all other "
+                             "pairs are counted as true negatives (not with -maskrandom; curves and AUC only include "
+                             "the offer/want pairs)")
+    parser.add_argument('-curvebins', action="store", dest="curvebins", default=None, type=int,
+                        help="compute precision/recall and ROC curves from score histograms with this number of bins "
+                             "instead of exactly from all scores (bounded memory and curve file size)")
+    parser.add_argument('-curvebinning', action="store", dest="curvebinning", default='width',
+                        choices=['width', 'quantile'], help="binning of the score histograms for the curves")
+    parser.add_argument('-workers', action="store", dest="workers", default=1, type=int,
+                        help="evaluate the folds in parallel in this number of worker processes (results are the same "
+                             "as of the sequential evaluation with the same seed)")
+    parser.add_argument('-resume', action="store_true", dest="resume",
+                        help="resume an aborted run in its output folder (-outputfolder): the results of the completed "
+                             "folds are loaded from their checkpoints and only the other folds are evaluated")
+    parser.add_argument('-checkpointfactors', action="store_true", dest="checkpointfactors",
+                        help="write the RESCAL factors of each fold to the checkpoint folder")
+    parser.add_argument('-blasthreads', action="store", dest="blasthreads", default=1, type=int,
+                        help="maximum number of BLAS threads per worker process if folds are evaluated in parallel "
+                             "(needs threadpoolctl)")
+    parser.add_argument('-lsh', action="store", dest="lsh", nargs=2, metavar=('bands', 'rows'),
+                        help="additionally evaluate the algorithms (RESCAL, cosine) on approximate MinHash LSH "
+                             "offer/want candidates and report the candidate recall")
+
+    # algorithm parameters, the thresholds of -rescal, -rescalsim, -cosine, -cosine_weighted and -intersection can be
+    # comma separated lists (e.g. 0.01,0.02,0.03): every fold is scored once and evaluated for all thresholds
     parser.add_argument('-rescal', action="store", dest="rescal", nargs=9,
                         metavar=('rank', 'threshold', 'useNeedTypeSlice', 'transitiveConnections', 'init', 'conv',
                                  'lambda_A', 'lambda_R', 'lambda_V'),
-                        help="evaluate RESCAL algorithm")
+                        help="evaluate RESCAL algorithm (threshold can be a comma separated list, the LSH evaluation "
+                             "and the statistics use the first threshold)")
     parser.add_argument('-rescalsim', action="store", dest="rescalsim", nargs=4,
                         metavar=('rank', 'threshold', 'useNeedTypeSlice', 'useConnectionSlice'),
-                        help="evaluate RESCAL similarity algorithm")
+                        help="evaluate RESCAL similarity algorithm (threshold can be a comma separated list)")
     parser.add_argument('-cosine', action="store", dest="cosine", nargs=2,
                         metavar=('threshold', 'transitive_threshold'),
-                        help="evaluate cosine similarity algorithm" )
+                        help="evaluate cosine similarity algorithm (threshold can be a comma separated list)")
     parser.add_argument('-cosine_weighted', action="store", dest="cosine_weigthed",
                         nargs=2, metavar=('threshold', 'transitive_threshold'),
-                        help="evaluate weighted cosine similarity algorithm")
+                        help="evaluate weighted cosine similarity algorithm (threshold can be a comma separated list)")
     parser.add_argument('-cosine_rescal', action="store", dest="cosine_rescal",
                         nargs=4, metavar=('rescal_rank', 'rescal_threshold', 'cosine_threshold', 'useNeedTypeSlice'),
                         help="evaluate combined algorithms cosine similarity and rescal")
     parser.add_argument('-intersection', action="store", dest="intersection",
                         nargs=4, metavar=('rescal_rank', 'rescal_threshold', 'cosine_threshold', 'useNeedTypeSlice'),
-                        help="compute the prediction intersection of algorithms cosine similarity and rescal")
+                        help="compute the prediction intersection of algorithms cosine similarity and rescal (the "
+                             "thresholds can be comma separated lists, all combinations are evaluated)")
+    parser.add_argument('-bm25', action="store", dest="bm25", nargs=3, metavar=('threshold', 'var_k', 'var_b'),
+                        help="evaluate BM25 algorithm (e.g. var_k=1.5, var_b=0.75)")
+    parser.add_argument('-bm25_topk', action="store", dest="bm25_topk", nargs=1, metavar='k',
+                        help="evaluate BM25 retrieval of the top k counterparts of each test need")
     parser.add_argument('-prediction_matrix_file', action='store', dest='prediction_matrix_file',
                         help='path to matrix file (same file format as connection slice of tensor) that makes '
                              'connection predictions and can be generated separately')
 
     args = parser.parse_args()
+    if args.offerwantpairs and args.maskrandom:
+        parser.error('-offerwantpairs can not be used together with -maskrandom')
+    if args.offerwantpairs and (args.bm25 or args.bm25_topk or args.prediction_matrix_file):
+        parser.error('-offerwantpairs can only be used with algorithms that only predict offer/want pairs (not with '
+                     '-bm25, -bm25_topk or -prediction_matrix_file)')
+    if args.resume and not args.outputfolder:
+        parser.error('-resume needs the output folder of the run (-outputfolder)')
     folder = args.inputfolder
 
     start_time = strftime("%Y-%m-%d_%H%M%S")
@@ -181,75 +530,39 @@ if __name__ == '__main__':
         outfolder = folder + "/out/" + start_time
     if not os.path.exists(outfolder):
         os.makedirs(outfolder)
+
+    # a resumed run restores the state of the run so it creates the same folds, otherwise the state is written for
+    # resuming this run later
+    checkpoints = checkpoint_folder(outfolder)
+    parameters = dict([(name, value) for name, value in vars(args).items() if name not in EXECUTION_OPTIONS])
+    run_state = read_run_state(checkpoints) if args.resume else None
+    if args.resume and run_state is None:
+        parser.error('-resume: no run was started in the output folder ' + outfolder)
+    if run_state:
+        if run_state['parameters'] != parameters:
+            parser.error('-resume: the parameters differ from the parameters of the run in the output folder: ' +
+                         ", ".join(sorted([name for name in set(parameters) | set(run_state['parameters'])
+                                           if parameters.get(name) != run_state['parameters'].get(name)])))
+        start_time = run_state['start_time']
+        np.random.set_state(run_state['random_state'])
+    else:
+        if args.seed is not None:
+            np.random.seed(args.seed)
+        write_run_state(checkpoints, parameters, start_time, np.random.get_state())
     hdlr = logging.FileHandler(outfolder + "/eval_result_" + start_time + ".log")
     _log.addHandler(hdlr)
 
     # load the tensor input data
-    data_input = [folder + "/" + args.connection_slice,
-                  folder + "/" + args.needtype_slice]
-    for slice in args.additional_slices:
-        data_input.append(folder + "/" + slice)
-    header_input = folder + "/" + args.headers
-    slices = SparseTensor.defaultSlices + [SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
-    input_tensor = read_input_tensor(header_input, data_input, slices, True)
-
+    input_tensor = read_evaluation_tensor(args)
 
-    # TEST-PARAMETERS:
-    # ===================
+    # the folds of a fold specification are only used with the same fold parameters and input tensor
+    fold_spec, fold_seed = load_fold_spec(args, input_tensor, parser.error, _log) if args.foldspec else (None, None)
 
-    # (10-)fold cross validation
+    # create the test setup of the cross validation
+    cross_validation_folds = CrossValidationFolds(args, input_tensor, _log, fold_spec, fold_seed)
+    GROUND_TRUTH = cross_validation_folds.ground_truth
     FOLDS = args.folds
 
-    # True means: for testing mask all connections of random test needs (Test Case: Predict connections for new need
-    # without connections)
-    # False means: for testing mask random connections (Test Case: Predict connections for existing need which may
-    # already have connections)
-    MASK_ALL_CONNECTIONS_OF_TEST_NEED = not args.maskrandom
-
-    # by changing this parameter the number of training connections per need can be set. Choose a high value (e.g.
-    # 100) to use all connection in the connections file. Choose a low number to restrict the number of training
-    # connections (e.g. to 1 or even 0). This way tests are possible that describe situation where initially not many
-    # connection are available to learn from.
-    MAX_CONNECTIONS_PER_NEED = args.maxconnections
-
-    _log.info('------------------------------')
-    _log.info('Test Setup:')
-    _log.info('------------------------------')
-
-    if (args.numneeds < len(input_tensor.getNeedIndices())):
-        input_tensor = keep_x_random_needs(input_tensor, args.numneeds)
-
-    input_tensor = mask_needs_with_more_than_X_connections(input_tensor, args.maxhubsize)
-    _log.info('Use only needs that do not have more than %d connections' % args.maxhubsize)
-
-    GROUND_TRUTH = input_tensor.copy()
-    needs = input_tensor.getNeedIndices()
-    np.random.shuffle(needs)
-    connections = need_connection_indices(input_tensor.getNeedIndices(), needs)
-
-    if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
-        _log.info('Mask all connections of random test needs (Test Case: Predict connections for new need '
-                  'without connections)')
-    else:
-        _log.info('Mask random connections (Test Case: Predict connections for existing need which may '
-                  'already have connections)')
-
-    _log.info('Use a maximum number of %d connections per need' % MAX_CONNECTIONS_PER_NEED)
-    input_tensor = mask_all_but_X_connections_per_need(input_tensor, MAX_CONNECTIONS_PER_NEED)
-    offers = input_tensor.getOfferIndices()
-    wants = input_tensor.getWantIndices()
-    need_fold_size = int(len(needs) / FOLDS)
-    connection_fold_size = int(len(connections[0]) / FOLDS)
-
-    _log.info('Number of test needs: %d (OFFERS: %d, WANTS: %d)' %
-              (len(needs), len(set(needs) & set(offers)), len(set(needs) & set(wants))))
-    _log.info('Number of total needs: %d (OFFERS: %d, WANTS: %d)' %
-              (len(input_tensor.getNeedIndices()), len(offers), len(wants)))
-    _log.info('Number of test and train connections: %d' % len(connection_indices(input_tensor)[0]))
-    _log.info('Number of total connections (for evaluation): %d' % len(connection_indices(GROUND_TRUTH)[0]))
-    _log.info('Number of attributes: %d' % len(input_tensor.getAttributeIndices()))
-    _log.info('Starting %d-fold cross validation' % FOLDS)
-
     # Create the algorithm evaluation classes
     _log.info('Evaluate the following algorithms: ')
     evaluation_algorithms = []
@@ -272,7 +585,7 @@ if __name__ == '__main__':
     if args.prediction_matrix_file:
         _log.info('- PredictionMatrixFileEvaluation')
         evaluation_algorithms.append(PredictionMatrixFileEvaluation(
-            args, outfolder, _log, GROUND_TRUTH, start_time))
+            args, outfolder, _log, GROUND_TRUTH, start_time, cross_validation_folds.entity_ids))
     if args.cosine_rescal:
         _log.info('- CombineCosineRescalEvaluation')
         evaluation_algorithms.append(CombineCosineRescalEvaluation(
@@ -281,36 +594,86 @@ if __name__ == '__main__':
         _log.info('- IntersectionCosineRescalEvaluation')
         evaluation_algorithms.append(IntersectionCosineRescalEvaluation(
             args, outfolder, _log, GROUND_TRUTH, start_time))
+    if args.bm25:
+        _log.info('- BM25Evaluation')
+        evaluation_algorithms.append(BM25Evaluation(
+            args, outfolder, _log, GROUND_TRUTH, start_time))
+    if args.bm25_topk:
+        _log.info('- BM25TopKEvaluation')
+        evaluation_algorithms.append(BM25TopKEvaluation(
+            args, outfolder, _log, GROUND_TRUTH, start_time))
 
-    # start the cross validation
-    offset = 0
-    for f in range(FOLDS):
-
-        _log.info('------------------------------')
-        # define test set of connections indices
-        if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
-            # choose the test needs for the fold and mask all connections of them to other needs
-            _log.info('Fold %d, fold size %d needs (out of %d)' % (f, need_fold_size, len(needs)))
-            test_needs = needs[offset:offset+need_fold_size]
-            test_tensor = mask_need_connections(input_tensor, test_needs)
-            idx_test = need_connection_indices(input_tensor.getNeedIndices(), test_needs)
-            offset += need_fold_size
-        else:
-            # choose test connections to mask independently of needs
-            _log.info('Fold %d, fold size %d connection indices (out of %d)' % (f, connection_fold_size,
-                                                                                len(connections[0])))
-            idx_test = (connections[0][offset:offset+connection_fold_size],
-                        connections[1][offset:offset+connection_fold_size])
-            test_tensor = mask_idx_connections(input_tensor, idx_test)
-
-            offset += connection_fold_size
-            test_needs = needs
-        _log.info('------------------------------')
+    # build the LSH candidate index once, the attributes of the needs do not change between the folds
+    if args.lsh:
+        lsh = MinHashLSH(GROUND_TRUTH, int(args.lsh[0]), int(args.lsh[1]), np.random.randint(np.iinfo(np.int32).max))
+        _log.info('Use MinHash LSH candidates with %d bands of %d rows (biggest bucket: %d needs)' %
+                  (lsh.bands, lsh.rows, lsh.max_bucket_size()))
+        for algorithm in evaluation_algorithms:
+            algorithm.set_lsh(lsh)
 
-        # evaluate the algorithms
+    # share the RESCAL factorizations and scores and the cosine similar needs of a fold between the algorithms
+    fold_cache = FoldCache(_log)
+    for algorithm in evaluation_algorithms:
+        algorithm.set_fold_cache(fold_cache)
+
+    # create the test data of a fold (FoldContext), the results of the fold cache are only kept for this fold
+    def create_fold(f):
+        fold = cross_validation_folds.create_fold(f)
+        fold_cache.start_fold(fold)
+        return fold
+
+    # evaluate a fold and write its checkpoint (after the artefacts of the fold if they are written in the background)
+    def evaluate_checkpointed_fold(f):
+        fold_results = evaluate_fold_results(evaluation_algorithms, create_fold(f))
+        write = writer.submit if writer else (lambda function, *arguments: function(*arguments))
+        if args.checkpointfactors:
+            write(write_fold_factors, checkpoints, f, fold_cache.results('RESCAL factorization'))
+        write(write_fold_checkpoint, checkpoints, f, fold_results)
+        return fold_results
+
+    # load the results of the folds that were completed before the run was resumed
+    completed = {}
+    if args.resume:
+        for f in range(FOLDS):
+            fold_results = read_fold_checkpoint(checkpoints, f)
+            if fold_results is not None:
+                completed[f] = fold_results
+        _log.info('Resume the cross validation, %d of %d folds are already completed' % (len(completed), FOLDS))
+    missing_folds = [f for f in range(FOLDS) if f not in completed]
+
+    # start the worker processes for a parallel cross validation before the background writer thread is started,
+    # the workers write their fold artefacts synchronously
+    pool = None
+    writer = None
+    if args.workers > 1 and len(missing_folds) > 0:
+        _log.info('Evaluate the folds in %d worker processes' % args.workers)
+        try:
+            import threadpoolctl
+        except ImportError:
+            _log.warning('threadpoolctl is not installed, set OMP_NUM_THREADS (or similar) to limit the BLAS threads '
+                         'of the worker processes')
+        _cross_validation = evaluate_checkpointed_fold
+        pool = fold_worker_pool(args.workers, args.blasthreads)
+
+    # write the statistics files in the background so the next fold can be computed in the meantime
+    if args.statistics and args.writequeue > 0:
+        writer = ArtefactWriter(args.writequeue, args.writebuffer << 20, _log)
         for algorithm in evaluation_algorithms:
-            algorithm.evaluate_fold(test_tensor.copy(), test_needs, idx_test)
+            algorithm.set_artefact_writer(writer)
+
+    # start the cross validation, the results of the folds are merged into the algorithms in fold order
+    if pool:
+        evaluated_folds = pool.imap(evaluate_worker_fold, missing_folds)
+    else:
+        evaluated_folds = (evaluate_checkpointed_fold(f) for f in missing_folds)
+    for f in range(FOLDS):
+        fold_results = completed[f] if f in completed else next(evaluated_folds)
+        for algorithm, results in zip(evaluation_algorithms, fold_results):
+            algorithm.merge_fold_results(results)
         # end of fold loop
+    if pool:
+        pool.close()
+        pool.join()
 
     # evaluation ended, print the summary
     _log.info('====================================================')
@@ -318,8 +681,6 @@ if __name__ == '__main__':
         algorithm.finish_evaluation()
         _log.info('----------------------------------------------------')
 
-
-
-
-
-
+    # wait until all statistics files are written
+    if writer:
+        writer.close()
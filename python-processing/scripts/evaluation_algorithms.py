@@ -1,12 +1,15 @@
 import numpy as np
 import sklearn.metrics as m
-from tools.cosine_link_prediction import cosinus_link_prediciton
+from scipy.sparse import csr_matrix
+from tools.bm25 import BM25Index
+from tools.cosine_link_prediction import cosine_similar_needs, predict_cosine_connections
 from tools.evaluation_utils import EvaluationReport, NeedEvaluationDetailDict, get_optimal_threshold, \
-    write_ROC_curve_file, write_precision_recall_curve_file
-from tools.graph_utils import create_gexf_graph
-from tools.tensor_utils import SparseTensor, matrix_to_array, execute_rescal, predict_rescal_connections_by_threshold, \
-    read_input_tensor, extend_next_hop_transitive_connections, predict_rescal_connections_array, \
-    predict_rescal_connections_by_need_similarity, similarity_ranking
+    write_ROC_curve_file, write_precision_recall_curve_file, ScoreCurve, ThresholdEvaluationReports, threshold_list
+from tools.graph_utils import write_gexf_graph_file
+from tools.minhash_lsh import candidate_recall
+from tools.tensor_utils import SparseTensor, matrix_to_array, execute_rescal, read_input_tensor, \
+    extend_next_hop_transitive_connections, predict_rescal_connections_array, \
+    similarity_ranking, offer_want_pair_indices, threshold_prediction, pair_scores, subset_tensor
 
 __author__ = 'hfriedrich'
 
@@ -16,6 +19,14 @@ __author__ = 'hfriedrich'
 # ========================================================================================
 class EvaluationAlgorithm:
 
+    # attributes with lists of per fold values, they are part of the per fold results (see fold_results()) together
+    # with the EvaluationReport and NeedEvaluationDetailDict attributes
+    FOLD_RESULT_LISTS = ['AUC_test', 'lsh_recall']
+
+    # True if the algorithm only predicts connections of offer/want pairs, only then the left out pairs of an
+    # evaluation of offer/want pairs are counted as true negatives (see set_excluded_pairs())
+    OFFER_WANT_PREDICTIONS = False
+
     def __init__(self, args, output_folder, logger, input_tensor, start_time):
         self.init(args, output_folder, logger, input_tensor, start_time)
 
@@ -26,15 +37,198 @@ class EvaluationAlgorithm:
         self.report = EvaluationReport(logger, args.fbeta)
         self.ground_truth = input_tensor.copy()
         self.start_time = start_time
+        self.lsh = None
+        self.writer = None
+        self.cache = None
 
-    # call this method in the loop at each fold
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
+    # call this method in the loop at each fold with the FoldContext of the fold (see tools/evaluation_utils.py)
+    def evaluate_fold(self, fold):
         raise NotImplementedError("not implemented")
 
     # call this method at the end of the evaluation
     def finish_evaluation(self):
         raise NotImplementedError("not implemented")
 
+    # start collecting the per fold results of a single fold (e.g. in a copy of the algorithm in a worker process):
+    # reset all collected results and set the excluded test pairs of the fold (FoldContext) for algorithms that only
+    # predict offer/want pairs
+    def start_fold_results(self, fold):
+        for name, value in list(vars(self).items()):
+            if isinstance(value, EvaluationReport):
+                setattr(self, name, EvaluationReport(self.logger, self.args.fbeta))
+            elif isinstance(value, ThresholdEvaluationReports):
+                setattr(self, name, ThresholdEvaluationReports(self.logger, self.args.fbeta, value.thresholds))
+            elif isinstance(value, NeedEvaluationDetailDict):
+                setattr(self, name, NeedEvaluationDetailDict())
+            elif name in self.FOLD_RESULT_LISTS:
+                setattr(self, name, [])
+        if hasattr(self, 'foldNumber'):
+            self.foldNumber = fold.number
+        if fold.excluded is not None and self.OFFER_WANT_PREDICTIONS:
+            self.set_excluded_pairs(fold.test_needs, fold.excluded)
+
+    # return the per fold results collected since start_fold_results()
+    def fold_results(self):
+        results = {}
+        for name, value in vars(self).items():
+            if isinstance(value, (EvaluationReport, ThresholdEvaluationReports)):
+                results[name] = value.fold_results()
+            elif isinstance(value, NeedEvaluationDetailDict) or name in self.FOLD_RESULT_LISTS:
+                results[name] = value
+        return results
+
+    # add the per fold results of a fold (see fold_results()) that was evaluated separately, e.g. in a worker process
+    # or in an earlier run (checkpoint)
+    def merge_fold_results(self, results):
+        for name, value in results.items():
+            current = getattr(self, name)
+            if isinstance(current, (EvaluationReport, ThresholdEvaluationReports)):
+                current.add_fold_results(value)
+            elif isinstance(current, NeedEvaluationDetailDict):
+                current.merge(value)
+            else:
+                current.extend(value)
+        if hasattr(self, 'foldNumber'):
+            self.foldNumber += 1
+
+    # return the precision/recall and ROC curve builder for prediction scores, exact or histogram based depending on
+    # the evaluation parameters
+    def score_curve(self, y_true, scores):
+        curve = ScoreCurve(self.args.curvebins, self.args.curvebinning)
+        curve.add(y_true, scores)
+        return curve
+
+    # share the results of the expensive computations of a fold (RESCAL factorization and scores, cosine similar
+    # needs) with the other evaluation algorithms by a FoldCache (see tools/fold_cache.py)
+    def set_fold_cache(self, cache):
+        self.cache = cache
+
+    # return the result of compute(*args) from the fold cache, without a cache it is computed directly. The parameters
+    # must identify the result within the fold, including the kind of tensor and index pairs it is computed from.
+    def cached(self, algorithm, parameters, compute, *args):
+        if self.cache is None:
+            return compute(*args)
+        return self.cache.get(algorithm, parameters, compute, *args)
+
+    # return the complete rescal parameters (see execute_rescal()) with the default values of missing parameters
+    @staticmethod
+    def rescal_parameters(rank, useNeedTypeSlice=True, useConnectionSlice=True, init='nvecs', conv=1e-4,
+                          lambda_A=0, lambda_R=0, lambda_V=0):
+        return (rank, useNeedTypeSlice, useConnectionSlice, init, conv, lambda_A, lambda_R, lambda_V)
+
+    # execute the rescal algorithm with the parameters (see rescal_parameters()) on a tensor of the fold, return the
+    # factors A and R. The tensor kind names the tensor in the fold cache, e.g. 'fold' for the fold tensor or the name
+    # of a tensor derived from it.
+    def rescal_factors(self, tensor, tensor_kind, *parameters):
+        parameters = self.rescal_parameters(*parameters)
+        return self.cached('RESCAL factorization', (tensor_kind,) + parameters, execute_rescal, tensor, *parameters)
+
+    # return the rescal scores of index pairs, the factors are computed from the tensor with the rescal parameters.
+    # The pairs kind names the index pairs in the fold cache, e.g. 'test' for the test index pairs of the fold.
+    def rescal_scores(self, tensor, tensor_kind, indices, pairs_kind, *parameters):
+        parameters = self.rescal_parameters(*parameters)
+        A, R = self.rescal_factors(tensor, tensor_kind, *parameters)
+        return self.cached('RESCAL scores', (tensor_kind, pairs_kind) + parameters,
+                           predict_rescal_connections_array, A, R, indices)
+
+    # predict the connections of the test needs of a fold to all needs of the opposite type with a rescal score higher
+    # or equal to a threshold (as predict_rescal_connections_by_threshold()) as csr matrix. Only the thresholding is
+    # done for every threshold, the scores are shared.
+    def rescal_threshold_prediction(self, tensor, tensor_kind, fold, threshold, *parameters):
+        indices = offer_want_pair_indices(fold.offer_indices, fold.want_indices, fold.test_needs)
+        scores = self.rescal_scores(tensor, tensor_kind, indices, 'offer/want', *parameters)
+        return threshold_prediction(indices, scores, threshold, tensor.shape)
+
+    # return the rescal scores of the pairs of rescal_threshold_prediction() at the test index pairs of a fold (-inf
+    # for the other test pairs). The test predictions of any threshold are comparisons with these scores.
+    def rescal_test_scores(self, tensor, tensor_kind, fold, *parameters):
+        indices = offer_want_pair_indices(fold.offer_indices, fold.want_indices, fold.test_needs)
+        scores = self.rescal_scores(tensor, tensor_kind, indices, 'offer/want', *parameters)
+        return pair_scores(indices, scores, fold.idx_test, -np.inf, tensor.shape)
+
+    # predict connections with the cosine similarity algorithm (see cosinus_link_prediciton()). The similar needs of
+    # the test needs are shared with all predictions of the fold with the same or a lower threshold. If a bound is
+    # given the similar needs are computed (and cached) for it if it is higher than the threshold, e.g. the highest
+    # threshold of a threshold sweep. The prediction is computed on the tensor of the fold for its test needs.
+    def cosine_prediction(self, fold, threshold, transitive_threshold, weighted, approximate_candidates=None,
+                          bound=None):
+        if self.cache is None:
+            similar_needs = cosine_similar_needs(fold.tensor, fold.test_needs, threshold, weighted,
+                                                 approximate_candidates)
+        else:
+            bound = threshold if bound is None else max(threshold, bound)
+            parameters = (weighted, approximate_candidates is not None)
+            similar_needs = self.cache.get_bounded('cosine similar needs', parameters, bound, cosine_similar_needs,
+                                                   fold.tensor, fold.test_needs, bound, weighted,
+                                                   approximate_candidates)
+        return predict_cosine_connections(fold.tensor, fold.test_needs, similar_needs, threshold,
+                                          transitive_threshold)
+
+    # write the evaluation artefacts (curve files, statistic details, graphs) in the background with an
+    # ArtefactWriter (see tools/artefact_writer.py) instead of synchronously
+    def set_artefact_writer(self, writer):
+        self.writer = writer
+
+    # write an artefact by calling function(*args), in the background if an artefact writer is set. The arguments
+    # must not be changed afterwards.
+    def write_artefact(self, function, *args):
+        if self.writer:
+            self.writer.submit(function, *args)
+        else:
+            function(*args)
+
+    # write the statistical need detail data to a folder, one file per tested need or one consolidated columnar file
+    # for all needs depending on the evaluation parameters
+    def output_statistic_details(self, folder, printThresholds=False):
+        if self.args.statistics_format == 'columnar':
+            self.write_artefact(self.evalDetails.output_consolidated_statistic_details,
+                                folder, self.ground_truth.getHeaders(), self.args.fbeta)
+        else:
+            self.write_artefact(self.evalDetails.output_statistic_details,
+                                folder, self.ground_truth.getHeaders(), self.args.fbeta, printThresholds)
+
+    # write the gexf graph of the ground truth including the statistical need detail data to a folder
+    def output_graph(self, folder):
+        self.write_artefact(write_gexf_graph_file, folder + "/graph.gexf", self.ground_truth, self.evalDetails)
+
+    # set the number of test pairs of each test need that are not evaluated in the next fold because only offer/want
+    # pairs are tested. These pairs are counted as true negatives in the reports and statistical detail data so the
+    # measures are comparable to an evaluation of all pairs. This is only valid for algorithms that never predict
+    # other pairs (OFFER_WANT_PREDICTIONS).
+    def set_excluded_pairs(self, test_needs, counts):
+        total = int(np.sum(counts))
+        for report in vars(self).values():
+            if isinstance(report, (EvaluationReport, ThresholdEvaluationReports)):
+                report.set_excluded_true_negatives(total)
+        if self.args.statistics and hasattr(self, 'evalDetails'):
+            self.evalDetails.add_true_negative_counts(test_needs, counts)
+
+    # use approximate MinHash LSH candidates (see tools/minhash_lsh.py). Algorithms that support them additionally
+    # report their predictions restricted to the candidate pairs and the recall of the candidates compared to their
+    # exhaustive prediction.
+    def set_lsh(self, lsh):
+        self.lsh = lsh
+        self.lsh_report = EvaluationReport(self.logger, self.args.fbeta)
+        self.lsh_recall = []
+
+    def add_lsh_evaluation_data(self, fold, exhaustive_pred, lsh_pred):
+        y_true = fold.y_true
+        mask = self.lsh.candidate_mask(fold.idx_test)
+        recall = candidate_recall(mask, exhaustive_pred)
+        self.lsh_recall.append(recall)
+        self.logger.info('LSH candidates: %d of %d test index pairs' % (np.count_nonzero(mask), len(mask)))
+        self.logger.info('LSH candidate recall (exhaustive prediction): %f' % recall)
+        self.logger.info('LSH candidate recall (ground truth connections): %f' % candidate_recall(mask, y_true))
+        self.logger.info('With LSH candidates (%d bands, %d rows):' % (self.lsh.bands, self.lsh.rows))
+        self.lsh_report.add_evaluation_data(y_true, lsh_pred)
+
+    def lsh_summary(self):
+        if self.lsh:
+            recall = np.array(self.lsh_recall)
+            self.logger.info('With LSH candidates (%d bands, %d rows):' % (self.lsh.bands, self.lsh.rows))
+            self.logger.info('LSH Candidate Recall Mean / Std: %f / %f' % (recall.mean(), recall.std()))
+            self.lsh_report.summary()
+
 # ========================================================================================
 # Implementation of evaluation of RESCAL algorithm
 # ========================================================================================
@@ -46,38 +240,42 @@ class EvaluationAlgorithm:
 # ========================================================================================
 class RescalEvaluation(EvaluationAlgorithm):
 
+    OFFER_WANT_PREDICTIONS = True
+
     def __init__(self, args, output_folder, logger, ground_truth, start_time):
         self.init(args, output_folder, logger, ground_truth, start_time)
         self.rank = int(args.rescal[0])
-        self.threshold = float(args.rescal[1])
+        self.thresholds = threshold_list(args.rescal[1])
+        self.report = ThresholdEvaluationReports(logger, args.fbeta, self.thresholds)
         self.evalDetails = NeedEvaluationDetailDict()
         self.AUC_test = []
         self.foldNumber = 0
-        self.offers = ground_truth.getOfferIndices()
-        self.wants = ground_truth.getWantIndices()
 
-    def log1(self):
-        self.logger.info('For RESCAL prediction with threshold %f:' % self.threshold)
+    def log1(self, threshold):
+        self.logger.info('For RESCAL prediction with threshold %f:' % threshold)
 
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
+    def evaluate_fold(self, fold):
         # set transitive connections before execution
+        test_tensor = fold.tensor
+        tensor_kind = 'fold'
         if (self.args.rescal[3] == 'True'):
             self.logger.info('extend connections transitively to the next need for RESCAL learning')
             test_tensor = extend_next_hop_transitive_connections(test_tensor)
+            tensor_kind = 'transitive'
 
         # execute the rescal algorithm
         useNeedTypeSlice = (self.args.rescal[2] == 'True')
-        A, R = execute_rescal(
-            test_tensor, self.rank, useNeedTypeSlice, init=self.args.rescal[4],
-            conv=float(self.args.rescal[5]), lambda_A=float(self.args.rescal[6]),
-            lambda_R=float(self.args.rescal[7]), lambda_V=float(self.args.rescal[8]))
+        parameters = (self.rank, useNeedTypeSlice, True, self.args.rescal[4], float(self.args.rescal[5]),
+                      float(self.args.rescal[6]), float(self.args.rescal[7]), float(self.args.rescal[8]))
+        self.rescal_factors(test_tensor, tensor_kind, *parameters)
 
         # evaluate the predictions
         self.logger.info('start predict connections ...')
-        prediction = np.round_(predict_rescal_connections_array(A, R, idx_test), decimals=5)
+        prediction = np.round_(self.rescal_scores(test_tensor, tensor_kind, fold.idx_test, 'test', *parameters),
+                               decimals=5)
         self.logger.info('stop predict connections')
-        precision, recall, threshold = m.precision_recall_curve(
-            self.ground_truth.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), prediction)
+        curve = self.score_curve(fold.y_true, prediction)
+        precision, recall, threshold = curve.precision_recall_curve()
         optimal_threshold = get_optimal_threshold(recall, precision, threshold, self.args.fbeta)
         self.logger.info('optimal RESCAL threshold would be ' + str(optimal_threshold) +
                   ' (for maximum F' + str(self.args.fbeta) + '-score)')
@@ -85,38 +283,40 @@ class RescalEvaluation(EvaluationAlgorithm):
         self.AUC_test.append(auc)
         self.logger.info('AUC test: ' + str(auc))
 
-        # use a fixed threshold to compute several measures
-        self.log1()
-        P_bin = predict_rescal_connections_by_threshold(A, R, self.threshold, self.offers, self.wants, test_needs)
-        binary_pred = matrix_to_array(P_bin, idx_test)
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test), binary_pred)
+        # use fixed thresholds to compute several measures, the predictions of all thresholds are computed from the
+        # same scores. The LSH evaluation and the statistics use the first threshold.
+        test_scores = self.rescal_test_scores(test_tensor, tensor_kind, fold, *parameters)
+        for i in range(len(self.thresholds)):
+            self.log1(self.thresholds[i])
+            self.report[i].add_evaluation_data(fold.y_true, (test_scores >= self.thresholds[i]).astype(int))
+        binary_pred = (test_scores >= self.thresholds[0]).astype(int)
+        if self.lsh:
+            # only the LSH candidate pairs of the test needs are scored
+            lsh_indices = self.lsh.candidate_pairs(fold.test_needs)
+            lsh_scores = self.rescal_scores(test_tensor, tensor_kind, lsh_indices, 'lsh', *parameters)
+            lsh_scores = pair_scores(lsh_indices, lsh_scores, fold.idx_test, -np.inf, test_tensor.shape)
+            self.add_lsh_evaluation_data(fold, binary_pred, (lsh_scores >= self.thresholds[0]).astype(int))
         if self.args.statistics:
-            write_precision_recall_curve_file(
+            self.write_artefact(
+                write_precision_recall_curve_file,
                 self.output_folder + "/statistics/rescal_" + self.start_time,
                 "precision_recall_curve_fold%d.csv" % self.foldNumber, precision, recall, threshold)
-            TP, FP, threshold = m.roc_curve(self.ground_truth.getArrayFromSliceMatrix(
-                SparseTensor.CONNECTION_SLICE, idx_test), prediction)
-            write_ROC_curve_file(self.output_folder + "/statistics/rescal_" + self.start_time,
-                                 "ROC_curve_fold%d.csv" % self.foldNumber, TP, FP, threshold)
-            self.evalDetails.add_statistic_details(self.ground_truth.getSliceMatrix(
-                SparseTensor.CONNECTION_SLICE), P_bin, idx_test, prediction)
+            TP, FP, threshold = curve.roc_curve()
+            self.write_artefact(write_ROC_curve_file, self.output_folder + "/statistics/rescal_" + self.start_time,
+                                "ROC_curve_fold%d.csv" % self.foldNumber, TP, FP, threshold)
+            self.evalDetails.add_statistic_details(fold.y_true, binary_pred, fold.idx_test, prediction)
         self.foldNumber += 1
 
     def finish_evaluation(self):
         self.AUC_test = np.array(self.AUC_test)
         self.logger.info('AUC-PR Test Mean / Std: %f / %f' % (self.AUC_test.mean(), self.AUC_test.std()))
         self.logger.info('----------------------------------------------------')
-        self.log1()
-        self.report.summary()
+        self.report.summary(self.log1)
+        self.lsh_summary()
         if self.args.statistics:
-            self.evalDetails.output_statistic_details(
-                self.output_folder + "/statistics/rescal_" + self.start_time,
-                self.ground_truth.getHeaders(), self.args.fbeta, True)
-            gexf = create_gexf_graph(self.ground_truth, self.evalDetails)
-            output_file = open(self.output_folder + "/statistics/rescal_" + self.start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            self.output_statistic_details(
+                self.output_folder + "/statistics/rescal_" + self.start_time, True)
+            self.output_graph(self.output_folder + "/statistics/rescal_" + self.start_time)
 
 # ========================================================================================
 # Implementation of evaluation of RESCAL similarity algorithm
@@ -129,58 +329,58 @@ class RescalEvaluation(EvaluationAlgorithm):
 # ========================================================================================
 class RescalSimilarityEvaluation(EvaluationAlgorithm):
 
+    OFFER_WANT_PREDICTIONS = True
+
     def __init__(self, args, output_folder, logger, ground_truth, start_time):
         self.init(args, output_folder, logger, ground_truth, start_time)
         self.rank = int(args.rescalsim[0])
-        self.threshold = float(args.rescalsim[1])
+        self.thresholds = threshold_list(args.rescalsim[1])
+        self.report = ThresholdEvaluationReports(logger, args.fbeta, self.thresholds)
         self.evalDetails = NeedEvaluationDetailDict()
-        self.offers = ground_truth.getOfferIndices()
-        self.wants = ground_truth.getWantIndices()
         self.foldNumber = 0
 
-    def log1(self):
-        self.logger.info('For RESCAL prediction based on need similarity with threshold: %f' % self.threshold)
+    def log1(self, threshold):
+        self.logger.info('For RESCAL prediction based on need similarity with threshold: %f' % threshold)
 
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
+    def evaluate_fold(self, fold):
 
         # execute the rescal algorithm
         useNeedTypeSlice = (self.args.rescalsim[2] == 'True')
         useConnectionSlice = (self.args.rescalsim[3] == 'True')
-        A, R = execute_rescal(test_tensor, self.rank, useNeedTypeSlice, useConnectionSlice)
-
-        # use the most similar needs per need to predict connections
-        self.log1()
-        P_bin = predict_rescal_connections_by_need_similarity(A, self.threshold, self.offers, self.wants, test_needs)
-        binary_pred = matrix_to_array(P_bin, idx_test)
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test), binary_pred)
-
+        A, R = self.rescal_factors(fold.tensor, 'fold', self.rank, useNeedTypeSlice, useConnectionSlice)
+
+        # use the most similar needs per need to predict connections (see
+        # predict_rescal_connections_by_need_similarity()), the predictions of all thresholds are computed from the
+        # same need distances
+        S = similarity_ranking(A)
+        indices = offer_want_pair_indices(fold.offer_indices, fold.want_indices, fold.test_needs)
+        test_distances = pair_scores(indices, S[indices], fold.idx_test, np.inf, S.shape)
+        for i in range(len(self.thresholds)):
+            self.log1(self.thresholds[i])
+            self.report[i].add_evaluation_data(fold.y_true, (test_distances < self.thresholds[i]).astype(int))
+
+        # the statistics use the first threshold
         if self.args.statistics:
-            S = similarity_ranking(A)
-            y_prop = [1.0 - i for i in np.nan_to_num(S[idx_test])]
-            precision, recall, threshold = m.precision_recall_curve(
-                self.ground_truth.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), y_prop)
-            write_precision_recall_curve_file(
+            y_prop = [1.0 - i for i in np.nan_to_num(S[fold.idx_test])]
+            curve = self.score_curve(fold.y_true, y_prop)
+            precision, recall, threshold = curve.precision_recall_curve()
+            self.write_artefact(
+                write_precision_recall_curve_file,
                 self.output_folder + "/statistics/rescalsim_" + self.start_time,
                 "precision_recall_curve_fold%d.csv" % self.foldNumber, precision, recall, threshold)
-            TP, FP, threshold = m.roc_curve(self.ground_truth.getArrayFromSliceMatrix(
-                    SparseTensor.CONNECTION_SLICE, idx_test), y_prop)
-            write_ROC_curve_file(self.output_folder + "/statistics/rescalsim_" + self.start_time,
-                                 "ROC_curve_fold%d.csv" % self.foldNumber, TP, FP, threshold)
-            self.evalDetails.add_statistic_details(self.ground_truth.getSliceMatrix(
-                SparseTensor.CONNECTION_SLICE), P_bin, idx_test)
+            TP, FP, threshold = curve.roc_curve()
+            self.write_artefact(write_ROC_curve_file, self.output_folder + "/statistics/rescalsim_" + self.start_time,
+                                "ROC_curve_fold%d.csv" % self.foldNumber, TP, FP, threshold)
+            self.evalDetails.add_statistic_details(fold.y_true, (test_distances < self.thresholds[0]).astype(int),
+                                                   fold.idx_test)
+        self.foldNumber += 1
 
     def finish_evaluation(self):
-        self.log1()
-        self.report.summary()
+        self.report.summary(self.log1)
         if self.args.statistics:
-            self.evalDetails.output_statistic_details(
-                self.output_folder + "/statistics/rescalsim_" + self.start_time,
-                self.ground_truth.getHeaders(), self.args.fbeta)
-            gexf = create_gexf_graph(self.ground_truth, self.evalDetails)
-            output_file = open(self.output_folder + "/statistics/rescalsim_" + self.start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            self.output_statistic_details(
+                self.output_folder + "/statistics/rescalsim_" + self.start_time)
+            self.output_graph(self.output_folder + "/statistics/rescalsim_" + self.start_time)
 
 
 # ========================================================================================
@@ -192,69 +392,183 @@ class RescalSimilarityEvaluation(EvaluationAlgorithm):
 # ========================================================================================
 class CosineEvaluation(EvaluationAlgorithm):
 
+    OFFER_WANT_PREDICTIONS = True
+
     def __init__(self, args, output_folder, logger, ground_truth, start_time, weighted):
         self.init(args, output_folder, logger, ground_truth, start_time)
         self.weighted = weighted
-        self.threshold = float(args.cosine_weigthed[0]) if weighted else float(args.cosine[0])
+        self.thresholds = threshold_list(args.cosine_weigthed[0] if weighted else args.cosine[0])
         self.transitive_threshold = float(args.cosine_weigthed[1]) if weighted else float(args.cosine[1])
+        self.report = ThresholdEvaluationReports(logger, args.fbeta, self.thresholds)
         self.evalDetails = NeedEvaluationDetailDict()
 
-    def logEvaluationLine(self):
+    def logEvaluationLine(self, threshold):
         str = ""
         if self.weighted:
             str = " weighted"
         self.logger.info('For prediction of%s cosine similarity between needs with thresholds %f, %f:' %
-                         (str, self.threshold, self.transitive_threshold))
-
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
-        self.logEvaluationLine()
-        binary_pred = cosinus_link_prediciton(test_tensor, test_needs, self.threshold,
-                                              self.transitive_threshold, self.weighted)
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test), matrix_to_array(binary_pred, idx_test))
+                         (str, threshold, self.transitive_threshold))
+
+    def evaluate_fold(self, fold):
+        # the similar needs are computed once for the highest threshold and shared by the predictions of all
+        # thresholds. The LSH evaluation and the statistics use the first threshold.
+        for i in range(len(self.thresholds)):
+            self.logEvaluationLine(self.thresholds[i])
+            pred = self.cosine_prediction(fold, self.thresholds[i], self.transitive_threshold, self.weighted,
+                                          bound=max(self.thresholds))
+            self.report[i].add_evaluation_data(fold.y_true, matrix_to_array(pred, fold.idx_test))
+            if i == 0:
+                binary_pred = pred
+        if self.lsh:
+            lsh_pred = self.cosine_prediction(fold, self.thresholds[0], self.transitive_threshold, self.weighted,
+                                              self.lsh.candidate_dict(fold.test_needs))
+            self.add_lsh_evaluation_data(fold, matrix_to_array(binary_pred, fold.idx_test),
+                                         matrix_to_array(lsh_pred, fold.idx_test))
         if self.args.statistics:
-            self.evalDetails.add_statistic_details(
-                self.ground_truth.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
-                binary_pred, idx_test)
+            self.evalDetails.add_statistic_details(fold.y_true, matrix_to_array(binary_pred, fold.idx_test),
+                                                   fold.idx_test)
 
     def finish_evaluation(self):
-        self.logEvaluationLine()
-        self.report.summary()
+        self.report.summary(self.logEvaluationLine)
+        self.lsh_summary()
         if self.args.statistics:
             folder = "/statistics/cosine_"
             if self.weighted:
                 folder = "/statistics/wcosine_"
-            self.evalDetails.output_statistic_details(
-                self.output_folder + folder + self.start_time,
-                self.ground_truth.getHeaders(), self.args.fbeta)
-            gexf = create_gexf_graph(self.ground_truth, self.evalDetails)
-            output_file = open(self.output_folder + folder +
-                               self.start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            self.output_statistic_details(
+                self.output_folder + folder + self.start_time)
+            self.output_graph(self.output_folder + folder + self.start_time)
+
+# ========================================================================================
+# Implementation of evaluation of BM25 algorithm
+# ========================================================================================
+# Notes:
+# the BM25 statistics (idf values, document lengths) are computed from the attribute
+# slices, which do not change between the folds (only connections are masked). So they
+# are computed once from the ground truth and each fold only scores its test indices.
+# higher threshold means higher precision.
+# ========================================================================================
+class BM25Evaluation(EvaluationAlgorithm):
+
+    def __init__(self, args, output_folder, logger, ground_truth, start_time):
+        self.init(args, output_folder, logger, ground_truth, start_time)
+        self.threshold = float(args.bm25[0])
+        self.index = BM25Index(self.ground_truth, float(args.bm25[1]), float(args.bm25[2]))
+        self.evalDetails = NeedEvaluationDetailDict()
+        self.AUC_test = []
+        self.foldNumber = 0
+
+    def log1(self):
+        self.logger.info('For BM25 prediction with threshold %f:' % self.threshold)
+
+    def evaluate_fold(self, fold):
+        idx_test = fold.idx_test
+        self.logger.info('start predict connections ...')
+        prediction = self.index.scores(idx_test)
+        if self.threshold >= 0:
+            binary_pred = (prediction > self.threshold).astype(int)
+        else:
+            binary_pred = self.index.scores(idx_test, self.threshold)
+        self.logger.info('stop predict connections')
+        y_true = fold.y_true
+        curve = self.score_curve(y_true, prediction)
+        precision, recall, threshold = curve.precision_recall_curve()
+        optimal_threshold = get_optimal_threshold(recall, precision, threshold, self.args.fbeta)
+        self.logger.info('optimal BM25 threshold would be ' + str(optimal_threshold) +
+                         ' (for maximum F' + str(self.args.fbeta) + '-score)')
+        auc = m.auc(recall, precision)
+        self.AUC_test.append(auc)
+        self.logger.info('AUC test: ' + str(auc))
+
+        self.log1()
+        self.report.add_evaluation_data(y_true, binary_pred)
+        if self.lsh:
+            self.add_lsh_evaluation_data(fold, binary_pred, binary_pred * self.lsh.candidate_mask(idx_test))
+        if self.args.statistics:
+            self.write_artefact(
+                write_precision_recall_curve_file,
+                self.output_folder + "/statistics/bm25_" + self.start_time,
+                "precision_recall_curve_fold%d.csv" % self.foldNumber, precision, recall, threshold)
+            TP, FP, threshold = curve.roc_curve()
+            self.write_artefact(write_ROC_curve_file, self.output_folder + "/statistics/bm25_" + self.start_time,
+                                "ROC_curve_fold%d.csv" % self.foldNumber, TP, FP, threshold)
+            self.evalDetails.add_statistic_details(y_true, binary_pred, idx_test, prediction)
+        self.foldNumber += 1
+
+    def finish_evaluation(self):
+        self.AUC_test = np.array(self.AUC_test)
+        self.logger.info('AUC-PR Test Mean / Std: %f / %f' % (self.AUC_test.mean(), self.AUC_test.std()))
+        self.logger.info('----------------------------------------------------')
+        self.log1()
+        self.report.summary()
+        self.lsh_summary()
+        if self.args.statistics:
+            self.output_statistic_details(
+                self.output_folder + "/statistics/bm25_" + self.start_time, True)
+            self.output_graph(self.output_folder + "/statistics/bm25_" + self.start_time)
+
+# ========================================================================================
+# Implementation of evaluation of BM25 top k retrieval
+# ========================================================================================
+# Notes:
+# for each test need the k needs of the opposite type with the highest BM25 score are
+# predicted as connections. The BM25 index only depends on the attributes of the needs
+# so it is built once from the ground truth and reused in all folds.
+# ========================================================================================
+class BM25TopKEvaluation(EvaluationAlgorithm):
+
+    def __init__(self, args, output_folder, logger, ground_truth, start_time):
+        self.init(args, output_folder, logger, ground_truth, start_time)
+        self.k = int(args.bm25_topk[0])
+        self.index = BM25Index(self.ground_truth)
+        self.evalDetails = NeedEvaluationDetailDict()
+
+    def log1(self):
+        self.logger.info('For BM25 prediction of the top %d counterparts of each need:' % self.k)
+
+    def evaluate_fold(self, fold):
+        query_needs, result_needs, _ = self.index.batch_query(fold.test_needs, self.k)
+        P_bin = csr_matrix((np.ones(len(query_needs)), (query_needs, result_needs)), shape=self.ground_truth.shape)
+        binary_pred = matrix_to_array(P_bin, fold.idx_test)
+        self.log1()
+        self.report.add_evaluation_data(fold.y_true, binary_pred)
+        if self.args.statistics:
+            self.evalDetails.add_statistic_details(fold.y_true, binary_pred, fold.idx_test)
+
+    def finish_evaluation(self):
+        self.log1()
+        self.report.summary()
+        if self.args.statistics:
+            self.output_statistic_details(
+                self.output_folder + "/statistics/bm25topk_" + self.start_time)
+            self.output_graph(self.output_folder + "/statistics/bm25topk_" + self.start_time)
 
 # ========================================================================================
 # Implementation of evaluation of loading an external matrix file with predictions
 # ========================================================================================
 # Notes:
-# Matrix connection file has the same file format as connection slice of tensor
+# Matrix connection file has the same file format as connection slice of tensor. The file
+# is indexed by the entities of the input tensor, it is reduced to the entities of the
+# evaluation (entity_ids, see CrossValidationFolds) so it is indexed like the test pairs.
 # ========================================================================================
 class PredictionMatrixFileEvaluation(EvaluationAlgorithm):
 
-    def __init__(self, args, output_folder, logger, ground_truth, start_time):
+    def __init__(self, args, output_folder, logger, ground_truth, start_time, entity_ids):
         self.init(args, output_folder, logger, ground_truth, start_time)
         header_input = args.inputfolder + "/" + args.headers
-        self.file_prediction_tensor = read_input_tensor(
+        file_prediction_tensor = read_input_tensor(
             header_input, [args.prediction_matrix_file], [SparseTensor.CONNECTION_SLICE], True)
+        keep = np.zeros(file_prediction_tensor.shape[0], dtype=bool)
+        keep[entity_ids] = True
+        self.file_prediction_tensor, _ = subset_tensor(file_prediction_tensor, keep)
 
     def logEvaluationLine(self):
         self.logger.info('External file (' + self.args.prediction_matrix_file + ') predictions: ')
 
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
+    def evaluate_fold(self, fold):
         file_pred = self.file_prediction_tensor.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test);
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test), file_pred)
+            SparseTensor.CONNECTION_SLICE, fold.idx_test);
+        self.report.add_evaluation_data(fold.y_true, file_pred)
 
     def finish_evaluation(self):
         self.logEvaluationLine()
@@ -270,6 +584,8 @@ class PredictionMatrixFileEvaluation(EvaluationAlgorithm):
 # ======================================================================================
 class CombineCosineRescalEvaluation(EvaluationAlgorithm):
 
+    OFFER_WANT_PREDICTIONS = True
+
     def __init__(self, args, output_folder, logger, ground_truth, start_time):
         self.init(args, output_folder, logger, ground_truth, start_time)
         self.report2 = EvaluationReport(logger, args.fbeta)
@@ -282,17 +598,15 @@ class CombineCosineRescalEvaluation(EvaluationAlgorithm):
         self.logger.info('And second step for combined RESCAL prediction with parameters: %d, %f:'
                          % (int(self.args.cosine_rescal[0]), float(self.args.cosine_rescal[1])))
 
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
+    def evaluate_fold(self, fold):
         cosine_pred, rescal_pred = self.predict_combine_cosine_rescal(
-            test_tensor, test_needs, idx_test, int(self.args.cosine_rescal[0]),
+            fold, int(self.args.cosine_rescal[0]),
             float(self.args.cosine_rescal[1]), float(self.args.cosine_rescal[2]),
             bool(self.args.cosine_rescal[3]))
         self.log1()
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-                SparseTensor.CONNECTION_SLICE, idx_test), cosine_pred)
+        self.report.add_evaluation_data(fold.y_true, cosine_pred)
         self.log2()
-        self.report2.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE,idx_test), rescal_pred)
+        self.report2.add_evaluation_data(fold.y_true, rescal_pred)
 
     def finish_evaluation(self):
         self.log1()
@@ -301,24 +615,20 @@ class CombineCosineRescalEvaluation(EvaluationAlgorithm):
         self.report2.summary()
 
     # predict connections by combining the execution of algorithms
-    def predict_combine_cosine_rescal(self, input_tensor, test_needs, idx_test, rank,
-                                      rescal_threshold, cosine_threshold, useNeedTypeSlice):
-
-        wants = input_tensor.getWantIndices()
-        offers = input_tensor.getOfferIndices()
+    def predict_combine_cosine_rescal(self, fold, rank, rescal_threshold, cosine_threshold, useNeedTypeSlice):
 
         # execute the cosine algorithm first
-        binary_pred_cosine = cosinus_link_prediciton(input_tensor, test_needs, cosine_threshold, 0.0, False)
+        binary_pred_cosine = self.cosine_prediction(fold, cosine_threshold, 0.0, False)
 
         # use the connection prediction of the cosine algorithm as input for rescal
-        temp_tensor = input_tensor.copy()
+        temp_tensor = fold.tensor.view()
         temp_tensor.addSliceMatrix(binary_pred_cosine, SparseTensor.CONNECTION_SLICE)
-        A,R = execute_rescal(temp_tensor, rank)
-        P_bin = predict_rescal_connections_by_threshold(A, R, rescal_threshold, offers, wants, test_needs)
+        P_bin = self.rescal_threshold_prediction(temp_tensor, ('cosine prediction', cosine_threshold), fold,
+                                                 rescal_threshold, rank)
 
         # return both predictions the earlier cosine and the combined rescal
-        binary_pred_cosine = binary_pred_cosine[idx_test]
-        binary_pred_rescal = matrix_to_array(P_bin, idx_test)
+        binary_pred_cosine = matrix_to_array(binary_pred_cosine, fold.idx_test)
+        binary_pred_rescal = matrix_to_array(P_bin, fold.idx_test)
         return binary_pred_cosine, binary_pred_rescal
 
 
@@ -332,60 +642,62 @@ class CombineCosineRescalEvaluation(EvaluationAlgorithm):
 # ======================================================================================
 class IntersectionCosineRescalEvaluation(EvaluationAlgorithm):
 
+    OFFER_WANT_PREDICTIONS = True
+
     def __init__(self, args, output_folder, logger, ground_truth, start_time):
         self.init(args, output_folder, logger, ground_truth, start_time)
-        self.report2 = EvaluationReport(logger, args.fbeta)
-        self.report3 = EvaluationReport(logger, args.fbeta)
-
-    def log1(self):
-        self.logger.info('Intersection of predictions of cosine similarity and rescal algorithms: ')
-
-    def log2(self):
-        self.logger.info('For RESCAL prediction with threshold %f:' % float(self.args.intersection[1]))
-
-    def log3(self):
-        self.logger.info('For prediction of cosine similarity between needs with thresholds: %f:' %
-                  float(self.args.intersection[2]))
-
-    def evaluate_fold(self, test_tensor, test_needs, idx_test):
-        inter_pred, cosine_pred, rescal_pred = self.predict_intersect_cosine_rescal(
-            test_tensor, test_needs, idx_test, int(self.args.intersection[0]),
-            float(self.args.intersection[1]), float(self.args.intersection[2]),
+        self.rescal_thresholds = threshold_list(args.intersection[1])
+        self.cosine_thresholds = threshold_list(args.intersection[2])
+        self.report = ThresholdEvaluationReports(logger, args.fbeta, [(rescal_threshold, cosine_threshold)
+                                                                      for rescal_threshold in self.rescal_thresholds
+                                                                      for cosine_threshold in self.cosine_thresholds])
+        self.report2 = ThresholdEvaluationReports(logger, args.fbeta, self.rescal_thresholds)
+        self.report3 = ThresholdEvaluationReports(logger, args.fbeta, self.cosine_thresholds)
+
+    def log1(self, thresholds):
+        self.logger.info('Intersection of predictions of cosine similarity and rescal algorithms with thresholds '
+                         '%f, %f: ' % thresholds)
+
+    def log2(self, threshold):
+        self.logger.info('For RESCAL prediction with threshold %f:' % threshold)
+
+    def log3(self, threshold):
+        self.logger.info('For prediction of cosine similarity between needs with thresholds: %f:' % threshold)
+
+    def evaluate_fold(self, fold):
+        inter_preds, cosine_preds, rescal_preds = self.predict_intersect_cosine_rescal(
+            fold, int(self.args.intersection[0]), self.rescal_thresholds, self.cosine_thresholds,
             bool(self.args.intersection[3]))
-        self.log1()
-        self.report.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE, idx_test), inter_pred)
-        self.log2()
-        self.report2.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE,idx_test), rescal_pred)
-        self.log3()
-        self.report3.add_evaluation_data(self.ground_truth.getArrayFromSliceMatrix(
-            SparseTensor.CONNECTION_SLICE,idx_test), cosine_pred)
+        for i in range(len(self.report)):
+            self.log1(self.report.thresholds[i])
+            self.report[i].add_evaluation_data(fold.y_true, inter_preds[i])
+        for i in range(len(self.rescal_thresholds)):
+            self.log2(self.rescal_thresholds[i])
+            self.report2[i].add_evaluation_data(fold.y_true, rescal_preds[i])
+        for i in range(len(self.cosine_thresholds)):
+            self.log3(self.cosine_thresholds[i])
+            self.report3[i].add_evaluation_data(fold.y_true, cosine_preds[i])
 
     def finish_evaluation(self):
-        self.log1()
-        self.report.summary()
-        self.log2()
-        self.report2.summary()
-        self.log3()
-        self.report3.summary()
-
-    # predict connections by intersection of RESCAL and cosine results
-    def predict_intersect_cosine_rescal(self, input_tensor, test_needs, idx_test, rank,
-                                        rescal_threshold, cosine_threshold, useNeedTypeSlice):
+        self.report.summary(self.log1)
+        self.report2.summary(self.log2)
+        self.report3.summary(self.log3)
 
-        wants = input_tensor.getWantIndices()
-        offers = input_tensor.getOfferIndices()
+    # predict connections by intersection of RESCAL and cosine results for all combinations of the rescal and cosine
+    # thresholds. Return the lists of the intersection predictions (ordered by rescal threshold and cosine threshold),
+    # the cosine predictions and the rescal predictions.
+    def predict_intersect_cosine_rescal(self, fold, rank, rescal_thresholds, cosine_thresholds, useNeedTypeSlice):
 
         # execute the cosine algorithm
-        binary_pred_cosine = cosinus_link_prediciton(input_tensor, test_needs, cosine_threshold, 0.0, False)
+        binary_preds_cosine = [matrix_to_array(self.cosine_prediction(fold, threshold, 0.0, False,
+                                                                      bound=max(cosine_thresholds)), fold.idx_test)
+                               for threshold in cosine_thresholds]
 
         # execute the rescal algorithm
-        A,R = execute_rescal(input_tensor, rank)
-        P_bin = predict_rescal_connections_by_threshold(A, R, rescal_threshold, offers, wants, test_needs)
+        test_scores = self.rescal_test_scores(fold.tensor, 'fold', fold, rank)
+        binary_preds_rescal = [(test_scores >= threshold).astype(int) for threshold in rescal_thresholds]
 
         # return the intersection of the prediction of both algorithms
-        binary_pred_cosine = matrix_to_array(binary_pred_cosine, idx_test)
-        binary_pred_rescal = matrix_to_array(P_bin, idx_test)
-        binary_pred = [min(binary_pred_cosine[i], binary_pred_rescal[i]) for i in range(len(binary_pred_cosine))]
-        return binary_pred, binary_pred_cosine, binary_pred_rescal
+        binary_preds = [np.minimum(binary_pred_cosine, binary_pred_rescal) for binary_pred_rescal in binary_preds_rescal
+                        for binary_pred_cosine in binary_preds_cosine]
+        return binary_preds, binary_preds_cosine, binary_preds_rescal
@@ -24,7 +24,8 @@ def output_folder_config():
 
 def base_config():
     base_params = ['--lock-pid-dir', args.luigitmp, '--local-scheduler', '--gatehome', args.gatehome,
-            '--inputfolder', args.testdataset + '/data', '--connections', args.testdataset + '/connections.txt']
+            '--inputfolder', args.testdataset + '/data', '--connections', args.testdataset + '/connections.txt',
+            '--foldspec']
     if args.python:
         base_params.extend(['--python', args.python])
     if args.java:
@@ -62,12 +63,12 @@ def rank_eval():
                       (2000,[0.02, 0.025, 0.03])]
     for tuple in rank_threshold:
         rank = tuple[0]
-        for threshold in tuple[1]:
-            params = ['RESCALEvaluation'] + base_config() + \
-                     ['--outputfolder', output_folder_config() + '/results/rank'] + \
-                     ['--rank', str(rank), '--threshold', str(threshold)]  + \
-                     ['--tensorfolder', output_folder_config() + '/tensor']
-            luigi.run(params)
+        thresholds = ",".join([str(threshold) for threshold in tuple[1]])
+        params = ['RESCALEvaluation'] + base_config() + \
+                 ['--outputfolder', output_folder_config() + '/results/rank'] + \
+                 ['--rank', str(rank), '--threshold', thresholds]  + \
+                 ['--tensorfolder', output_folder_config() + '/tensor']
+        luigi.run(params)
 
 # evaluate the influence of stopwords on the algorithms. This test executes the preprocessing without filtering out
 #  any stopwords (here in this case the effect might not be that big since only the subject line of emails is used as
@@ -101,35 +102,27 @@ def content_slice_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--content', '--additionalslices', 'subject.mtx content.mtx'] + \
              ['--outputfolder', output_folder_config() + '/results/content'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_content']
-    luigi.run(params + RESCAL_DEFAULT_PARAMS)
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.02,0.03'])
 
 # evaluate the effect of adding the category slice to the RESCAL evaluation
 def category_slice_eval():
     params = ['CategoryEvaluation'] + base_config() + ['--allneeds', args.testdataset + '/allneeds.txt'] + \
              ['--outputfolder', output_folder_config() + '/results/category'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_category']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.04'])
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.02,0.03,0.04'])
 
     params = ['CategoryCosineEvaluation'] + base_config() + ['--allneeds', args.testdataset + '/allneeds.txt'] + \
              ['--outputfolder', output_folder_config() + '/results/category'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_category']
-    luigi.run(params + COSINE_DEFAULT_PARAMS)
-    luigi.run(params + ['--costhreshold', '0.45', '--costransthreshold', '0.0', '--wcosthreshold', '0.45',
-                        '--wcostransthreshold', '0.0'])
-    luigi.run(params + ['--costhreshold', '0.4', '--costransthreshold', '0.0', '--wcosthreshold', '0.4',
-                        '--wcostransthreshold', '0.0'])
+    luigi.run(params + ['--costhreshold', '0.5,0.45,0.4', '--costransthreshold', '0.0',
+                        '--wcosthreshold', '0.6,0.45,0.4', '--wcostransthreshold', '0.0'])
 
 # evaluate the effect of adding the category slice to the RESCAL evaluation
 def keyword_slice_eval():
     params = ['KeywordEvaluation'] + base_config() + \
              ['--outputfolder', output_folder_config() + '/results/keyword'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_keyword']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.04'])
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.02,0.03,0.04'])
 
 # evaluate the effect of adding the needtype slice to the RESCAL evaluation
 def needtype_slice_eval():
@@ -141,16 +134,13 @@ def needtype_slice_eval():
 def maskrandom_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--outputfolder', output_folder_config() + '/results/maskrandom'] + \
              ['--maskrandom'] + ['--tensorfolder', output_folder_config() + '/tensor']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.1'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.2'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.3'])
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.1,0.2,0.3'])
 
 # evaluate the effect of adding transitive connections to needs only one edge away (connects needs of the same type)
 def transitive_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--outputfolder', output_folder_config() + '/results/transitive'] + \
              ['--tensorfolder', output_folder_config() + '/tensor', ]  + ['--transitive'] + ['--maxhubsize', '10']
-    luigi.run(params + RESCAL_DEFAULT_PARAMS)
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.02,0.03'])
 
 # evaluate the influence of the number of input connections (chosen randomly) to learn from on the RESCAL algorithm
 def connection_rescalsim_eval():
@@ -168,22 +158,22 @@ def connections_rescal_eval():
                             (5,[0.02, 0.03]),
                             (10,[0.02, 0.03])]
     for tuple in connection_threshold:
-        for threshold in tuple[1]:
-            con = tuple[0]
-            params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', str(threshold)] + \
-                     ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
-                     ['--tensorfolder', output_folder_config() + '/tensor']
-    luigi.run(params)
+        con = tuple[0]
+        thresholds = ",".join([str(threshold) for threshold in tuple[1]])
+        params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', thresholds] + \
+                 ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
+                 ['--tensorfolder', output_folder_config() + '/tensor']
+        luigi.run(params)
     connection_threshold = [(10,[0.015, 0.02]),
                             (20,[0.015, 0.02]),
                             (50,[0.015, 0.02])]
     for tuple in connection_threshold:
-        for threshold in tuple[1]:
-            con = tuple[0]
-            params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', str(threshold)] + \
-                     ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
-                     ['--tensorfolder', output_folder_config() + '/tensor'] + ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0']
-            luigi.run(params)
+        con = tuple[0]
+        thresholds = ",".join([str(threshold) for threshold in tuple[1]])
+        params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', thresholds] + \
+                 ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
+                 ['--tensorfolder', output_folder_config() + '/tensor'] + ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0']
+        luigi.run(params)
 
 def num_needs_eval():
     params = ['AllEvaluation'] + base_config() + \
@@ -220,10 +210,7 @@ def intersection_eval():
     params = ['IntersectionEvaluation'] + base_config() + \
                  ['--outputfolder', output_folder_config() + '/results/intersection'] + \
                  ['--tensorfolder', output_folder_config() + '/tensor']
-    luigi.run(params + ['--rank',  '500', '--rescalthreshold', '0.01', '--cosinethreshold', '0.5'])
-    luigi.run(params + ['--rank',  '500', '--rescalthreshold', '0.005', '--cosinethreshold', '0.5'])
-    luigi.run(params + ['--rank',  '500', '--rescalthreshold', '0.01', '--cosinethreshold', '0.6'])
-    luigi.run(params + ['--rank',  '500', '--rescalthreshold', '0.005', '--cosinethreshold', '0.6'])
+    luigi.run(params + ['--rank',  '500', '--rescalthreshold', '0.01,0.005', '--cosinethreshold', '0.5,0.6'])
 
 # evaluate different configurations of rescal (init, conv, lambda parameters)
 def rescal_configuration_eval():
@@ -269,13 +256,9 @@ def optimal_rescal_eval():
              ['--outputfolder', output_folder_config() + '/results/optimal'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_category']
 
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'] +
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.02,0.025'] +
               ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.025'] +
-              ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.015'] +
-              ['--lambdaA', '10.0', '--lambdaR', '10.0', '--lambdaV', '10.0'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'] +
+    luigi.run(params + ['--rank',  '500', '--threshold', '0.015,0.02'] +
               ['--lambdaA', '10.0', '--lambdaR', '10.0', '--lambdaV', '10.0'])
 
 
@@ -143,11 +143,17 @@ class BaseEvaluation(CreateTensor):
     outputfolder = luigi.Parameter(default=None)
     additionalslices = luigi.Parameter(default="subject.mtx")
     maxconnections = luigi.IntParameter(default=1000)
+    folds = luigi.IntParameter(default=10)
     maskrandom = luigi.BooleanParameter(default=False)
+    offerwantpairs = luigi.BooleanParameter(default=False)
     fbeta = luigi.FloatParameter(default=0.5)
     numneeds = luigi.IntParameter(default=10000)
     statistics = luigi.BooleanParameter(default=True)
+    statisticsformat = luigi.Parameter(default="files")
     maxhubsize = luigi.IntParameter(default=10000)
+    workers = luigi.IntParameter(default=1)
+    resume = luigi.BooleanParameter(default=False)
+    foldspec = luigi.BooleanParameter(default=False)
 
     def requires(self):
         return [CreateTensor(self.gatehome, self.jarfile,
@@ -159,6 +165,14 @@ class BaseEvaluation(CreateTensor):
     def getEvaluationFolder(self):
         return self.input()[0][0].path
 
+    # fold specification file of the tensor and the fold parameters, all evaluations with the same tensor and fold
+    # parameters use the same folds. If the tensor was created again the specification is rebuilt by the evaluation.
+    def getFoldSpecFile(self):
+        slices = "_".join([os.path.splitext(slice)[0] for slice in self.additionalslices.split()])
+        return os.path.join(self.getEvaluationFolder(), "folds", "folds_%s_%d_%d_%d_%d%s.npz" % (
+            slices, self.folds, self.numneeds, self.maxhubsize, self.maxconnections,
+            "_maskrandom" if self.maskrandom else ""))
+
     def output(self):
         return [luigi.LocalTarget(is_tmp=True)]
 
@@ -166,15 +180,24 @@ class BaseEvaluation(CreateTensor):
         params = " -inputfolder " + self.getEvaluationFolder()
         params += " -additional_slices " + self.additionalslices
         params += " -maxconnections " + str(self.maxconnections)
+        params += " -folds " + str(self.folds)
         params += " -fbeta " + str(self.fbeta)
         params += " -numneeds " + str(self.numneeds)
         params += " -maxhubsize " + str(self.maxhubsize)
+        params += " -workers " + str(self.workers)
         if (self.maskrandom):
             params += " -maskrandom "
+        if (self.offerwantpairs):
+            params += " -offerwantpairs "
+        if (self.foldspec):
+            params += " -foldspec " + self.getFoldSpecFile() + " -rebuildfoldspec "
         if (self.statistics):
             params += " -statistics "
+            params += " -statistics_format " + self.statisticsformat
         if (self.outputfolder):
             params += " -outputfolder " + self.outputfolder
+            if (self.resume):
+                params += " -resume "
         return params
 
     def run(self):
@@ -185,7 +208,8 @@ class BaseEvaluation(CreateTensor):
 class RESCALEvaluation(BaseEvaluation):
 
     rank = luigi.IntParameter(default=0)
-    threshold = luigi.FloatParameter(default=0.0)
+    # the thresholds can be comma separated lists that are evaluated from the same scores (e.g. "0.01,0.02,0.03")
+    threshold = luigi.Parameter(default="0.0")
     needtypeslice = luigi.BooleanParameter(default=False)
     transitive = luigi.BooleanParameter(default=False)
     init = luigi.Parameter(default='nvecs')
@@ -194,7 +218,7 @@ class RESCALEvaluation(BaseEvaluation):
     lambdaR = luigi.FloatParameter(default=0.0)
     lambdaV = luigi.FloatParameter(default=0.0)
     rank2 = luigi.IntParameter(default=0)
-    threshold2 = luigi.FloatParameter(default=0.0)
+    threshold2 = luigi.Parameter(default="0.0")
     connectionslice2 = luigi.BooleanParameter(default=False)
 
     def getParams(self):
@@ -213,10 +237,10 @@ class RESCALEvaluation(BaseEvaluation):
 class AllEvaluation(RESCALEvaluation):
 
     rank2 = luigi.IntParameter()
-    threshold2 = luigi.FloatParameter()
-    costhreshold = luigi.FloatParameter()
+    threshold2 = luigi.Parameter()
+    costhreshold = luigi.Parameter()
     costransthreshold = luigi.FloatParameter()
-    wcosthreshold = luigi.FloatParameter()
+    wcosthreshold = luigi.Parameter()
     wcostransthreshold = luigi.FloatParameter()
 
     def getParams(self):
@@ -228,9 +252,9 @@ class AllEvaluation(RESCALEvaluation):
 # Execute the evaluation for the cosine algorithm
 class CosineEvaluation(BaseEvaluation):
 
-    costhreshold = luigi.FloatParameter()
+    costhreshold = luigi.Parameter()
     costransthreshold = luigi.FloatParameter()
-    wcosthreshold = luigi.FloatParameter()
+    wcosthreshold = luigi.Parameter()
     wcostransthreshold = luigi.FloatParameter()
 
     def getParams(self):
@@ -257,8 +281,8 @@ class CombineCosineRescalEvaluation(BaseEvaluation):
 class IntersectionEvaluation(BaseEvaluation):
 
     rank = luigi.IntParameter()
-    rescalthreshold = luigi.FloatParameter()
-    cosinethreshold = luigi.FloatParameter()
+    rescalthreshold = luigi.Parameter()
+    cosinethreshold = luigi.Parameter()
     needtypeslice = luigi.BooleanParameter(default=False)
 
     def getParams(self):
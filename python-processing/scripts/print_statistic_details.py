@@ -0,0 +1,39 @@
+__author__ = 'hfriedrich'
+
+import sys
+import codecs
+import argparse
+
+from tools.evaluation_utils import read_statistic_details
+
+# Simple script to print the detail view of needs (TP, FN, FP need names) or the summary of all tested needs from a
+# consolidated statistic details file that is written by evaluate_link_prediction.py with the option
+# "-statistics_format columnar". The output is the same as the content of the per need files of the option
+# "-statistics_format files".
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='print statistic details of a link prediction evaluation')
+    parser.add_argument('-file', action="store", dest="file", required=True,
+                        help="consolidated statistic details file (statistic_details.npz)")
+    parser.add_argument('-needs', action="store", dest="needs", nargs="+",
+                        help="names of the needs to print the details for, if not specified print the summary of "
+                             "all tested needs")
+    parser.add_argument('-thresholds', action="store_true", dest="thresholds",
+                        help="print the scores of the classified pairs")
+    parser.add_argument('-fbeta', action="store", dest="fbeta", default=0.5,
+                        type=float, help="f-beta measure to print in the summary")
+    args = parser.parse_args()
+
+    details, headers = read_statistic_details(args.file)
+    out = codecs.getwriter('utf8')(getattr(sys.stdout, 'buffer', sys.stdout))
+    if args.needs:
+        needs = dict([(headers[need][6:], need) for need in details.getNeeds()])
+        for name in args.needs:
+            if name not in needs:
+                raise Exception('need was not tested: ' + name)
+            for line in details.needDetailLines(needs[name], headers, args.thresholds):
+                out.write(line + "\n")
+    else:
+        for need in details.getNeeds():
+            out.write(details.needSummaryLine(need, headers, args.fbeta))
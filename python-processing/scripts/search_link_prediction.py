@@ -0,0 +1,341 @@
+__author__ = 'hfriedrich'
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import copy
+import math
+import codecs
+import argparse
+import itertools
+
+import numpy as np
+from time import strftime
+from tools.fold_cache import FoldCache
+from scripts.evaluation_algorithms import CosineEvaluation, RescalEvaluation
+from scripts.evaluate_link_prediction import read_evaluation_tensor, load_fold_spec, CrossValidationFolds, \
+    evaluate_fold_results
+
+# return the cpu time (in seconds) used by this process and its finished child processes
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+# configuration of an algorithm in the search: the parameters of the algorithm option of evaluate_link_prediction.py
+# (e.g. the 9 parameters of "-rescal") and the evaluation algorithm that collects the results of the folds that were
+# evaluated for it. The threshold parameter of a configuration is a list of thresholds that are evaluated from the
+# same scores, the score of the configuration is the best mean f-score of its thresholds.
+class SearchConfiguration:
+
+    def __init__(self, name, parameters, args, output_folder, logger, ground_truth, start_time, cache):
+        self.name = name
+        self.parameters = parameters
+        algorithm_args = copy.copy(args)
+        if name == 'rescal':
+            algorithm_args.rescal = parameters
+            self.evaluation = RescalEvaluation(algorithm_args, output_folder, logger, ground_truth, start_time)
+        else:
+            weighted = (name == 'cosine_weighted')
+            setattr(algorithm_args, 'cosine_weigthed' if weighted else 'cosine', parameters)
+            self.evaluation = CosineEvaluation(algorithm_args, output_folder, logger, ground_truth, start_time,
+                                               weighted)
+        self.evaluation.set_fold_cache(cache)
+        self.folds = 0
+        self.cpu_seconds = 0.0
+
+    def __str__(self):
+        return "-%s %s" % (self.name, " ".join(self.parameters))
+
+    # evaluate a fold (FoldContext) and add its results
+    def evaluate_fold(self, fold):
+        start = cpu_time()
+        fold_results = evaluate_fold_results([self.evaluation], fold)
+        self.evaluation.merge_fold_results(fold_results[0])
+        self.cpu_seconds += cpu_time() - start
+        self.folds += 1
+
+    # return the index of the threshold with the best mean f-score and the mean f-score
+    def best_threshold(self):
+        fscores = [np.mean(report.fscore) for report in self.evaluation.report]
+        best = int(np.argmax(fscores))
+        return best, fscores[best]
+
+    def score(self):
+        return self.best_threshold()[1] if self.folds > 0 else -1.0
+
+    # return the measures of the best threshold: threshold, f-score mean and std, precision mean, recall mean and the
+    # mean AUC (None if the algorithm does not compute it)
+    def measures(self):
+        best, fscore = self.best_threshold()
+        report = self.evaluation.report[best]
+        auc = np.mean(self.evaluation.AUC_test) if len(getattr(self.evaluation, 'AUC_test', [])) > 0 else None
+        return (self.evaluation.report.thresholds[best], fscore, np.std(report.fscore), np.mean(report.precision),
+                np.mean(report.recall), auc)
+
+# return all configurations of the search space as (algorithm, parameters) tuples, the parameters are the parameters of
+# the algorithm options of evaluate_link_prediction.py
+def search_space(args):
+    configurations = []
+    if 'rescal' in args.algorithms:
+        thresholds = ",".join(args.rescal_thresholds)
+        for rank, lambda_value, init in itertools.product(args.ranks, args.lambdas, args.inits):
+            configurations.append(('rescal', [rank, thresholds, str(args.needtypeslice), 'False', init, args.conv,
+                                              lambda_value, lambda_value, lambda_value]))
+    for name in ['cosine', 'cosine_weighted']:
+        if name in args.algorithms:
+            thresholds = ",".join(args.cosine_thresholds)
+            for transitive_threshold in args.transitive_thresholds:
+                configurations.append((name, [thresholds, transitive_threshold]))
+    return configurations
+
+# Successive halving and Hyperband search over the configurations of the link prediction algorithms. A bracket of
+# successive halving evaluates n configurations on a small number of folds of the cross validation, keeps the best
+# 1/eta of them and evaluates these on eta times as many folds, until the configurations are evaluated on all folds (or
+# only one configuration is left). Hyperband runs several brackets that trade off the number of configurations against
+# the number of folds they are evaluated on. The folds are evaluated in order, so the configurations of a round are
+# compared on the same folds, and the cpu time of the search is checked before each evaluation of a fold.
+class LinkPredictionSearch:
+
+    def __init__(self, args, cross_validation_folds, output_folder, logger, start_time, random_state):
+        self.args = args
+        self.cross_validation_folds = cross_validation_folds
+        self.output_folder = output_folder
+        self.logger = logger
+        self.start_time = start_time
+        self.random_state = random_state
+        self.space = search_space(args)
+        self.cache = FoldCache(logger)
+        # the configurations that were sampled by index in the search space
+        self.configurations = {}
+        self.budget = args.budget * 3600.0 if args.budget else None
+        self.start_cpu_time = cpu_time()
+
+    def used_cpu_seconds(self):
+        return cpu_time() - self.start_cpu_time
+
+    def budget_exceeded(self):
+        return self.budget is not None and self.used_cpu_seconds() >= self.budget
+
+    # sample n configurations of the search space without replacement. A configuration that was already sampled (by an
+    # earlier Hyperband bracket) is reused, it keeps the folds it was evaluated on.
+    def sample_configurations(self, n):
+        choices = sorted(self.random_state.permutation(len(self.space))[:n])
+        for i in choices:
+            if i not in self.configurations:
+                self.configurations[i] = SearchConfiguration(self.space[i][0], self.space[i][1], self.args,
+                                                             self.output_folder, self.logger,
+                                                             self.cross_validation_folds.ground_truth,
+                                                             self.start_time, self.cache)
+        return [self.configurations[i] for i in choices]
+
+    # evaluate the configurations on the folds up to "folds", return False if the budget was exceeded
+    def evaluate_configurations(self, configurations, folds):
+        for f in range(min(configuration.folds for configuration in configurations), folds):
+            fold = None
+            for configuration in configurations:
+                if configuration.folds > f:
+                    continue
+                if self.budget_exceeded():
+                    self.logger.info('The cpu budget of %f hours is exceeded, stop the search' % self.args.budget)
+                    return False
+                if fold is None:
+                    fold = self.cross_validation_folds.create_fold(f)
+                    self.cache.start_fold(fold)
+                configuration.evaluate_fold(fold)
+        return True
+
+    # successive halving of n configurations that starts with the evaluation on "folds" folds, return False if the
+    # budget was exceeded
+    def successive_halving(self, n, folds):
+        configurations = self.sample_configurations(n)
+        eta = self.args.eta
+        while True:
+            self.logger.info('====================================================')
+            self.logger.info('Evaluate %d configurations on %d folds' % (len(configurations), folds))
+            if not self.evaluate_configurations(configurations, folds):
+                return False
+            for configuration in configurations:
+                self.logger.info('%s: F%.01f-Score Mean %f' % (configuration, self.args.fbeta, configuration.score()))
+            if folds >= self.args.folds or len(configurations) <= 1:
+                return True
+            configurations = sorted(configurations, key=lambda configuration: -configuration.score())
+            configurations = configurations[:max(1, int(len(configurations) / eta))]
+            folds = min(self.args.folds, folds * eta)
+
+    def run(self):
+        folds = self.args.folds
+        min_folds = min(self.args.minfolds, folds)
+        eta = self.args.eta
+        if self.args.hyperband:
+            # bracket s starts with n configurations on folds / eta^s folds
+            s_max = int(math.floor(math.log(float(folds) / min_folds) / math.log(eta) + 1e-9))
+            for s in range(s_max, -1, -1):
+                n = int(math.ceil(float(s_max + 1) / (s + 1) * eta ** s))
+                bracket_folds = max(min_folds, int(folds / eta ** s))
+                self.logger.info('Hyperband bracket %d: %d configurations starting on %d folds' % (s, n, bracket_folds))
+                if not self.successive_halving(n, bracket_folds):
+                    break
+        else:
+            self.successive_halving(self.args.configurations, min_folds)
+
+    # ranking of the evaluated configurations: the configurations that were evaluated on more folds (that survived more
+    # rounds) first, then by score
+    def leaderboard(self):
+        evaluated = [self.configurations[i] for i in sorted(self.configurations) if self.configurations[i].folds > 0]
+        return sorted(evaluated, key=lambda configuration: (-configuration.folds, -configuration.score()))
+
+    # write the leaderboard as csv file and print its best entries
+    def write_leaderboard(self, filename, top):
+        leaderboard = self.leaderboard()
+        file = codecs.open(filename, 'w+', encoding='utf8')
+        file.write("rank, folds, threshold, fscore_mean, fscore_std, precision_mean, recall_mean, auc_mean, "
+                   "cpu_seconds, configuration")
+        for rank, configuration in enumerate(leaderboard):
+            threshold, fscore, fscore_std, precision, recall, auc = configuration.measures()
+            file.write("\n%d, %d, %f, %f, %f, %f, %f, %s, %.1f, %s" %
+                       (rank + 1, configuration.folds, threshold, fscore, fscore_std, precision, recall,
+                        "%f" % auc if auc is not None else "", configuration.cpu_seconds, configuration))
+        file.close()
+
+        self.logger.info('====================================================')
+        self.logger.info('Leaderboard (%d configurations evaluated, %f cpu hours):' %
+                         (len(leaderboard), self.used_cpu_seconds() / 3600.0))
+        for rank, configuration in enumerate(leaderboard[:top]):
+            threshold, fscore, fscore_std, precision, recall, auc = configuration.measures()
+            self.logger.info('%d. %s with threshold %f on %d folds: F%.01f-Score Mean / Std: %f / %f' %
+                             (rank + 1, configuration, threshold, configuration.folds, self.args.fbeta, fscore,
+                              fscore_std))
+        self.logger.info('Leaderboard written to %s' % filename)
+
+# This program searches the configurations (parameters) of the link prediction algorithms RESCAL and cosine similarity
+# with successive halving or Hyperband: many configurations are evaluated on a few folds of the cross validation of
+# evaluate_link_prediction.py, only the best configurations are evaluated on more folds. The search stops when a
+# budget of cpu hours is used up and writes a ranked leaderboard of the evaluated configurations.
+if __name__ == '__main__':
+
+    # CLI processing
+    parser = argparse.ArgumentParser(description='link prediction algorithm configuration search script')
+
+    # general
+    parser.add_argument('-inputfolder',
+                        action="store", dest="inputfolder", required=True,
+                        help="input folder of the evaluation")
+    parser.add_argument('-outputfolder',
+                        action="store", dest="outputfolder", required=False,
+                        help="output folder of the search")
+    parser.add_argument('-header',
+                        action="store", dest="headers", default="headers.txt",
+                        help="name of header file")
+    parser.add_argument('-connection_slice',
+                        action="store", dest="connection_slice", default="connection.mtx",
+                        help="name of connection slice file of the tensor")
+    parser.add_argument('-needtype_slice',
+                        action="store", dest="needtype_slice", default="needtype.mtx",
+                        help="name of needtype slice file of the tensor")
+    parser.add_argument('-additional_slices', action="store", required=True,
+                        dest="additional_slices", nargs="+",
+                        help="name of additional slice files to add to the tensor")
+
+    # evaluation parameters (see evaluate_link_prediction.py)
+    parser.add_argument('-folds', action="store", dest="folds", default=10,
+                        type=int, help="number of folds in cross fold validation (maximum number of folds a "
+                                       "configuration is evaluated on)")
+    parser.add_argument('-maskrandom', action="store_true", dest="maskrandom",
+                        help="mask random test connections (not per need)")
+    parser.add_argument('-fbeta', action="store", dest="fbeta", default=0.5,
+                        type=float, help="f-beta measure to calculate during evaluation")
+    parser.add_argument('-maxconnections', action="store", dest="maxconnections", default=1000,
+                        type=int, help="maximum number of connections used to lern from per need")
+    parser.add_argument('-numneeds', action="store", dest="numneeds", default=10000,
+                        type=int, help="number of needs used for the evaluation")
+    parser.add_argument('-maxhubsize', action="store", dest="maxhubsize", default=10000,
+                        type=int, help="use only needs for the evaluation that do not exceed a number X of connections")
+    parser.add_argument('-offerwantpairs', action="store_true", dest="offerwantpairs",
+                        help="only test the pairs of test needs to needs of the opposite type (offer/want)")
+    parser.add_argument('-seed', action="store", dest="seed", default=None, type=int,
+                        help="seed of the random choices of the evaluation and the search")
+    parser.add_argument('-foldspec', action="store", dest="foldspec", default=None,
+                        help="fold specification file of the dataset (see tools/fold_spec.py): if it exists the "
+                             "folds are loaded from it, otherwise the folds of this search are written to it")
+    parser.add_argument('-rebuildfoldspec', action="store_true", dest="rebuildfoldspec",
+                        help="create the fold specification again if it was created with other fold parameters or "
+                             "another input tensor (instead of stopping with an error)")
+    parser.add_argument('-curvebins', action="store", dest="curvebins", default=None, type=int,
+                        help="compute precision/recall curves from score histograms with this number of bins")
+    parser.add_argument('-curvebinning', action="store", dest="curvebinning", default='width',
+                        choices=['width', 'quantile'], help="binning of the score histograms for the curves")
+
+    # search parameters
+    parser.add_argument('-algorithms', action="store", dest="algorithms", nargs="+", default=['rescal', 'cosine'],
+                        choices=['rescal', 'cosine', 'cosine_weighted'], help="algorithms to search")
+    parser.add_argument('-configurations', action="store", dest="configurations", default=27, type=int,
+                        help="number of configurations sampled from the search space for successive halving")
+    parser.add_argument('-minfolds', action="store", dest="minfolds", default=1, type=int,
+                        help="minimum number of folds a configuration is evaluated on")
+    parser.add_argument('-eta', action="store", dest="eta", default=3, type=int,
+                        help="only the best 1/eta configurations of a round are evaluated on eta times as many folds")
+    parser.add_argument('-hyperband', action="store_true", dest="hyperband",
+                        help="run the Hyperband brackets of successive halving instead of a single successive halving "
+                             "(the number of configurations follows from -folds, -minfolds and -eta)")
+    parser.add_argument('-budget', action="store", dest="budget", default=None, type=float,
+                        help="budget of cpu hours of the search, no further folds are evaluated after it is used up")
+    parser.add_argument('-top', action="store", dest="top", default=10, type=int,
+                        help="number of leaderboard entries to print")
+
+    # search space
+    parser.add_argument('-ranks', action="store", dest="ranks", nargs="+", default=['50', '100', '250', '500'],
+                        help="RESCAL ranks")
+    parser.add_argument('-lambdas', action="store", dest="lambdas", nargs="+", default=['0.0', '5.0', '10.0'],
+                        help="RESCAL regularization parameters (lambda_A, lambda_R and lambda_V)")
+    parser.add_argument('-inits', action="store", dest="inits", nargs="+", default=['nvecs', 'random'],
+                        help="RESCAL initializations")
+    parser.add_argument('-conv', action="store", dest="conv", default='1e-3',
+                        help="RESCAL convergence criterion")
+    parser.add_argument('-needtypeslice', action="store_true", dest="needtypeslice",
+                        help="use the need type slice for RESCAL")
+    parser.add_argument('-rescal_thresholds', action="store", dest="rescal_thresholds", nargs="+",
+                        default=['0.005', '0.01', '0.015', '0.02', '0.03'],
+                        help="RESCAL thresholds, they are evaluated from the same scores of a configuration")
+    parser.add_argument('-cosine_thresholds', action="store", dest="cosine_thresholds", nargs="+",
+                        default=['0.3', '0.4', '0.5', '0.6', '0.7'],
+                        help="cosine similarity thresholds, they are evaluated from the same similarities of a "
+                             "configuration")
+    parser.add_argument('-transitive_thresholds', action="store", dest="transitive_thresholds", nargs="+",
+                        default=['0.0'], help="cosine similarity transitive thresholds")
+    parser.set_defaults(statistics=False, statistics_format='files')
+
+    args = parser.parse_args()
+    if args.offerwantpairs and args.maskrandom:
+        parser.error('-offerwantpairs can not be used together with -maskrandom')
+    if args.eta < 2:
+        parser.error('-eta must be at least 2')
+    if args.minfolds < 1 or args.folds < 1:
+        parser.error('-minfolds and -folds must be at least 1')
+
+    start_time = strftime("%Y-%m-%d_%H%M%S")
+    if args.outputfolder:
+        outfolder = args.outputfolder
+    else:
+        outfolder = args.inputfolder + "/out/search_" + start_time
+    if not os.path.exists(outfolder):
+        os.makedirs(outfolder)
+    hdlr = logging.FileHandler(outfolder + "/search_result_" + start_time + ".log")
+    _log.addHandler(hdlr)
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    # load the tensor input data and create the folds of the cross validation
+    input_tensor = read_evaluation_tensor(args)
+    fold_spec, fold_seed = load_fold_spec(args, input_tensor, parser.error, _log) if args.foldspec else (None, None)
+    cross_validation_folds = CrossValidationFolds(args, input_tensor, _log, fold_spec, fold_seed)
+
+    # the configurations are sampled with their own random state, the folds reseed numpy
+    search = LinkPredictionSearch(args, cross_validation_folds, outfolder, _log, start_time,
+                                  np.random.RandomState(np.random.randint(np.iinfo(np.int32).max)))
+    _log.info('Search %d configurations of the algorithms %s' % (len(search.space), ", ".join(args.algorithms)))
+    search.run()
+    search.write_leaderboard(outfolder + "/leaderboard.csv", args.top)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import the tools as package ("tools.x"), the tools import each other as modules ("x")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, ROOT)
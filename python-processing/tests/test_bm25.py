@@ -0,0 +1,66 @@
+__author__ = 'hfriedrich'
+
+import numpy as np
+from math import log10
+from scipy.sparse import csr_matrix
+from tools.tensor_utils import SparseTensor, need_pair_indices
+from tools.bm25 import bm25_link_prediciton, BM25Index
+
+# random tensor with needs that have a few attributes of the subject, content and category slices
+def random_tensor(num_needs=40, num_attributes=30, seed=1):
+    random_state = np.random.RandomState(seed)
+    headers = ["Need: %d" % i for i in range(num_needs)] + ["Attr: %d" % i for i in range(num_attributes)] + \
+              ["Attr: OFFER", "Attr: WANT"]
+    tensor = SparseTensor(headers)
+    shape = (len(headers), len(headers))
+    for slice in [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]:
+        rows = np.repeat(np.arange(num_needs), 3)
+        cols = num_needs + random_state.randint(0, num_attributes, len(rows))
+        tensor.addSliceMatrix(csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape), slice)
+    need_type = num_needs + num_attributes + (np.arange(num_needs) % 2)
+    tensor.addSliceMatrix(csr_matrix((np.ones(num_needs), (np.arange(num_needs), need_type)), shape=shape),
+                          SparseTensor.NEED_TYPE_SLICE)
+    return tensor
+
+# BM25 scoring of every single index pair like it was computed before the scoring was vectorised
+def reference_bm25(tensor, indices, threshold=None, var_k=1.5, var_b=0.75):
+    m = tensor.getSliceMatrix(SparseTensor.ATTR_SUBJECT_SLICE) + \
+        tensor.getSliceMatrix(SparseTensor.ATTR_CONTENT_SLICE) + tensor.getSliceMatrix(SparseTensor.CATEGORY_SLICE)
+    numNeeds = len(tensor.getNeedIndices())
+    avgDocLength = len(m[tensor.getNeedIndices(), :].nonzero()[1]) / float(numNeeds)
+    idf = dict()
+    m_csc = m.tocsc()
+    for attr in tensor.getAttributeIndices():
+        n = len(m_csc[:, attr].nonzero()[1])
+        idf[attr] = log10((numNeeds - n + 0.5) / (n + 0.5))
+    prediction = []
+    for i in range(len(indices[0])):
+        docNeed = indices[0][i]
+        docLength = len(m[docNeed, :].nonzero()[1])
+        queryAttrs = m[indices[1][i], :].nonzero()[1]
+        s = 0
+        if len(m[docNeed, queryAttrs].nonzero()[0]) > 0:
+            queryAttrs = [attr for attr in queryAttrs if m[docNeed, attr] != 0.0]
+            d = (var_k + 1) / (1 + var_k * (1 - var_b + var_b * docLength / avgDocLength))
+            for attr in queryAttrs:
+                s += idf[attr] * d
+            if threshold != None:
+                s = 1 if s > threshold else 0
+        prediction.append(s)
+    return np.array(prediction)
+
+def test_scores_are_identical_to_the_reference():
+    tensor = random_tensor()
+    indices = need_pair_indices(tensor.getNeedIndices()[:10], tensor.getNeedIndices())
+    expected = reference_bm25(tensor, indices)
+    assert np.array_equal(bm25_link_prediciton(tensor, indices, chunk_size=7), expected)
+    assert np.array_equal(BM25Index(tensor).scores(indices), expected)
+
+def test_thresholded_scores_of_the_inverted_index_are_identical_to_the_reference():
+    tensor = random_tensor()
+    indices = need_pair_indices(tensor.getNeedIndices()[:10], tensor.getNeedIndices())
+    index = BM25Index(tensor)
+    for threshold in [-0.5, 0.0, 0.2, 0.5, 1.0, 100.0]:
+        expected = reference_bm25(tensor, indices, threshold)
+        assert np.array_equal(bm25_link_prediciton(tensor, indices, threshold, chunk_size=7), expected)
+        assert np.array_equal(index.scores(indices, threshold), expected)
@@ -0,0 +1,138 @@
+__author__ = 'hfriedrich'
+
+import argparse
+import codecs
+import logging
+import os
+import subprocess
+import sys
+import numpy as np
+from scipy.io import mmwrite
+from scipy.sparse import csr_matrix
+from tools.tensor_utils import SparseTensor
+from scripts.evaluate_link_prediction import mask_all_but_X_connections_per_need, read_evaluation_tensor, \
+    CrossValidationFolds, evaluate_fold_results
+from scripts.evaluation_algorithms import PredictionMatrixFileEvaluation, CosineEvaluation
+
+# tensor with a symmetric connection slice of a small graph with hubs: needs 0 and 1 are connected to most other
+# needs, the other needs have a few random connections (and need 5 a connection to itself)
+def hub_tensor(num_needs=60, seed=2):
+    random_state = np.random.RandomState(seed)
+    tensor = SparseTensor(["Need: %d" % i for i in range(num_needs)])
+    dense = np.zeros((num_needs, num_needs))
+    dense[0, 2:] = 1
+    dense[1, 2:num_needs - 10] = 1
+    dense[np.triu(random_state.rand(num_needs, num_needs) < 0.08, 1)] = 1
+    dense[5, 5] = 1
+    dense = np.maximum(dense, dense.T)
+    tensor.addSliceMatrix(csr_matrix(dense), SparseTensor.CONNECTION_SLICE)
+    return tensor
+
+def connections(tensor):
+    return tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).toarray()
+
+def test_every_need_keeps_at_most_x_symmetric_connections():
+    tensor = hub_tensor()
+    original = connections(tensor)
+    for keep_x in [0, 1, 2, 5, 10, 100]:
+        kept = connections(mask_all_but_X_connections_per_need(tensor, keep_x, np.random.RandomState(keep_x)))
+        degrees = (kept != 0).sum(axis=1)
+        assert degrees.max() <= keep_x
+        assert np.array_equal(kept, kept.T)
+        assert np.all((kept == 0) | (kept == original))
+        # a connection is only masked if one of its needs already keeps X connections
+        masked_rows, masked_cols = np.nonzero((original != 0) & (kept == 0))
+        assert np.all((degrees[masked_rows] == keep_x) | (degrees[masked_cols] == keep_x))
+    assert np.array_equal(connections(mask_all_but_X_connections_per_need(tensor, 100)), original)
+    assert not connections(mask_all_but_X_connections_per_need(tensor, 0)).any()
+
+def test_masked_connections_only_depend_on_the_random_state():
+    tensor = hub_tensor()
+    first = connections(mask_all_but_X_connections_per_need(tensor, 3, np.random.RandomState(7)))
+    second = connections(mask_all_but_X_connections_per_need(tensor, 3, np.random.RandomState(7)))
+    other = connections(mask_all_but_X_connections_per_need(tensor, 3, np.random.RandomState(8)))
+    assert np.array_equal(first, second)
+    assert not np.array_equal(first, other)
+    # the input tensor is not changed
+    assert np.array_equal(connections(tensor), connections(hub_tensor()))
+
+# write the input files of an evaluation (headers, connection, need type and subject slice) of a random dataset of
+# offers and wants with hubs to a folder, return the connection slice
+def write_dataset(folder, num_needs=80, num_attributes=30, seed=3):
+    random_state = np.random.RandomState(seed)
+    headers = ["Need: %d" % i for i in range(num_needs)] + ["Attr: OFFER", "Attr: WANT"] + \
+              ["Attr: %d" % i for i in range(num_attributes)]
+    size = len(headers)
+    offers = np.arange(num_needs) % 2 == 0
+    connections = np.zeros((size, size))
+    connections[:num_needs, :num_needs] = (random_state.rand(num_needs, num_needs) < 0.15) & \
+                                          (offers[:, np.newaxis] != offers[np.newaxis, :])
+    connections[0, 1:num_needs:2] = 1
+    connections = np.maximum(connections, connections.T)
+    needtype = np.zeros((size, size))
+    needtype[np.arange(num_needs), np.where(offers, num_needs, num_needs + 1)] = 1
+    subject = np.zeros((size, size))
+    subject[:num_needs, num_needs + 2:] = random_state.rand(num_needs, num_attributes) < 0.2
+    with codecs.open(folder + "/headers.txt", 'w', encoding='utf8') as f:
+        f.write("\n".join(headers))
+    for name, matrix in [("connection", connections), ("needtype", needtype), ("subject", subject)]:
+        mmwrite(folder + "/" + name + ".mtx", csr_matrix(matrix))
+    return connections
+
+def evaluation_args(folder, **options):
+    args = argparse.Namespace(inputfolder=folder, headers="headers.txt", connection_slice="connection.mtx",
+                              needtype_slice="needtype.mtx", additional_slices=["subject.mtx"], folds=4,
+                              maskrandom=False, maxconnections=1000, numneeds=10000, maxhubsize=10000,
+                              offerwantpairs=False, foldspec=None, fbeta=0.5, statistics=False, curvebins=None,
+                              curvebinning='width', prediction_matrix_file=None, cosine=None, cosine_weigthed=None)
+    vars(args).update(options)
+    return args
+
+# evaluate an algorithm (created by create(args, ground truth, cross validation folds)) on all folds, return its
+# EvaluationReport
+def cross_validation_report(args, create, seed=1):
+    np.random.seed(seed)
+    logger = logging.getLogger()
+    cross_validation_folds = CrossValidationFolds(args, read_evaluation_tensor(args), logger)
+    algorithm = create(args, cross_validation_folds.ground_truth, cross_validation_folds)
+    for f in range(args.folds):
+        algorithm.merge_fold_results(evaluate_fold_results([algorithm], cross_validation_folds.create_fold(f))[0])
+    return algorithm.report
+
+def test_prediction_file_is_evaluated_on_the_used_needs(tmpdir):
+    folder = str(tmpdir)
+    connections = write_dataset(folder)
+    mmwrite(folder + "/prediction.mtx", csr_matrix(connections))
+    create = lambda args, ground_truth, folds: PredictionMatrixFileEvaluation(
+        args, folder, logging.getLogger(), ground_truth, "test", folds.entity_ids)
+    # the perfect predictions stay perfect if needs are removed (by number of needs and hub size)
+    for options in [{}, {'numneeds': 50}, {'maxhubsize': 8}, {'numneeds': 60, 'maxhubsize': 8}]:
+        report = cross_validation_report(evaluation_args(folder, prediction_matrix_file=folder + "/prediction.mtx",
+                                                         **options), create)
+        assert np.allclose(report.accuracy, 1.0) and np.allclose(report.precision, 1.0)
+        assert np.allclose(report.recall, 1.0)
+
+def test_offer_want_pairs_do_not_change_the_cosine_measures(tmpdir):
+    folder = str(tmpdir)
+    write_dataset(folder)
+    create = lambda args, ground_truth, folds: CosineEvaluation(args, folder, logging.getLogger(), ground_truth,
+                                                                "test", False)
+    all_pairs = cross_validation_report(evaluation_args(folder, cosine=['0.2', '0.0']), create)[0]
+    offer_want_pairs = cross_validation_report(evaluation_args(folder, cosine=['0.2', '0.0'], offerwantpairs=True),
+                                               create)[0]
+    for measure in ['accuracy', 'precision', 'recall', 'fscore']:
+        assert np.allclose(getattr(all_pairs, measure), getattr(offer_want_pairs, measure), rtol=0, atol=1e-12)
+
+def test_offer_want_pairs_are_rejected_for_algorithms_that_predict_other_pairs(tmpdir):
+    folder = str(tmpdir)
+    write_dataset(folder)
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    for algorithm in [['-bm25', '1.0', '1.5', '0.75'], ['-bm25_topk', '3'],
+                      ['-prediction_matrix_file', folder + "/connection.mtx"]]:
+        process = subprocess.Popen([sys.executable, os.path.join(root, 'scripts', 'evaluate_link_prediction.py'),
+                                    '-inputfolder', folder, '-additional_slices', 'subject.mtx', '-offerwantpairs'] +
+                                   algorithm, cwd=root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+        assert process.returncode == 2
+        assert b'-offerwantpairs can only be used' in error
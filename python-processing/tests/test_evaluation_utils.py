@@ -0,0 +1,79 @@
+__author__ = 'hfriedrich'
+
+import codecs
+import logging
+import warnings
+import numpy as np
+import sklearn.metrics as m
+from tools.tensor_utils import need_pair_indices
+from tools.evaluation_utils import ConfusionMatrixAccumulator, EvaluationReport, NeedEvaluationDetailDict, \
+    read_statistic_details, STATISTIC_DETAILS_FILE
+
+# weighted measures and accuracy of the accumulator for y_true, y_pred (added in chunks of chunk_size)
+def accumulated_measures(y_true, y_pred, f_beta, chunk_size=7):
+    accumulator = ConfusionMatrixAccumulator()
+    for start in range(0, len(y_true), chunk_size):
+        accumulator.add(y_true[start:start + chunk_size], y_pred[start:start + chunk_size])
+    return accumulator.getWeightedMeasures(f_beta) + (accumulator.getAccuracy(),)
+
+# sklearn measures, undefined measures (e.g. precision without positive predictions) are 0 with a warning
+def sklearn_measures(y_true, y_pred, f_beta):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        p, r, f, _ = m.precision_recall_fscore_support(y_true, y_pred, average='weighted', beta=f_beta)
+    return p, r, f, m.accuracy_score(y_true, y_pred)
+
+def test_accumulator_measures_are_the_sklearn_weighted_measures():
+    random_state = np.random.RandomState(3)
+    folds = [(random_state.rand(100) < 0.2, random_state.rand(100) < 0.3) for i in range(10)]
+    folds.append((np.zeros(50, dtype=bool), np.zeros(50, dtype=bool)))
+    folds.append((np.zeros(50, dtype=bool), random_state.rand(50) < 0.3))
+    folds.append((np.ones(50, dtype=bool), np.zeros(50, dtype=bool)))
+    folds.append((random_state.rand(50) < 0.2, np.ones(50, dtype=bool)))
+    for y_true, y_pred in folds:
+        y_true = y_true.astype(int)
+        y_pred = y_pred.astype(int)
+        for f_beta in [0.5, 1.0, 2.0]:
+            assert np.allclose(accumulated_measures(y_true, y_pred, f_beta), sklearn_measures(y_true, y_pred, f_beta),
+                               rtol=0, atol=1e-12)
+
+def test_excluded_true_negatives_are_counted_like_evaluated_true_negatives():
+    random_state = np.random.RandomState(4)
+    y_true = (random_state.rand(80) < 0.2).astype(int)
+    y_pred = (random_state.rand(80) < 0.3).astype(int)
+    report = EvaluationReport(logging.getLogger(), 0.5)
+    report.set_excluded_true_negatives(20)
+    report.add_evaluation_data(y_true, y_pred)
+    excluded = np.zeros(20, dtype=int)
+    p, r, f, a = sklearn_measures(np.append(y_true, excluded), np.append(y_pred, excluded), 0.5)
+    assert np.allclose([report.precision[0], report.recall[0], report.fscore[0], report.accuracy[0]], [p, r, f, a],
+                       rtol=0, atol=1e-12)
+
+def read_file(filename):
+    with codecs.open(filename, 'r', encoding='utf8') as f:
+        return f.read()
+
+def test_per_need_and_columnar_statistics_write_the_same_summary(tmpdir):
+    random_state = np.random.RandomState(5)
+    headers = ["Need: %d" % i for i in range(12)]
+    idx_test = need_pair_indices([0, 3, 7], np.arange(12))
+    y_true = (random_state.rand(len(idx_test[0])) < 0.3).astype(int)
+    y_pred = (random_state.rand(len(idx_test[0])) < 0.3).astype(int)
+    details = NeedEvaluationDetailDict()
+    details.add_statistic_details(y_true, y_pred, idx_test, random_state.rand(len(idx_test[0])))
+    files_folder = str(tmpdir.join('files'))
+    columnar_folder = str(tmpdir.join('columnar'))
+    for i in range(2):
+        # a second evaluation in the same folder replaces the summary
+        details.output_statistic_details(files_folder, headers, 0.5)
+        details.output_consolidated_statistic_details(columnar_folder, headers, 0.5)
+    summary = read_file(files_folder + "/_summary.txt")
+    assert len(summary.splitlines()) == 3
+    assert summary == read_file(columnar_folder + "/_summary.txt")
+    stored_details, stored_headers = read_statistic_details(columnar_folder + "/" + STATISTIC_DETAILS_FILE)
+    assert summary == "".join([stored_details.needSummaryLine(need, stored_headers, 0.5)
+                               for need in stored_details.getNeeds()])
+
+def test_statistics_without_tested_needs_write_an_empty_summary(tmpdir):
+    NeedEvaluationDetailDict().output_statistic_details(str(tmpdir), [], 0.5)
+    assert read_file(str(tmpdir.join("_summary.txt"))) == ""
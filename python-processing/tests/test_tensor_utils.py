@@ -0,0 +1,15 @@
+__author__ = 'hfriedrich'
+
+import numpy as np
+from tools.tensor_utils import fold_pair_numbers
+
+def test_fold_pair_numbers_partition_the_pairs():
+    num_pairs = 10007
+    folds = [fold_pair_numbers(num_pairs, 4, f, 12345, chunk_size=1000) for f in range(4)]
+    assert np.array_equal(np.sort(np.concatenate(folds)), np.arange(num_pairs))
+    for pairs in folds:
+        assert np.all(np.diff(pairs) > 0)
+        assert abs(len(pairs) - num_pairs / 4.0) < 200
+    # the partition only depends on the seed, not on the chunks
+    assert np.array_equal(folds[1], fold_pair_numbers(num_pairs, 4, 1, 12345))
+    assert not np.array_equal(folds[1], fold_pair_numbers(num_pairs, 4, 1, 54321))
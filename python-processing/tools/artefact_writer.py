@@ -0,0 +1,98 @@
+__author__ = 'hfriedrich'
+
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# This file contains a background writer for the artefacts of an evaluation (curve files, statistic details, graphs).
+# Instead of writing the files synchronously the evaluation classes submit write functions together with the (already
+# computed) data to the writer and continue computing (e.g. the factorization of the next fold) while a background
+# thread writes the files in the order of submission.
+#
+# Backpressure: the writer blocks submitting new artefacts if either "max_pending" artefacts are waiting to be
+# written or the numpy arrays of the waiting artefacts would exceed "max_pending_bytes". This bounds the memory held
+# by artefacts that are not yet on disk.
+
+# estimate the memory held by the arguments of an artefact (size of the numpy arrays and lists of them)
+def artefact_size(args):
+    size = 0
+    for arg in args:
+        if hasattr(arg, 'nbytes'):
+            size += arg.nbytes
+        elif isinstance(arg, (list, tuple)):
+            size += artefact_size(arg)
+    return size
+
+# background writer thread for evaluation artefacts
+#
+# parameters:
+# ============
+# max_pending: maximum number of artefacts waiting to be written
+# max_pending_bytes: maximum size of the arrays of the artefacts waiting to be written, a single bigger artefact is
+#   accepted if no other artefacts are waiting
+# logger: if given errors of the write functions are logged
+class ArtefactWriter:
+
+    def __init__(self, max_pending=8, max_pending_bytes=256 << 20, logger=None):
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.logger = logger
+        self.error = None
+        self.condition = threading.Condition()
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._run, name='artefact-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            artefact = self.queue.get()
+            try:
+                if artefact is None:
+                    return
+                function, args, kwargs, size = artefact
+                try:
+                    if self.error is None:
+                        function(*args, **kwargs)
+                except Exception:
+                    self.error = sys.exc_info()[1]
+                    if self.logger:
+                        self.logger.exception('Writing of evaluation artefact failed')
+                finally:
+                    with self.condition:
+                        self.pending_bytes -= size
+                        self.condition.notify_all()
+            finally:
+                self.queue.task_done()
+
+    # raise the first error of the background thread in the calling thread
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    # submit an artefact: function(*args, **kwargs) is called in the background thread. The arguments must not be
+    # changed by the caller afterwards. Blocks while the limits of pending artefacts are reached.
+    def submit(self, function, *args, **kwargs):
+        self._check()
+        size = artefact_size(args)
+        with self.condition:
+            while self.pending_bytes > 0 and self.pending_bytes + size > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes += size
+        self.queue.put((function, args, kwargs, size))
+
+    # wait until all submitted artefacts are written
+    def flush(self):
+        self.queue.join()
+        self._check()
+
+    # write all submitted artefacts and stop the background thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check()
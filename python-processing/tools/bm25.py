@@ -2,9 +2,13 @@ __author__ = 'hfriedrich'
 
 import numpy as np
 from tools.tensor_utils import SparseTensor
+from tools.similarity_join import InvertedIndex, attribute_matrix
 from math import log10
 from scipy.sparse import csr_matrix
 
+# number of index pairs that are scored at once
+BM25_CHUNK_SIZE = 100000
+
 # see http://en.wikipedia.org/wiki/Okapi_BM25
 # parameters:
 # tensor: SparseTensor object
@@ -12,51 +16,192 @@ from scipy.sparse import csr_matrix
 # threshold: if threshold is given result array is binary
 # var_k: see http://en.wikipedia.org/wiki/Okapi_BM25
 # var_b: http://en.wikipedia.org/wiki/Okapi_BM25
+# chunk_size: number of index pairs that are scored at once
 # return: array with result bm25 scores (float or binary) for each index pair
-def bm25_link_prediciton(tensor, indices, threshold=None, var_k=1.5, var_b=0.75):
+def bm25_link_prediciton(tensor, indices, threshold=None, var_k=1.5, var_b=0.75, chunk_size=BM25_CHUNK_SIZE):
 
     # combine the attributes in one matrix
-    m_csr = m = tensor.getSliceMatrix(SparseTensor.ATTR_SUBJECT_SLICE) + \
-                tensor.getSliceMatrix(SparseTensor.ATTR_CONTENT_SLICE) + \
-                tensor.getSliceMatrix(SparseTensor.CATEGORY_SLICE)
-
-    # compute the average document length
-    numNeeds = len(tensor.getNeedIndices())
-    avgDocLength = len(m_csr[tensor.getNeedIndices(),:].nonzero()[1]) / float(numNeeds)
-
-    # create a dictionary with computed idf values of all attributes
-    idf = dict()
-    m_csc = m_csr.tocsc()
-    for attr in tensor.getAttributeIndices():
-        n = len(m_csc[:,attr].nonzero()[1])
-        idf[attr] = log10((numNeeds - n + 0.5) / (n + 0.5))
-
-    # compute the BM25 score for every index
-    # if a threshold is specified use it to set the result prediction value to 0 or 1
-    prediction = []
-    for i in range(len(indices[0])):
-        docNeed = indices[0][i]
-        docLength = len(m[docNeed,:].nonzero()[1])
-        queryNeed = indices[1][i]
-        queryAttrs = m_csr[queryNeed,:].nonzero()[1]
-        s = 0
-        if len(m[docNeed,queryAttrs].nonzero()[0]) > 0:
-            queryAttrs = [attr for attr in queryAttrs if m[docNeed,attr] != 0.0]
-            if len(queryAttrs) > 0:
-                s = score(docLength, avgDocLength, queryAttrs, idf, var_k, var_b)
-            if threshold != None:
-                s = 1 if s > threshold else 0
-        prediction.append(s)
-    return prediction
+    m = attribute_matrix(tensor, [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE,
+                                  SparseTensor.CATEGORY_SLICE])
+    m.eliminate_zeros()
+
+    # compute the document lengths and the idf values of all attributes once
+    docLength, avgDocLength = document_lengths(m, tensor.getNeedIndices())
+    idf = idf_array(m, tensor.getAttributeIndices(), len(tensor.getNeedIndices()))
+    weights = bm25_weights(m, idf, docLength, avgDocLength, var_k, var_b)
+    index = bm25_index(weights, threshold) if threshold != None and threshold >= 0 else None
+    return bm25_scores(m, weights, indices, threshold, chunk_size, index)
+
+# number of attributes of every need (row) and the average document length of the needs
+def document_lengths(m, needs):
+    docLength = np.diff(m.indptr)
+    avgDocLength = docLength[needs].sum() / float(len(needs))
+    return docLength, avgDocLength
 
-# for computation of the score use term frequency either 0 or 1 since we don't have the number of occurrences of an
-# attribute in a need. This is why in queryAttrs only are attributes that actually are part of the document.
-def score(docLength, avgDocLength, queryAttrs, idf, k, b):
-    sum = 0
+# array with the idf value of every attribute (column), 0 for all other columns
+def idf_array(m, attributes, numNeeds):
+    df = np.bincount(m.indices, minlength=m.shape[1])
+    idf = np.zeros(m.shape[1])
+    idf[attributes] = [log10((numNeeds - n + 0.5) / (n + 0.5)) for n in df[attributes]]
+    return idf
+
+# csr matrix of the contribution of every attribute of a document to the BM25 score if the attribute is part of the
+# query, that is the idf times the length normalization of the document. For the computation of the score use term
+# frequency either 0 or 1 since we don't have the number of occurrences of an attribute in a need.
+def bm25_weights(m, idf, docLength, avgDocLength, k, b):
     d = (k + 1) / (1 + k * (1 - b + b * docLength / avgDocLength))
-    for attr in queryAttrs:
-        sum += idf[attr] * d
-    return sum
+    return csr_matrix((np.repeat(d, docLength) * idf[m.indices], m.indices.copy(), m.indptr.copy()), shape=m.shape)
+
+# compute the BM25 score for every index pair in chunks as the row wise product of the binary query attributes and
+# the weighted document attributes. If a threshold is specified use it to set the result prediction value to 0 or 1
+# (pairs without common attributes are always 0). With an inverted index of a non-negative threshold (see
+# bm25_index()) only the pairs whose document is a candidate of the query are scored, all other pairs can not exceed
+# the threshold.
+def bm25_scores(m, weights, indices, threshold=None, chunk_size=BM25_CHUNK_SIZE, index=None):
+    binary = csr_matrix((np.ones(len(m.data)), m.indices, m.indptr), shape=m.shape)
+    docNeeds = np.asarray(indices[0], dtype=np.int64)
+    queryNeeds = np.asarray(indices[1], dtype=np.int64)
+    prediction = np.zeros(len(docNeeds), dtype=float if threshold is None else int)
+    candidates = bm25_candidates(m, index, queryNeeds) if threshold != None and index is not None else None
+    for start in range(0, len(docNeeds), chunk_size):
+        rows = np.arange(start, min(start + chunk_size, len(docNeeds)))
+        if candidates is not None:
+            rows = rows[np.asarray(candidates[queryNeeds[rows], docNeeds[rows]]).ravel() > 0]
+        docs = docNeeds[rows]
+        queries = binary[queryNeeds[rows]]
+        s = sequential_row_sums(csr_matrix(queries.multiply(weights[docs])))
+        if threshold != None:
+            common = np.asarray(queries.multiply(binary[docs]).sum(axis=1)).ravel() > 0
+            s = common & (s > threshold)
+        prediction[rows] = s
+    return prediction
+
+# row sums of a csr matrix (with sorted indices) that are added up one attribute after the other like the score of a
+# single pair is computed, this way the scores do not differ in the last digits because of a different summation order
+def sequential_row_sums(m):
+    lengths = np.diff(m.indptr)
+    sums = np.zeros(m.shape[0])
+    for j in range(lengths.max() if len(lengths) > 0 else 0):
+        rows = np.flatnonzero(lengths > j)
+        sums[rows] += m.data[m.indptr[rows] + j]
+    return sums
+
+# build an inverted index over the documents with the maximum contribution of each attribute to the BM25 score of a
+# document (the query term frequency is 0 or 1)
+def bm25_index(weights, threshold):
+    bounds = weights.copy()
+    bounds.data = np.maximum(bounds.data, 0.0)
+    return InvertedIndex(bounds, threshold, max_query_weights=np.ones(weights.shape[1]))
+
+# return a csr matrix (rows: query needs, columns: documents) of the inverted index candidates of the query needs
+def bm25_candidates(m, index, queryNeeds):
+    queries = np.unique(queryNeeds)
+    candidates = [index.candidates(m.indices[m.indptr[q]:m.indptr[q + 1]], np.ones(m.indptr[q + 1] - m.indptr[q]))
+                  for q in queries]
+    counts = [len(c) for c in candidates]
+    docs = np.concatenate(candidates) if len(candidates) > 0 else np.array([], dtype=np.int64)
+    return csr_matrix((np.ones(len(docs)), (np.repeat(queries, counts), docs)), shape=(m.shape[0], m.shape[0]))
+
+# impact ordered postings lists of the documents (rows) of a weight matrix: for every attribute the documents that
+# contain it sorted by their decreasing weight (impact) of the attribute
+# return: tuple (pointer array to the start of the list of each attribute, documents, impacts, non-negative maximum
+# impact of each list)
+def impact_ordered_postings(weights, docs):
+    keep = np.zeros(weights.shape[0])
+    keep[docs] = 1.0
+    csc = csr_matrix(weights.multiply(keep.reshape(-1, 1))).tocsc()
+    csc.eliminate_zeros()
+    col = np.repeat(np.arange(csc.shape[1]), np.diff(csc.indptr))
+    order = np.lexsort((csc.indices, -csc.data, col))
+    impacts = csc.data[order]
+    max_impacts = np.zeros(csc.shape[1])
+    nonempty = np.diff(csc.indptr) > 0
+    max_impacts[nonempty] = np.maximum(impacts[csc.indptr[:-1][nonempty]], 0.0)
+    return csc.indptr, csc.indices[order], impacts, max_impacts
+
+# ========================================================================================
+# BM25 retrieval engine that returns the top k counterparts (needs of the opposite type) for query needs without
+# scoring every need.
+# ========================================================================================
+# Notes:
+# - the BM25 statistics (idf values, document lengths) and the impact ordered postings lists only depend on the
+# attribute slices of the tensor. These do not change between the folds of an evaluation so the index can be built
+# once from the ground truth and reused for all folds.
+# - queries are evaluated term-at-a-time with MaxScore pruning: the postings lists of the query attributes are
+# processed in decreasing order of their maximum impact and every new document is scored exactly. Processing stops
+# as soon as the sum of the maximum impacts of the remaining lists can not exceed the k-th best score anymore, and
+# a list is cut off where the impact of its documents plus the maximum impacts of all other lists can not exceed it.
+# ========================================================================================
+class BM25Index:
+
+    def __init__(self, tensor, var_k=1.5, var_b=0.75):
+        self.m = attribute_matrix(tensor, [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE,
+                                           SparseTensor.CATEGORY_SLICE])
+        self.m.eliminate_zeros()
+        needs = tensor.getNeedIndices()
+        docLength, avgDocLength = document_lengths(self.m, needs)
+        self.idf = idf_array(self.m, tensor.getAttributeIndices(), len(needs))
+        self.weights = bm25_weights(self.m, self.idf, docLength, avgDocLength, var_k, var_b)
+        self.offers = tensor.getOfferIndices()
+        self.wants = tensor.getWantIndices()
+        self.need_type = np.zeros(tensor.shape[0], dtype=np.int8)
+        self.need_type[self.offers] = 1
+        self.need_type[self.wants] = 2
+        self.postings = {1: impact_ordered_postings(self.weights, self.wants),
+                         2: impact_ordered_postings(self.weights, self.offers)}
+        self.indexes = {}
+
+    # return the BM25 score (float or binary if threshold is given) for each index pair (doc, query), with a
+    # non-negative threshold only the candidates of the inverted index of the threshold are scored
+    def scores(self, indices, threshold=None, chunk_size=BM25_CHUNK_SIZE):
+        index = None
+        if threshold != None and threshold >= 0:
+            if threshold not in self.indexes:
+                self.indexes[threshold] = bm25_index(self.weights, threshold)
+            index = self.indexes[threshold]
+        return bm25_scores(self.m, self.weights, indices, threshold, chunk_size, index)
+
+    # return the top k needs of the opposite type for a query need and their scores, both sorted by decreasing score
+    # (needs that have no common attribute with the query are not returned)
+    def query(self, need, k):
+        empty = (np.array([], dtype=np.int64), np.array([]))
+        if self.need_type[need] == 0 or k <= 0:
+            return empty
+        ptr, docs, impacts, max_impacts = self.postings[self.need_type[need]]
+        attrs = self.m.indices[self.m.indptr[need]:self.m.indptr[need + 1]]
+        attrs = attrs[np.argsort(-max_impacts[attrs], kind='mergesort')]
+        upper = max_impacts[attrs]
+        remaining = np.cumsum(upper[::-1])[::-1]
+        total = upper.sum()
 
+        candidates = np.array([], dtype=np.int64)
+        candidate_scores = np.array([])
+        theta = None
+        for i in range(len(attrs)):
+            if theta is not None and remaining[i] <= theta:
+                break
+            start, end = ptr[attrs[i]], ptr[attrs[i] + 1]
+            if theta is not None:
+                end = start + np.count_nonzero(impacts[start:end] + (total - upper[i]) > theta)
+            new = np.setdiff1d(docs[start:end], candidates)
+            if len(new) > 0:
+                new_scores = self.scores((new, np.repeat(need, len(new))))
+                candidates = np.concatenate((candidates, new))
+                candidate_scores = np.concatenate((candidate_scores, new_scores))
+            if len(candidates) >= k:
+                theta = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
 
+        if len(candidates) == 0:
+            return empty
+        top = np.lexsort((candidates, -candidate_scores))[:k]
+        return candidates[top], candidate_scores[top]
 
+    # return the top k counterparts of several query needs as tuple of arrays (query needs, result needs, scores)
+    def batch_query(self, needs, k):
+        results = [self.query(need, k) for need in needs]
+        counts = [len(r[0]) for r in results]
+        query_needs = np.repeat(np.asarray(needs, dtype=np.int64), counts)
+        if len(results) == 0:
+            return query_needs, np.array([], dtype=np.int64), np.array([])
+        return (query_needs, np.concatenate([r[0] for r in results]),
+                np.concatenate([r[1] for r in results]))
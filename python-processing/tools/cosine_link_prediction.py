@@ -1,23 +1,33 @@
 
 __author__ = 'bivanschitz'
 
-from math import log10
+import numpy as np
 
-from scipy.spatial.distance import cosine
 from scipy.sparse import csr_matrix
 from tools.tensor_utils import SparseTensor
+from tools.similarity_join import InvertedIndex, attribute_matrix
 
 
 #FUNCTIONS
 
-#get the most commen elements using the cosinus distance (alternative distance measure available)
-def most_common_elements(needindex ,mat, newelement):
-    most_common = {}
-    for item in needindex:
-         if (mat[item].sum() > 0.0 and mat[newelement].sum() > 0.0):
-            temp = cosine(mat[item],mat[newelement])
-            most_common.update({item: temp})
-    result = sorted(most_common.items(), key=lambda x: x[1])
+#build the inverted index over the (weighted) attribute matrix for finding all needs with a cosinus distance lower
+#than max_value to a need, this is the same as a cosinus similarity higher than 1 - max_value
+def cosine_index(needindex, mat, sqnorms, max_value):
+    norms = np.sqrt(sqnorms)
+    norms[norms == 0] = 1.0
+    bounds = csr_matrix(abs(mat).multiply(1.0 / norms.reshape(-1, 1)))
+    return InvertedIndex(bounds, 1.0 - max_value, rows=needindex)
+
+#get the most commen elements using the cosinus distance, only the candidates of the inverted index are compared
+#(restricted to the approximate candidates if these are given)
+def most_common_elements(index, mat, sqnorms, newelement, approximate_candidates=None):
+    row = mat[newelement]
+    items = index.candidates(row.indices, abs(row.data) / np.sqrt(sqnorms[newelement]))
+    if approximate_candidates is not None:
+        items = np.intersect1d(items, approximate_candidates)
+    uv = mat[items].dot(row.T).toarray().ravel()
+    distances = np.clip(1.0 - uv / np.sqrt(sqnorms[items] * sqnorms[newelement]), 0.0, 2.0)
+    result = sorted(zip(items, distances), key=lambda x: x[1])
     return result
 
 #Get the candidates witch value is smaller then the bound
@@ -29,32 +39,43 @@ def get_candidates(most_common, max_value):
             continue
     return add_connection
 
-#add the new connections to the matrix
-def add_transitv_connections(candidates, connectionmatrix, new_element_index, checkset, threshold):
+#get the needs connected to a need, these are the entries of its row in the csr connection matrix together with the
+#connections that have already been predicted for it (need -> set of needs)
+def connected_needs(connectionmatrix, predicted, need):
+    row = connectionmatrix.indices[connectionmatrix.indptr[need]:connectionmatrix.indptr[need + 1]]
+    return set(row).union(predicted.get(need, ()))
+
+#add the new connections of a need to the predicted connections, only the rows of the candidates are gathered from the
+#csr connection matrix so the cost depends on the number of connected needs and not on the number of all needs
+def add_transitv_connections(candidates, connectionmatrix, predicted, new_element_index, checkset, threshold):
+    connected = connected_needs(connectionmatrix, predicted, new_element_index)
+    added = set()
     for item in candidates:
         value = item[1]
         position = int(item[0])
-        if connectionmatrix[new_element_index, position] == 0 and position in checkset:
-            connectionmatrix[new_element_index, position] = 1
-        else:
-            if (value < threshold) and (position != new_element_index):
-                for i, j in enumerate(connectionmatrix[position]):
-                    if j == 1 and connectionmatrix[new_element_index, i] == 0:
-                        connectionmatrix[new_element_index, i] = 1
-
-    return connectionmatrix
+        if position not in connected and position in checkset:
+            connected.add(position)
+            added.add(position)
+        elif (value < threshold) and (position != new_element_index):
+            transitive = connected_needs(connectionmatrix, predicted, position) - connected
+            connected |= transitive
+            added |= transitive
+    predicted.setdefault(new_element_index, set()).update(added)
+    return predicted
+
+#merge the predicted connections (need -> set of needs) into the connection matrix in one sparse operation
+def merge_predicted_connections(connectionmatrix, predicted):
+    rows = [need for need in predicted for _ in predicted[need]]
+    cols = [x for need in predicted for x in predicted[need]]
+    prediction = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=connectionmatrix.shape)
+    return connectionmatrix + prediction
 
 #Gereate the inverse term frequencies
 def termFrequencies (attributemat, numberOfDocuments):
-    colsum=attributemat.sum(axis=0)
-    numberdocuments = numberOfDocuments
-    inftermfre = []
-    for item in colsum:
-        if item == 0:
-            inftermfre.append(0)
-        else:
-            idf = log10(numberdocuments/item)
-            inftermfre.append(idf)
+    colsum = np.asarray(attributemat.sum(axis=0), dtype=float).ravel()
+    inftermfre = np.zeros(len(colsum))
+    nonzero = colsum != 0
+    inftermfre[nonzero] = np.log10(numberOfDocuments / colsum[nonzero])
     return inftermfre
 
 
@@ -62,37 +83,58 @@ def termFrequencies (attributemat, numberOfDocuments):
 #############################
 #Generate the link prediction
 
-# the cosinus transitiv weighted link prediction algorithm
+# compute the similar needs of the new elements (need -> list of (need, cosinus distance) sorted by distance) that have
+# a cosinus distance lower than max_value. The similar needs of a lower threshold are a subset of them, so the
+# (expensive) similarity computation can be shared by predictions with different thresholds (see
+# predict_cosine_connections()).
 #
 # parameters:
 # ============
-# tensormatrix: list of csr_matrix slices describing the tensor
-# offers: indices in the tensor that references all the offers
-# wants: indices in the tensor that references all the wants
-# new_elements: list of need indices for which the prediction should be calculated
-# threshold: if similarity value between an offer and want is lower than threshold then there is a connection predicted
-# transitive_threshold: if similarity between want/want or offer/offer pairs is lower than "threshold"
-#   connections to transitive connected needs are taken if their need similarity is lower than "transitive_threshold" in
-#   comparison to the origin need. To get transitive predictions set "transitive_threshold" > "threshold" (e.g. set
-#   "transitive_threshold" value to 0 for no transitive connection prediction).
+# tensor: tensor of the needs and their attributes
+# new_elements: list of need indices for which the similar needs should be calculated
+# max_value: maximum cosinus distance of the similar needs
 # weighted: True if the attribute terms should be weighted
-def cosinus_link_prediciton(tensor, new_elements, threshold, transitive_threshold, weighted):
+# approximate_candidates: optional dictionary (need -> candidate needs, e.g. from tools/minhash_lsh.py), if given
+#   only the candidates of a need are compared to it.
+def cosine_similar_needs(tensor, new_elements, max_value, weighted, approximate_candidates=None):
 
-    # slice 2 of the tensor are the attributes
-    attributemat = tensor.getSliceMatrix(SparseTensor.ATTR_SUBJECT_SLICE)
+    # slice 2 of the tensor are the attributes, if the category and content slice is available also use these
+    # information as attributes
+    attributemat = attribute_matrix(tensor)
+    allneeds = tensor.getNeedIndices()
 
-    # if the category and content slice is available also use these information as attributes
-    attributemat = attributemat + tensor.getSliceMatrix(SparseTensor.CATEGORY_SLICE) + \
-                   tensor.getSliceMatrix(SparseTensor.ATTR_CONTENT_SLICE)
+    # get the weighted attribute matrix
+    if weighted:
+        idf = termFrequencies(attributemat, len(allneeds)) # IDF
+        attributemat = csr_matrix(attributemat.multiply(idf))  # TF * IDF
 
-    attributemat = attributemat.toarray()
-    allneeds = tensor.getNeedIndices()
-    offers = tensor.getOfferIndices()
-    wants = tensor.getWantIndices()
+    # only needs with attributes can be compared
+    rowsums = np.asarray(attributemat.sum(axis=1)).ravel()
+    allneeds = [need for need in allneeds if rowsums[need] > 0.0]
+    sqnorms = np.asarray(attributemat.multiply(attributemat).sum(axis=1)).ravel()
+    index = cosine_index(allneeds, attributemat, sqnorms, max_value)
+
+    similar_needs = dict()
+    for new_element in new_elements:
+        #get the most comment elements
+        if rowsums[new_element] > 0.0:
+            most_common_elements_weighted = most_common_elements(
+                index, attributemat, sqnorms, new_element,
+                approximate_candidates.get(new_element, []) if approximate_candidates is not None else None)
+        else:
+            most_common_elements_weighted = []
+        similar_needs[new_element] = get_candidates(most_common_elements_weighted, max_value)
+    return similar_needs
+
+# predict the connections of the new elements from their similar needs (see cosine_similar_needs(), computed for
+# the same or a higher threshold), the parameters are the same as of cosinus_link_prediciton()
+def predict_cosine_connections(tensor, new_elements, similar_needs, threshold, transitive_threshold):
+    offers = set(tensor.getOfferIndices())
+    wants = set(tensor.getWantIndices())
 
     # slice 0 of the tensor are the connections
     connectionmat = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)
-    connectionmat = connectionmat.toarray()
+    predicted = dict()
 
     for new_element in new_elements:
         if new_element in offers:
@@ -100,15 +142,31 @@ def cosinus_link_prediciton(tensor, new_elements, threshold, transitive_threshol
         else:
             checkset = offers
 
-        # get the weighted attribute matrix
-        if weighted:
-            weighted = termFrequencies(attributemat, len(allneeds)) # IDF
-            attributemat = weighted * attributemat  # TF * IDF
-
-        #get the most comment elements
-        most_common_elements_weighted = most_common_elements(allneeds, attributemat, new_element)
         #get the candidates for the link prediction
-        candidates = get_candidates(most_common_elements_weighted, threshold)
-        newconnectionmat = add_transitv_connections(candidates, connectionmat, new_element, checkset, transitive_threshold)
+        candidates = get_candidates(similar_needs.get(new_element, []), threshold)
+        predicted = add_transitv_connections(candidates, connectionmat, predicted, new_element, checkset,
+                                             transitive_threshold)
 
-    return csr_matrix(newconnectionmat)
\ No newline at end of file
+    return merge_predicted_connections(connectionmat, predicted)
+
+# the cosinus transitiv weighted link prediction algorithm
+#
+# parameters:
+# ============
+# tensormatrix: list of csr_matrix slices describing the tensor
+# offers: indices in the tensor that references all the offers
+# wants: indices in the tensor that references all the wants
+# new_elements: list of need indices for which the prediction should be calculated
+# threshold: if similarity value between an offer and want is lower than threshold then there is a connection predicted
+# transitive_threshold: if similarity between want/want or offer/offer pairs is lower than "threshold"
+#   connections to transitive connected needs are taken if their need similarity is lower than "transitive_threshold" in
+#   comparison to the origin need. To get transitive predictions set "transitive_threshold" > "threshold" (e.g. set
+#   "transitive_threshold" value to 0 for no transitive connection prediction).
+# weighted: True if the attribute terms should be weighted
+# approximate_candidates: optional dictionary (need -> candidate needs, e.g. from tools/minhash_lsh.py), if given
+#   only the candidates of a need are compared to it. Since these are usually needs of the opposite type this also restricts
+#   the transitive predictions to the candidates.
+def cosinus_link_prediciton(tensor, new_elements, threshold, transitive_threshold, weighted,
+                            approximate_candidates=None):
+    similar_needs = cosine_similar_needs(tensor, new_elements, threshold, weighted, approximate_candidates)
+    return predict_cosine_connections(tensor, new_elements, similar_needs, threshold, transitive_threshold)
@@ -0,0 +1,81 @@
+__author__ = 'hfriedrich'
+
+import os
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# This file contains the checkpoints of a cross validation run of evaluate_link_prediction.py that are used to resume
+# the run (option "-resume") if it was aborted:
+# - the state of the run (parameters, start time and random state of numpy) is written when the run is started. A
+#   resumed run restores the random state so it chooses the same needs and creates the same folds.
+# - when a fold is completed the per fold results of all evaluation algorithms (measures of the reports, AUC values,
+#   statistical detail data) are written to a checkpoint file of the fold. A resumed run loads these results and only
+#   evaluates the folds without checkpoint.
+# - optionally the RESCAL factors of a fold are written too (for analysis, they are not needed to resume).
+
+CHECKPOINT_FOLDER = "checkpoints"
+RUN_STATE_FILE = "run.pkl"
+
+# write data to a pickle file, the file is written under a temporary name first so an aborted run does not leave an
+# incomplete file
+def write_pickle_file(filename, data):
+    temp_filename = filename + ".tmp"
+    output_file = open(temp_filename, 'wb')
+    try:
+        pickle.dump(data, output_file, pickle.HIGHEST_PROTOCOL)
+    finally:
+        output_file.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp_filename, filename)
+
+# read the data of a pickle file, return None if the file does not exist
+def read_pickle_file(filename):
+    if not os.path.exists(filename):
+        return None
+    input_file = open(filename, 'rb')
+    try:
+        return pickle.load(input_file)
+    finally:
+        input_file.close()
+
+# return the checkpoint folder of an output folder (it is created if it does not exist)
+def checkpoint_folder(output_folder):
+    folder = os.path.join(output_folder, CHECKPOINT_FOLDER)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+# write the state of a run: parameters (dictionary), start time and random state of numpy (np.random.get_state())
+def write_run_state(folder, parameters, start_time, random_state):
+    write_pickle_file(os.path.join(folder, RUN_STATE_FILE),
+                      {'parameters': parameters, 'start_time': start_time, 'random_state': random_state})
+
+# read the state of a run (dictionary with the keys of write_run_state()), None if no run was started
+def read_run_state(folder):
+    return read_pickle_file(os.path.join(folder, RUN_STATE_FILE))
+
+def fold_checkpoint_file(folder, fold):
+    return os.path.join(folder, "fold%d.pkl" % fold)
+
+# write the per fold results of the evaluation algorithms of a completed fold
+def write_fold_checkpoint(folder, fold, results):
+    write_pickle_file(fold_checkpoint_file(folder, fold), results)
+
+# read the per fold results of a completed fold, None if the fold was not completed
+def read_fold_checkpoint(folder, fold):
+    return read_pickle_file(fold_checkpoint_file(folder, fold))
+
+# write the RESCAL factors of a fold, factors is a list of (parameters, (A, R)) tuples (see FoldCache.results())
+def write_fold_factors(folder, fold, factors):
+    arrays = {}
+    for i in range(len(factors)):
+        parameters, (A, R) = factors[i]
+        arrays['parameters_%d' % i] = np.array(str(parameters))
+        arrays['A_%d' % i] = A
+        arrays['R_%d' % i] = np.asarray(R)
+    np.savez_compressed(os.path.join(folder, "fold%d_factors.npz" % fold), **arrays)
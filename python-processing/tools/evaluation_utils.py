@@ -4,7 +4,7 @@ import os
 __author__ = 'hfriedrich'
 
 import numpy as np
-from tensor_utils import matrix_to_array
+from tensor_utils import need_type_mask, SparseTensor
 import sklearn.metrics as m
 
 # class to store statistical detail data for a need, data like number true positives, true negatives,
@@ -70,38 +70,137 @@ class NeedEvaluationDetails:
             f_score = (1 + f_beta * f_beta) * (self.getPrecision() * self.getRecall()) / div
         return f_score
 
-# this class is basically a dictionary of statistical need detail data for each need. Use this to store all data per
-# need for the whole evaluation
+# outcome codes of the classified (need, need) pairs that are stored in the statistical detail data
+OUTCOME_TP, OUTCOME_FN, OUTCOME_FP = range(3)
+
+# return the outcome codes for the true and predicted values of classified pairs (-1 for true negatives)
+def classification_outcomes(y_true, y_pred):
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    equal = (y_true == y_pred)
+    positive = (y_true == 1.0)
+    outcomes = np.full(len(y_true), -1, dtype=np.int8)
+    outcomes[equal & positive] = OUTCOME_TP
+    outcomes[~equal & positive] = OUTCOME_FN
+    outcomes[~equal & ~positive] = OUTCOME_FP
+    return outcomes
+
+# this class stores the statistical need detail data of all needs for the whole evaluation. The classified (need,
+# need) pairs are stored in a columnar way in parallel arrays (from need, to need, outcome code, threshold) that grow
+# in chunks. The per need data (NeedEvaluationDetails) is computed on demand. The true negatives are only counted.
 class NeedEvaluationDetailDict:
 
+    CHUNK_SIZE = 1 << 16
+
     def __init__(self):
-        self.dict = dict()
+        self.size = 0
+        self.from_needs = np.empty(0, dtype=np.int32)
+        self.to_needs = np.empty(0, dtype=np.int32)
+        self.outcomes = np.empty(0, dtype=np.int8)
+        self.thresholds = np.empty(0, dtype=np.float32)
+        self.TN = np.zeros(0, dtype=np.int64)
+        self.tested = np.zeros(0, dtype=bool)
+        self.grouped = None
+
+    # grow the arrays in chunks to hold at least "size" pairs
+    def _reserve(self, size):
+        if size > len(self.from_needs):
+            capacity = ((size // self.CHUNK_SIZE) + 1) * self.CHUNK_SIZE
+            for name in ['from_needs', 'to_needs', 'outcomes', 'thresholds']:
+                array = getattr(self, name)
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                setattr(self, name, grown)
+
+    # grow the per need arrays to hold at least "num_needs" needs
+    def _reserve_needs(self, num_needs):
+        if num_needs > len(self.tested):
+            self.TN = np.concatenate((self.TN, np.zeros(num_needs - len(self.TN), dtype=np.int64)))
+            self.tested = np.concatenate((self.tested, np.zeros(num_needs - len(self.tested), dtype=bool)))
+
+    # append classified pairs (outcome codes) to the arrays
+    def add_pairs(self, from_needs, to_needs, outcomes, thresholds=None):
+        n = len(from_needs)
+        self._reserve(self.size + n)
+        self.from_needs[self.size:self.size + n] = from_needs
+        self.to_needs[self.size:self.size + n] = to_needs
+        self.outcomes[self.size:self.size + n] = outcomes
+        self.thresholds[self.size:self.size + n] = thresholds if thresholds is not None else np.nan
+        self.size += n
+        self.grouped = None
+
+    # count the true negatives of the needs (one entry per true negative pair) and mark the needs as tested
+    def add_true_negatives(self, tested_needs, true_negative_needs):
+        if len(tested_needs) > 0:
+            self._reserve_needs(np.max(tested_needs) + 1)
+            self.TN += np.bincount(true_negative_needs, minlength=len(self.TN)).astype(np.int64)
+            self.tested[tested_needs] = True
 
+    # add a number of true negatives to each of the needs (e.g. for pairs that are not classified because they can
+    # never be connected)
+    def add_true_negative_counts(self, needs, counts):
+        if len(needs) > 0:
+            self._reserve_needs(np.max(needs) + 1)
+            np.add.at(self.TN, np.asarray(needs), np.asarray(counts, dtype=np.int64))
+
+    # append the statistical detail data of another NeedEvaluationDetailDict (e.g. of a fold evaluated in a worker
+    # process)
+    def merge(self, other):
+        self.add_pairs(other.from_needs[:other.size], other.to_needs[:other.size], other.outcomes[:other.size],
+                       other.thresholds[:other.size])
+        self._reserve_needs(len(other.tested))
+        self.TN[:len(other.TN)] += other.TN
+        self.tested[:len(other.tested)] |= other.tested
+
+    # return the tested needs
+    def getNeeds(self):
+        return np.flatnonzero(self.tested)
+
+    # return the number of TP, TN, FP, FN of all needs as arrays (indexed by need)
+    def getCounts(self):
+        n = len(self.tested)
+        counts = [np.bincount(self.from_needs[:self.size][self.outcomes[:self.size] == outcome], minlength=n)
+                  for outcome in (OUTCOME_TP, OUTCOME_FP, OUTCOME_FN)]
+        return counts[0], self.TN.copy(), counts[1], counts[2]
+
+    # pairs sorted (stable) by the from need and the start index of each need
+    def _grouped(self):
+        if self.grouped is None:
+            order = np.argsort(self.from_needs[:self.size], kind='mergesort')
+            starts = np.searchsorted(self.from_needs[:self.size][order], np.arange(len(self.tested) + 1))
+            self.grouped = (order, starts)
+        return self.grouped
+
+    # return the statistical detail data of a need
     def retrieveNeedDetails(self, need):
-        if (need not in self.dict):
-            self.dict[need] = NeedEvaluationDetails(need)
-        return self.dict[need]
-
-    def add_statistic_details(self, con_slice_true, con_slice_pred, idx_test, thresholds=[]):
-        sorted_idx = np.argsort(idx_test[0])
-        i1 = [idx_test[0][i] for i in sorted_idx]
-        i2 = [idx_test[1][i] for i in sorted_idx]
-        if len(thresholds) > 0:
-            sorted_thresholds = [thresholds[i] for i in sorted_idx]
-        idx_test = (i1, i2)
-
-        from_idx = 0
-        while from_idx < len(idx_test[0]):
-            need_from = idx_test[0][from_idx]
-            to_idx = np.searchsorted(idx_test[0][from_idx:], need_from, side='right') + from_idx
-            needDetails = self.retrieveNeedDetails(need_from)
-            idx_temp = (idx_test[0][from_idx:to_idx], idx_test[1][from_idx:to_idx])
-            th = None
-            if len(thresholds) > 0:
-                th = sorted_thresholds[from_idx:to_idx]
-            needDetails.addClassificationData(matrix_to_array(con_slice_true, idx_temp),
-                                              matrix_to_array(con_slice_pred, idx_temp), idx_temp[1], th)
-            from_idx = to_idx
+        needDetails = NeedEvaluationDetails(need)
+        if need >= len(self.tested):
+            return needDetails
+        order, starts = self._grouped()
+        pairs = order[starts[need]:starts[need + 1]]
+        outcomes = self.outcomes[pairs]
+        for outcome, toNeeds, thresholds in [(OUTCOME_TP, needDetails.TP_toNeeds, needDetails.TP_thresholds),
+                                             (OUTCOME_FN, needDetails.FN_toNeeds, needDetails.FN_thresholds),
+                                             (OUTCOME_FP, needDetails.FP_toNeeds, needDetails.FP_thresholds)]:
+            selected = pairs[outcomes == outcome]
+            toNeeds.extend(self.to_needs[selected].tolist())
+            thresholds.extend(self.thresholds[selected].tolist())
+        needDetails.TP = len(needDetails.TP_toNeeds)
+        needDetails.FN = len(needDetails.FN_toNeeds)
+        needDetails.FP = len(needDetails.FP_toNeeds)
+        needDetails.TN = int(self.TN[need])
+        return needDetails
+
+    # classify all (need, need) test pairs of a fold at once from the true and predicted connections of the pairs
+    # (arrays in the order of idx_test, e.g. FoldContext.y_true), store the TP, FN, FP pairs and count the TN per need
+    def add_statistic_details(self, y_true, y_pred, idx_test, thresholds=[]):
+        from_needs = np.asarray(idx_test[0], dtype=np.int64)
+        to_needs = np.asarray(idx_test[1], dtype=np.int64)
+        outcomes = classification_outcomes(np.asarray(y_true), np.asarray(y_pred))
+        stored = outcomes >= 0
+        self.add_pairs(from_needs[stored], to_needs[stored], outcomes[stored],
+                       np.asarray(thresholds)[stored] if len(thresholds) > 0 else None)
+        self.add_true_negatives(np.unique(from_needs), from_needs[~stored])
 
     # helper function
     def create_file_from_sorted_list(self, dir, filename, list):
@@ -113,51 +212,147 @@ class NeedEvaluationDetailDict:
             file.write(entry + "\n")
         file.close()
 
+    # return the (sorted) lines of the detail view of a need: the binary classifiers TP, FP, FN (optionally with the
+    # score of the pair) including the (connected/not connected) need names
+    def needDetailLines(self, need, headers, printThresholds=False):
+        needEval = self.retrieveNeedDetails(need)
+        if printThresholds:
+            needDetails = [ "TP (%f): " % needEval.TP_thresholds[i] + headers[needEval.TP_toNeeds[i]][6:]
+                            for i in range(len(needEval.TP_toNeeds))]
+            needDetails += [ "FN (%f): " % needEval.FN_thresholds[i] + headers[needEval.FN_toNeeds[i]][6:]
+                             for i in range(len(needEval.FN_toNeeds))]
+            needDetails += [ "FP (%f): " % needEval.FP_thresholds[i] + headers[needEval.FP_toNeeds[i]][6:]
+                             for i in range(len(needEval.FP_toNeeds))]
+        else:
+            needDetails = [ "TP: " + headers[toNeed][6:] for toNeed in needEval.TP_toNeeds]
+            needDetails += [ "FN: " + headers[toNeed][6:] for toNeed in needEval.FN_toNeeds]
+            needDetails += [ "FP: " + headers[toNeed][6:] for toNeed in needEval.FP_toNeeds]
+        needDetails.sort()
+        return needDetails
+
+    # return the line of a need in the summary file
+    def needSummaryLine(self, need, headers, fbeta):
+        needEval = self.retrieveNeedDetails(need)
+        return headers[need][6:] + \
+               ": TP: " + str(needEval.TP) + \
+               ": TN: " + str(needEval.TN) + \
+               ": FP: " + str(needEval.FP) + \
+               ": FN: " + str(needEval.FN) + \
+               ": Precision: " + str(needEval.getPrecision()) + \
+               ": Recall: " + str(needEval.getRecall()) + \
+               ": f%f-score : " % fbeta + str(needEval.getFScore(fbeta)) + \
+               ": Accuracy: " + str(needEval.getAccuracy()) + "\n"
+
     # in a specified folder create files which represent tested needs. For each of these files print the
     # binary classifiers: TP, FP, FN including the (connected/not connected) need names for manual detailed analysis of
     # the classification algorithm.
     def output_statistic_details(self, outputpath, headers, fbeta, printThresholds=False):
         if not os.path.exists(outputpath):
             os.makedirs(outputpath)
-        summary_file = codecs.open(outputpath + "/_summary.txt",'a+',encoding='utf8')
-
-        for need in self.dict.keys():
+        needs = self.getNeeds()
+        for need in needs:
             # write need details file
-            needEval = self.dict[need]
-            if printThresholds:
-                needDetails = [ "TP (%f): " % needEval.TP_thresholds[i] + headers[needEval.TP_toNeeds[i]][6:]
-                                for i in range(len(needEval.TP_toNeeds))]
-                needDetails += [ "FN (%f): " % needEval.FN_thresholds[i] + headers[needEval.FN_toNeeds[i]][6:]
-                                 for i in range(len(needEval.FN_toNeeds))]
-                needDetails += [ "FP (%f): " % needEval.FP_thresholds[i] + headers[needEval.FP_toNeeds[i]][6:]
-                                 for i in range(len(needEval.FP_toNeeds))]
-            else:
-                needDetails = [ "TP: " + headers[toNeed][6:] for toNeed in needEval.TP_toNeeds]
-                needDetails += [ "FN: " + headers[toNeed][6:] for toNeed in needEval.FN_toNeeds]
-                needDetails += [ "FP: " + headers[toNeed][6:] for toNeed in needEval.FP_toNeeds]
-
+            needDetails = self.needDetailLines(need, headers, printThresholds)
             self.create_file_from_sorted_list(outputpath, headers[need][6:] + ".txt", needDetails)
+        self.output_summary(outputpath, needs, headers, fbeta)
 
-        # write the summary file
-        summary_file.write(headers[need][6:])
-        summary_file.write(": TP: " + str(self.dict[need].TP))
-        summary_file.write(": TN: " + str(self.dict[need].TN))
-        summary_file.write(": FP: " + str(self.dict[need].FP))
-        summary_file.write(": FN: " + str(self.dict[need].FN))
-        summary_file.write(": Precision: " + str(self.dict[need].getPrecision()))
-        summary_file.write(": Recall: " + str(self.dict[need].getRecall()))
-        summary_file.write(": f%f-score : " % fbeta + str(self.dict[need].getFScore(fbeta)))
-        summary_file.write(": Accuracy: " + str(self.dict[need].getAccuracy()) + "\n")
+    # write the summary file with one line for each tested need
+    def output_summary(self, outputpath, needs, headers, fbeta):
+        summary_file = codecs.open(outputpath + "/_summary.txt", 'w', encoding='utf8',
+                                   buffering=STATISTICS_BUFFER_SIZE)
+        summary_file.write("".join([self.needSummaryLine(need, headers, fbeta) for need in needs]))
         summary_file.close()
 
+    # instead of one file per tested need write all classified pairs of the evaluation in one compressed columnar
+    # file (need, counterpart, outcome code, score) together with the true negative counts and the headers of the
+    # referenced needs. The files are written with big buffers in one go, the detail view of a need can be
+    # reproduced from the file with read_statistic_details() and needDetailLines().
+    def output_consolidated_statistic_details(self, outputpath, headers, fbeta):
+        if not os.path.exists(outputpath):
+            os.makedirs(outputpath)
+        needs = self.getNeeds()
+        referenced = np.union1d(needs, self.to_needs[:self.size])
+        with open(outputpath + "/" + STATISTIC_DETAILS_FILE, 'wb', STATISTICS_BUFFER_SIZE) as details_file:
+            np.savez_compressed(details_file,
+                                need=self.from_needs[:self.size],
+                                counterpart=self.to_needs[:self.size],
+                                outcome=self.outcomes[:self.size],
+                                score=self.thresholds[:self.size],
+                                tested_needs=needs.astype(np.int32),
+                                TN=self.TN[needs],
+                                header_needs=referenced.astype(np.int32),
+                                headers=np.asarray([headers[need] for need in referenced], dtype='U'))
+        self.output_summary(outputpath, needs, headers, fbeta)
+
+# file name and write buffer size of the consolidated statistic details
+STATISTIC_DETAILS_FILE = "statistic_details.npz"
+STATISTICS_BUFFER_SIZE = 1 << 20
+
+# read a file written by NeedEvaluationDetailDict.output_consolidated_statistic_details. Return the statistical
+# detail data and the headers of the referenced needs (dict need index -> header), e.g. to print the detail view of a
+# need with needDetailLines(need, headers)
+def read_statistic_details(filename):
+    data = np.load(filename)
+    details = NeedEvaluationDetailDict()
+    details.add_pairs(data['need'], data['counterpart'], data['outcome'], data['score'])
+    tested = data['tested_needs']
+    if len(tested) > 0:
+        details._reserve_needs(tested.max() + 1)
+        details.TN[tested] = data['TN']
+        details.tested[tested] = True
+    headers = dict(zip(data['header_needs'].tolist(), data['headers'].tolist()))
+    return details, headers
+
+# running confusion matrix of binary classification data (y_true, y_pred) that can be added in chunks. The
+# measures are derived from the confusion matrix in closed form the same way as sklearn computes them with
+# average='weighted' (per class measures weighted by the number of true instances of each class).
+class ConfusionMatrixAccumulator:
+
+    def __init__(self):
+        # rows: true class (1, 0), columns: predicted class (1, 0), like sklearn confusion_matrix(labels=[1, 0])
+        self.cm = np.zeros((2, 2), dtype=np.int64)
+
+    def add(self, y_true, y_pred):
+        t = (np.asarray(y_true) != 1).astype(np.int64)
+        p = (np.asarray(y_pred) != 1).astype(np.int64)
+        self.cm += np.bincount(2 * t + p, minlength=4).reshape(2, 2)
+
+    # add true negatives without classification data
+    def add_true_negatives(self, count):
+        self.cm[1, 1] += count
 
+    def getConfusionMatrix(self):
+        return self.cm.copy()
 
+    def getAccuracy(self):
+        total = self.cm.sum()
+        return (self.cm[0, 0] + self.cm[1, 1]) / float(total) if total > 0 else 0.0
+
+    # return the weighted precision, recall and f-beta score
+    def getWeightedMeasures(self, f_beta):
+        # per class counts for the classes (1, 0)
+        tp = np.diag(self.cm).astype(float)
+        true_sum = self.cm.sum(axis=1).astype(float)
+        pred_sum = self.cm.sum(axis=0).astype(float)
+        beta2 = f_beta * f_beta
+        precision = np.where(pred_sum > 0, tp / np.where(pred_sum > 0, pred_sum, 1), 0.0)
+        recall = np.where(true_sum > 0, tp / np.where(true_sum > 0, true_sum, 1), 0.0)
+        denom = beta2 * true_sum + pred_sum
+        fscore = np.where(denom > 0, (1 + beta2) * tp / np.where(denom > 0, denom, 1), 0.0)
+        if true_sum.sum() == 0:
+            return 0.0, 0.0, 0.0
+        return (np.average(precision, weights=true_sum), np.average(recall, weights=true_sum),
+                np.average(fscore, weights=true_sum))
 
-# class to collect data during the runs of the test and print calculated measures for summary
+# class to collect data during the runs of the test and print calculated measures for summary. The measures of a fold
+# are computed from its confusion matrix (see ConfusionMatrixAccumulator). If test pairs are left out of the
+# evaluation because they can never be connected (see set_excluded_true_negatives) they are counted as true negatives
+# of each fold.
 class EvaluationReport:
 
     def __init__(self, logger, f_beta=1.0):
         self.f_beta = f_beta
+        self.excluded_true_negatives = 0
         self.precision = []
         self.recall = []
         self.accuracy = []
@@ -165,9 +360,12 @@ class EvaluationReport:
         self.logger = logger
 
     def add_evaluation_data(self, y_true, y_pred):
-        p, r, f, _ =  m.precision_recall_fscore_support(y_true, y_pred, average='weighted', beta=self.f_beta)
-        a = m.accuracy_score(y_true, y_pred)
-        cm = m.confusion_matrix(y_true, y_pred, [1, 0])
+        fold = ConfusionMatrixAccumulator()
+        fold.add_true_negatives(self.excluded_true_negatives)
+        fold.add(y_true, y_pred)
+        p, r, f = fold.getWeightedMeasures(self.f_beta)
+        a = fold.getAccuracy()
+        cm = fold.getConfusionMatrix()
         self.precision.append(p)
         self.recall.append(r)
         self.fscore.append(f)
@@ -178,6 +376,21 @@ class EvaluationReport:
         self.logger.info('f%.01f-score: %f' % (self.f_beta, f))
         self.logger.info('confusion matrix: ' + str(cm))
 
+    # set the number of true negatives that are added to each of the following folds
+    def set_excluded_true_negatives(self, count):
+        self.excluded_true_negatives = count
+
+    # return the measures of all folds (e.g. to pass them from a worker process)
+    def fold_results(self):
+        return {'precision': self.precision, 'recall': self.recall, 'accuracy': self.accuracy, 'fscore': self.fscore}
+
+    # append the measures of folds returned by fold_results()
+    def add_fold_results(self, results):
+        self.precision.extend(results['precision'])
+        self.recall.extend(results['recall'])
+        self.accuracy.extend(results['accuracy'])
+        self.fscore.extend(results['fscore'])
+
     def summary(self):
         a = np.array(self.accuracy)
         p = np.array(self.precision)
@@ -188,21 +401,135 @@ class EvaluationReport:
         self.logger.info('Recall Mean / Std: %f / %f' % (r.mean(), r.std()))
         self.logger.info('F%.01f-Score Mean / Std: %f / %f' % (self.f_beta, f.mean(), f.std()))
 
+# one EvaluationReport per threshold of a threshold sweep (e.g. "-rescal 100 0.01,0.02,0.03 ..."). The predictions of
+# all thresholds are computed from the same scores of a fold, the per fold results are passed and merged like the
+# results of a single EvaluationReport.
+class ThresholdEvaluationReports:
+
+    def __init__(self, logger, f_beta, thresholds):
+        self.logger = logger
+        self.f_beta = f_beta
+        self.thresholds = list(thresholds)
+        self.reports = [EvaluationReport(logger, f_beta) for threshold in self.thresholds]
+
+    def __len__(self):
+        return len(self.reports)
+
+    def __getitem__(self, i):
+        return self.reports[i]
+
+    def set_excluded_true_negatives(self, count):
+        for report in self.reports:
+            report.set_excluded_true_negatives(count)
+
+    def fold_results(self):
+        return [report.fold_results() for report in self.reports]
+
+    def add_fold_results(self, results):
+        for report, report_results in zip(self.reports, results):
+            report.add_fold_results(report_results)
+
+    # print the summary of every threshold after its description (log_threshold(threshold)) and the threshold with
+    # the best mean f-score of a sweep
+    def summary(self, log_threshold):
+        for threshold, report in zip(self.thresholds, self.reports):
+            log_threshold(threshold)
+            report.summary()
+        if len(self.reports) > 1:
+            fscores = [np.mean(report.fscore) for report in self.reports]
+            best = int(np.argmax(fscores))
+            self.logger.info('Best threshold of the sweep: %s (F%.01f-Score Mean: %f)' %
+                             (self.thresholds[best], self.f_beta, fscores[best]))
+
+# parse a threshold parameter of the evaluation, a single threshold or a comma separated list of thresholds that are
+# evaluated from the same scores (e.g. "0.01,0.02,0.03")
+def threshold_list(value):
+    return [float(threshold) for threshold in str(value).split(',')]
+
 
 # calculate the optimal threshold by maximizing the f-score measure
 def get_optimal_threshold(recall, precision, threshold, f_beta=1.0):
-    max_f_score = 0
-    optimal_threshold = 0.0
-    for i in range(len(threshold)):
-        r = recall[i]
-        p = precision[i]
-        div = (f_beta * f_beta * p + r)
-        if div != 0:
-            f_score = (1 + f_beta * f_beta) * (p * r) / div
-            if f_score > max_f_score:
-                max_f_score = f_score
-                optimal_threshold = threshold[i]
-    return optimal_threshold
+    n = len(threshold)
+    if n == 0:
+        return 0.0
+    r = np.asarray(recall[:n], dtype=float)
+    p = np.asarray(precision[:n], dtype=float)
+    div = f_beta * f_beta * p + r
+    f_score = np.zeros(n)
+    nonzero = div != 0
+    f_score[nonzero] = (1 + f_beta * f_beta) * (p[nonzero] * r[nonzero]) / div[nonzero]
+    best = np.argmax(f_score)
+    return threshold[best] if f_score[best] > 0 else 0.0
+
+# class to build precision/recall and ROC curves of prediction scores. The (y_true, score) data can be added in
+# chunks. In exact mode (bins=None) all scores are kept and the curves are computed by sklearn. Otherwise the scores
+# are counted in histograms per label with a fixed number of bins ('width': bins of the same width, 'quantile': bins
+# with the same number of scores) and the curves are computed from the cumulative histograms with one point per
+# (non-empty) bin. The bin edges are taken from the first chunk, later scores outside of them are put into the
+# first/last bin.
+class ScoreCurve:
+
+    def __init__(self, bins=None, binning='width'):
+        self.bins = bins
+        self.binning = binning
+        self.y_true = []
+        self.scores = []
+        self.edges = None
+        self.min_score = np.inf
+
+    def add(self, y_true, scores):
+        y_true = np.asarray(y_true)
+        scores = np.asarray(scores, dtype=float)
+        if self.bins is None:
+            self.y_true.append(y_true)
+            self.scores.append(scores)
+            return
+        if len(scores) == 0:
+            return
+        if self.edges is None:
+            if self.binning == 'quantile':
+                edges = np.unique(np.percentile(scores, np.linspace(0, 100, self.bins + 1)))
+            else:
+                edges = np.linspace(scores.min(), scores.max(), self.bins + 1)
+            self.edges = edges if len(edges) > 1 else np.array([edges[0], edges[0] + 1.0])
+            self.positives = np.zeros(len(self.edges) - 1, dtype=np.int64)
+            self.negatives = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.min_score = min(self.min_score, scores.min())
+        idx = np.clip(np.searchsorted(self.edges, scores, side='right') - 1, 0, len(self.edges) - 2)
+        positive = (y_true == 1)
+        self.positives += np.bincount(idx[positive], minlength=len(self.positives))
+        self.negatives += np.bincount(idx[~positive], minlength=len(self.negatives))
+
+    # cumulative number of true and false positives for the thresholds (decreasing) of the non-empty bins
+    def _cumulative_counts(self):
+        if self.edges is None:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        nonempty = np.flatnonzero((self.positives + self.negatives) > 0)[::-1]
+        tps = np.cumsum(self.positives[::-1])[::-1][nonempty].astype(float)
+        fps = np.cumsum(self.negatives[::-1])[::-1][nonempty].astype(float)
+        thresholds = self.edges[nonempty]
+        if len(nonempty) > 0 and nonempty[-1] == 0:
+            thresholds[-1] = min(thresholds[-1], self.min_score)
+        return tps, fps, thresholds
+
+    # return precision, recall and (increasing) thresholds like sklearn.metrics.precision_recall_curve
+    def precision_recall_curve(self):
+        if self.bins is None:
+            return m.precision_recall_curve(np.concatenate(self.y_true), np.concatenate(self.scores))
+        tps, fps, thresholds = self._cumulative_counts()
+        precision = tps / np.maximum(tps + fps, 1)
+        recall = tps / tps[-1] if len(tps) > 0 and tps[-1] > 0 else np.zeros(len(tps))
+        return np.r_[precision[::-1], 1], np.r_[recall[::-1], 0], thresholds[::-1]
+
+    # return false positive rate, true positive rate and (decreasing) thresholds like sklearn.metrics.roc_curve
+    def roc_curve(self):
+        if self.bins is None:
+            return m.roc_curve(np.concatenate(self.y_true), np.concatenate(self.scores))
+        tps, fps, thresholds = self._cumulative_counts()
+        tpr = tps / tps[-1] if len(tps) > 0 and tps[-1] > 0 else np.zeros(len(tps))
+        fpr = fps / fps[-1] if len(fps) > 0 and fps[-1] > 0 else np.zeros(len(fps))
+        first = thresholds[0] + 1 if len(thresholds) > 0 else 1.0
+        return np.r_[0, fpr], np.r_[0, tpr], np.r_[first, thresholds]
 
 # write precision/recall (and threshold) curve to file
 def write_precision_recall_curve_file(folder, outfilename, precision, recall, threshold):
@@ -231,3 +558,40 @@ def write_ROC_curve_file(folder, outfilename, TP, FP, threshold):
             file.write(line)
             prevline = line
     file.close()
+
+# return a numpy array that can not be changed
+def read_only_array(array, dtype=None):
+    array = np.array(array, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+# Data of a fold of the cross validation that is shared by all evaluation algorithms. It is created once per fold so
+# the algorithms do not compute it again, and must not be changed by them (the arrays are read only):
+# - number: number of the fold
+# - tensor: the tensor with the masked test connections of the fold (a view, see SparseTensor.view()), algorithms
+#   that change slices of it must create their own view first
+# - test_needs: the test needs of the fold (int32 array)
+# - idx_test: the test index pairs (tuple of two int32 arrays)
+# - y_true: the ground truth connections at the test index pairs
+# - offers, wants: boolean arrays (indexed by entity) which are True for the needs of type offer or want
+# - offer_indices, want_indices: the offers and wants as int32 arrays
+# - excluded: if only offer/want pairs are tested, the number of left out pairs of each test need (counted as true
+#   negatives), otherwise None
+class FoldContext:
+
+    def __init__(self, number, tensor, test_needs, idx_test, ground_truth, offers=None, wants=None, excluded=None):
+        self.number = number
+        self.tensor = tensor
+        self.test_needs = read_only_array(test_needs, np.int32)
+        self.idx_test = (read_only_array(idx_test[0], np.int32), read_only_array(idx_test[1], np.int32))
+        self.y_true = read_only_array(ground_truth.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
+                                                                           self.idx_test))
+        if offers is None:
+            offers = need_type_mask(ground_truth, ground_truth.offerString)
+        if wants is None:
+            wants = need_type_mask(ground_truth, ground_truth.wantString)
+        self.offers = read_only_array(offers, bool)
+        self.wants = read_only_array(wants, bool)
+        self.offer_indices = read_only_array(np.flatnonzero(self.offers), np.int32)
+        self.want_indices = read_only_array(np.flatnonzero(self.wants), np.int32)
+        self.excluded = read_only_array(excluded) if excluded is not None else None
@@ -0,0 +1,59 @@
+__author__ = 'hfriedrich'
+
+# This file contains a cache for the results of the expensive computations of a fold (RESCAL factorizations, score
+# arrays, cosine similar needs) that is shared by all evaluation algorithms. E.g. if RESCAL and the intersection of
+# cosine and RESCAL are evaluated with the same RESCAL parameters, the fold tensor is only factorized once and the
+# predictions of the algorithms are cheap thresholding steps on the cached results.
+#
+# The results are cached by (fold number, algorithm, parameters). The parameters contain the kind of the tensor and
+# index pairs a result was computed from (e.g. the fold tensor or a tensor derived from it, the test pairs or the
+# offer/want pairs of the test needs), so a lookup does not hash any arrays. The results of a fold are removed when the
+# next fold is started, so at most the results of one fold are held in memory.
+
+class FoldCache:
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.fold = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    # return the cached results of an algorithm as list of (parameters, result) tuples
+    def results(self, algorithm):
+        return [(key[2], self.entries[key]) for key in self.entries if key[1] == algorithm]
+
+    # start a new fold (FoldContext), the results of the previous fold are removed
+    def start_fold(self, fold):
+        self.fold = fold.number
+        self.entries = {}
+
+    def _key(self, algorithm, parameters):
+        return (self.fold, algorithm, parameters)
+
+    def _hit(self, algorithm):
+        self.hits += 1
+        if self.logger:
+            self.logger.info('Use cached %s result of fold %d' % (algorithm, self.fold))
+
+    # return the result of compute(*args, **kwargs) for an algorithm with parameters in the current fold, it is only
+    # computed if it is not cached yet
+    def get(self, algorithm, parameters, compute, *args, **kwargs):
+        key = self._key(algorithm, parameters)
+        if key in self.entries:
+            self._hit(algorithm)
+        else:
+            self.misses += 1
+            self.entries[key] = compute(*args, **kwargs)
+        return self.entries[key]
+
+    # same as get() for results that are computed for a bound (e.g. a maximum distance of similar needs) and contain
+    # the results of all lower bounds. A cached result is returned if it was computed for the same or a higher bound.
+    def get_bounded(self, algorithm, parameters, bound, compute, *args, **kwargs):
+        key = self._key(algorithm, parameters)
+        if key in self.entries and self.entries[key][0] >= bound:
+            self._hit(algorithm)
+        else:
+            self.misses += 1
+            self.entries[key] = (bound, compute(*args, **kwargs))
+        return self.entries[key][1]
@@ -0,0 +1,145 @@
+__author__ = 'hfriedrich'
+
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from tensor_utils import array_fingerprint
+
+# This file contains the fold specification of a cross validation of evaluate_link_prediction.py (option "-foldspec").
+# The random choices of a cross validation are written once per dataset to a fold specification file, all runs that
+# reference the same specification evaluate their algorithms on identical folds instead of choosing (and masking)
+# their own. The specification contains:
+# - the seed of the random choices, the parameters that define the folds (FOLD_PARAMETERS) and the fingerprint of the
+#   input tensor the folds were created from
+# - the entities of the input tensor that are used for the evaluation (number of needs, maximum hub size)
+# - the connection slice with the training connections (maximum number of connections per need)
+# - the (shuffled) test needs, the random seeds of the folds and the test needs of every fold (with "-maskrandom" the
+#   seed of the random assignment of the connection pairs to the folds instead)
+# - the random state of numpy after the folds were created, so later runs continue with the same random choices
+#
+# Next to the specification file the masked connection slices of the folds are cached in binary form (folder
+# "<specification>_folds"). A run loads the connection slice of a fold from the cache instead of masking it again.
+
+# parameters of evaluate_link_prediction.py that define the folds
+FOLD_PARAMETERS = ['folds', 'maskrandom', 'maxconnections', 'numneeds', 'maxhubsize']
+
+# write arrays to a npz file, the file is written under a temporary name first so an aborted run does not leave an
+# incomplete file
+def write_npz_file(filename, arrays, compressed=False):
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    temp_filename = filename + ".tmp"
+    output_file = open(temp_filename, 'wb')
+    try:
+        if compressed:
+            np.savez_compressed(output_file, **arrays)
+        else:
+            np.savez(output_file, **arrays)
+    finally:
+        output_file.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp_filename, filename)
+
+# read all arrays of a npz file as dictionary, return None if the file does not exist
+def read_npz_file(filename):
+    if not os.path.exists(filename):
+        return None
+    npz = np.load(filename)
+    try:
+        return dict([(name, npz[name]) for name in npz.files])
+    finally:
+        npz.close()
+
+def matrix_arrays(prefix, matrix):
+    matrix = csr_matrix(matrix)
+    return {prefix + '_data': matrix.data, prefix + '_indices': matrix.indices, prefix + '_indptr': matrix.indptr,
+            prefix + '_shape': np.array(matrix.shape)}
+
+def arrays_matrix(prefix, arrays):
+    return csr_matrix((arrays[prefix + '_data'], arrays[prefix + '_indices'], arrays[prefix + '_indptr']),
+                      shape=tuple(arrays[prefix + '_shape']))
+
+# return the id of a fold specification (fingerprint of its random choices), the cached fold connection slices are
+# only used with the specification they were created for
+def fold_spec_id(spec):
+    connections = spec['train_connections']
+    arrays = [spec['entity_ids'], connections.indptr, connections.indices, connections.data, spec['needs'],
+              spec['fold_seeds']] + list(spec['fold_tests'])
+    if spec.get('pair_seed') is not None:
+        arrays.append(np.array(spec['pair_seed']))
+    return array_fingerprint(*arrays)
+
+# write a fold specification. The specification is a dictionary with the keys:
+# - 'seed': seed of the random choices
+# - 'parameters': dictionary with the values of the FOLD_PARAMETERS
+# - 'fingerprint': fingerprint of the input tensor
+# - 'entity_ids': indices of the used entities in the input tensor
+# - 'train_connections': connection slice with the training connections
+# - 'needs': shuffled test needs
+# - 'fold_seeds': random seeds of the folds
+# - 'fold_tests': test needs of each fold (empty with "-maskrandom")
+# - 'pair_seed': seed of the assignment of the connection pairs to the folds with "-maskrandom" (None otherwise, see
+#   fold_pair_numbers() in tensor_utils.py)
+# - 'random_state': random state of numpy after the folds were created (np.random.get_state())
+# The id of the specification (see fold_spec_id()) is returned.
+def write_fold_spec(filename, spec):
+    arrays = {'seed': np.array(spec['seed']), 'fingerprint': np.array(spec['fingerprint']),
+              'entity_ids': spec['entity_ids'], 'needs': np.asarray(spec['needs']), 'fold_seeds': spec['fold_seeds']}
+    for name in spec['parameters']:
+        arrays['parameter_' + name] = np.array(spec['parameters'][name])
+    arrays.update(matrix_arrays('train_connections', spec['train_connections']))
+    for f in range(len(spec['fold_tests'])):
+        arrays['fold_tests_%d' % f] = spec['fold_tests'][f]
+    state = spec['random_state']
+    arrays.update({'random_state_keys': state[1], 'random_state_pos': np.array(state[2]),
+                   'random_state_has_gauss': np.array(state[3]), 'random_state_cached_gaussian': np.array(state[4])})
+    if spec.get('pair_seed') is not None:
+        arrays['pair_seed'] = np.array(spec['pair_seed'])
+    arrays['id'] = np.array(fold_spec_id(spec))
+    write_npz_file(filename, arrays, True)
+    return arrays['id'].item()
+
+# read a fold specification (dictionary with the keys of write_fold_spec() and its 'id'), None if it does not exist
+def read_fold_spec(filename):
+    arrays = read_npz_file(filename)
+    if arrays is None:
+        return None
+    parameters = dict([(name[len('parameter_'):], arrays[name].item()) for name in arrays
+                       if name.startswith('parameter_')])
+    folds = len([name for name in arrays if name.startswith('fold_tests_')])
+    return {'seed': arrays['seed'].item(), 'parameters': parameters, 'fingerprint': arrays['fingerprint'].item(),
+            'entity_ids': arrays['entity_ids'], 'train_connections': arrays_matrix('train_connections', arrays),
+            'needs': arrays['needs'], 'fold_seeds': arrays['fold_seeds'],
+            'fold_tests': [arrays['fold_tests_%d' % f] for f in range(folds)],
+            'pair_seed': arrays['pair_seed'].item() if 'pair_seed' in arrays else None,
+            'random_state': ('MT19937', arrays['random_state_keys'], arrays['random_state_pos'].item(),
+                             arrays['random_state_has_gauss'].item(),
+                             arrays['random_state_cached_gaussian'].item()),
+            'id': arrays['id'].item()}
+
+# return the names of the parameters (and 'seed', 'input tensor') of a run that differ from a fold specification
+def fold_spec_differences(spec, parameters, fingerprint):
+    values = dict(spec['parameters'], seed=spec['seed'])
+    differences = sorted([name for name in parameters if values.get(name) != parameters[name]])
+    if spec['fingerprint'] != fingerprint:
+        differences.append('input tensor')
+    return differences
+
+def fold_connections_file(spec_filename, fold):
+    return os.path.join(os.path.splitext(spec_filename)[0] + "_folds", "fold%d_connections.npz" % fold)
+
+# write the masked connection slice of a fold to the cache of a fold specification
+def write_fold_connections(spec_filename, spec, fold, connection_slice):
+    arrays = matrix_arrays('connections', connection_slice)
+    arrays['spec_id'] = np.array(spec['id'])
+    write_npz_file(fold_connections_file(spec_filename, fold), arrays)
+
+# read the masked connection slice of a fold from the cache of a fold specification, None if it is not cached (or
+# was cached for another specification)
+def read_fold_connections(spec_filename, spec, fold):
+    arrays = read_npz_file(fold_connections_file(spec_filename, fold))
+    if arrays is None or arrays['spec_id'].item() != spec['id']:
+        return None
+    return arrays_matrix('connections', arrays)
@@ -1,80 +1,131 @@
 __author__ = 'hfriedrich'
 
 import os
-from gexf import Gexf
+import codecs
+import numpy as np
 from time import strftime
-from tensor_utils import SparseTensor
-from evaluation_utils import NeedEvaluationDetailDict, NeedEvaluationDetails
+from xml.sax.saxutils import escape
+from scipy.sparse import csr_matrix
+from tensor_utils import SparseTensor, need_type_mask
 
-# create a gexf graph from the tensor for visualization in gephi
-# add the following data:
+# write a gexf graph (http://gexf.net) of the tensor for visualization in gephi. The nodes and edges are written
+# directly to the output file one after the other, so apart from the tensor (and a few arrays with one entry per need)
+# no memory is needed for the graph. The graph contains the following data:
 # - needs (nodes)
 # - connections (edges)
 # - need labels & ids
 # - need type
 # - need attributes (subject & content keywords, categories)
-def create_gexf_graph(tensor, needEvaluationDetailDict=None):
-    needs = tensor.getNeedIndices()
-    offers = tensor.getOfferIndices()
-    wants = tensor.getWantIndices()
-    date_time = strftime("%Y-%m-%d_%H%M%S")
+# - optionally the statistical detail data of the needs (TP, TN, FP, FN, precision, recall, accuracy, f-scores)
 
-    gexf = Gexf(os.path.basename(__file__), date_time)
-    graph = gexf.addGraph('undirected','static','generated need graph')
-    need_type_attr = graph.addNodeAttribute("need type", "undefined", "string")
-    subject_attr = graph.addNodeAttribute("subject attributes", "", "string")
-    content_attr = graph.addNodeAttribute("content attributes", "", "string")
-    category_attr = graph.addNodeAttribute("category attributes", "", "string")
+# escape also quotes in xml attribute values
+QUOTE = {'"': '&quot;'}
 
-    if needEvaluationDetailDict:
-        TP_attr = graph.addNodeAttribute("TP", "", "integer")
-        TN_attr = graph.addNodeAttribute("TN", "", "integer")
-        FP_attr = graph.addNodeAttribute("FP", "", "integer")
-        FN_attr = graph.addNodeAttribute("FN", "", "integer")
-        precision_attr = graph.addNodeAttribute("precision", "", "float")
-        recall_attr = graph.addNodeAttribute("recall", "", "float")
-        accuracy_attr = graph.addNodeAttribute("accuracy", "", "float")
-        f0_5score_attr = graph.addNodeAttribute("f0.5score", "", "float")
-        f1score_attr = graph.addNodeAttribute("f1score", "", "float")
+GEXF_HEADER = u'<?xml version="1.0" encoding="UTF-8"?>\n' \
+              u'<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n'
+
+# node attributes of the graph (title, type, default value)
+NEED_ATTRIBUTES = [("need type", "string", "undefined"),
+                   ("subject attributes", "string", ""),
+                   ("content attributes", "string", ""),
+                   ("category attributes", "string", "")]
+STATISTIC_ATTRIBUTES = [("TP", "integer", ""), ("TN", "integer", ""), ("FP", "integer", ""), ("FN", "integer", ""),
+                        ("precision", "float", ""), ("recall", "float", ""), ("accuracy", "float", ""),
+                        ("f0.5score", "float", ""), ("f1score", "float", "")]
 
-    # add the nodes
+# return the (escaped) labels of the attributes of every need in a slice joined by ', ' (indexed by need)
+def attribute_labels(slice_matrix, escaped_headers, needs, sort=False):
+    m = csr_matrix(slice_matrix)
+    m.sort_indices()
+    labels = [u""] * m.shape[0]
     for need in needs:
-        # add a node for each need
-        node = graph.addNode(need, tensor.getNeedLabel(need))
+        row = m.indices[m.indptr[need]:m.indptr[need + 1]][m.data[m.indptr[need]:m.indptr[need + 1]] != 0]
+        attr = [escaped_headers[i] for i in row]
+        if sort:
+            attr.sort()
+        labels[need] = u", ".join(attr)
+    return labels
 
-        # set the need type to each node as an attribute
-        if need in offers:
-            node.addAttribute(need_type_attr, "OFFER")
-        if need in wants:
-            node.addAttribute(need_type_attr, "WANT")
+# return the values of the statistic node attributes (STATISTIC_ATTRIBUTES) of all needs as list of arrays (indexed
+# by need), the measures are computed the same way as in NeedEvaluationDetails
+def statistic_values(needEvaluationDetailDict, num_needs):
+    TP, TN, FP, FN = [np.concatenate((c, np.zeros(max(0, num_needs - len(c)), dtype=c.dtype)))[:num_needs]
+                      for c in needEvaluationDetailDict.getCounts()]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(TP + FP > 0, TP / (TP + FP).astype(float), 1.0)
+        recall = np.where(TP + FN > 0, TP / (TP + FN).astype(float), 1.0)
+        accuracy = np.where(TP + TN + FP + FN > 0, (TP + TN) / (TP + TN + FP + FN).astype(float), 1.0)
+        fscores = []
+        for f_beta in [0.5, 1]:
+            div = f_beta * f_beta * precision + recall
+            fscores.append(np.where(div != 0, (1 + f_beta * f_beta) * (precision * recall) / div, 0.0))
+    return [TP, TN, FP, FN, precision, recall, accuracy] + fscores
 
-        # get the attributes for each need
-        attr = tensor.getAttributesForNeed(need, SparseTensor.ATTR_SUBJECT_SLICE)
-        node.addAttribute(subject_attr, ', '.join(attr))
-        attr = tensor.getAttributesForNeed(need, SparseTensor.ATTR_CONTENT_SLICE)
-        node.addAttribute(content_attr, ', '.join(attr))
-        attr = tensor.getAttributesForNeed(need, SparseTensor.CATEGORY_SLICE)
-        attr.sort()
-        node.addAttribute(category_attr, ', '.join(attr))
+# write the declarations of the node attributes
+def write_attribute_declarations(output_file, attributes):
+    output_file.write(u'    <attributes class="node" mode="static">\n')
+    for i in range(len(attributes)):
+        title, type, default = attributes[i]
+        output_file.write(u'      <attribute id="%d" title="%s" type="%s">' % (i, escape(title, QUOTE), type))
+        if default:
+            output_file.write(u'<default>%s</default>' % escape(default))
+        output_file.write(u'</attribute>\n')
+    output_file.write(u'    </attributes>\n')
 
-        # add the statistical detail data to every node
-        if needEvaluationDetailDict:
-            needDetail = needEvaluationDetailDict.retrieveNeedDetails(need)
-            node.addAttribute(TP_attr, str(needDetail.TP))
-            node.addAttribute(TN_attr, str(needDetail.TN))
-            node.addAttribute(FN_attr, str(needDetail.FN))
-            node.addAttribute(FP_attr, str(needDetail.FP))
-            node.addAttribute(precision_attr, str(needDetail.getPrecision()))
-            node.addAttribute(recall_attr, str(needDetail.getRecall()))
-            node.addAttribute(accuracy_attr, str(needDetail.getAccuracy()))
-            node.addAttribute(f0_5score_attr, str(needDetail.getFScore(0.5)))
-            node.addAttribute(f1score_attr, str(needDetail.getFScore(1)))
+# write the gexf graph of the tensor to an (open) file
+def write_gexf_graph(output_file, tensor, needEvaluationDetailDict=None):
+    headers = tensor.getHeaders()
+    needs = [i for i in range(len(headers)) if headers[i].startswith('Need:')]
+    offers = need_type_mask(tensor, tensor.offerString)
+    wants = need_type_mask(tensor, tensor.wantString)
+    escaped_headers = [escape(header[6:], QUOTE) for header in headers]
+    labels = [attribute_labels(tensor.getSliceMatrix(SparseTensor.ATTR_SUBJECT_SLICE), escaped_headers, needs),
+              attribute_labels(tensor.getSliceMatrix(SparseTensor.ATTR_CONTENT_SLICE), escaped_headers, needs),
+              attribute_labels(tensor.getSliceMatrix(SparseTensor.CATEGORY_SLICE), escaped_headers, needs, True)]
+    attributes = NEED_ATTRIBUTES
+    statistics = []
+    if needEvaluationDetailDict:
+        attributes = attributes + STATISTIC_ATTRIBUTES
+        statistics = [values.tolist() for values in statistic_values(needEvaluationDetailDict, len(headers))]
 
-    # add the connections as edges between nodes (needs)
-    nz = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).nonzero()
-    for i in range(len(nz[0])):
-        if nz[0][i] < nz[1][i]:
-            graph.addEdge(str(nz[0][i]) + "_" + str(nz[1][i]), nz[0][i], nz[1][i])
+    output_file.write(GEXF_HEADER)
+    output_file.write(u'  <meta lastmodifieddate="%s">\n' % strftime("%Y-%m-%d"))
+    output_file.write(u'    <creator>%s</creator>\n' % escape(os.path.basename(__file__)))
+    output_file.write(u'    <description>generated need graph</description>\n')
+    output_file.write(u'  </meta>\n')
+    output_file.write(u'  <graph defaultedgetype="undirected" mode="static">\n')
+    write_attribute_declarations(output_file, attributes)
+
+    # write the nodes
+    output_file.write(u'    <nodes>\n')
+    for need in needs:
+        output_file.write(u'      <node id="%d" label="%s">\n        <attvalues>\n' %
+                          (need, escaped_headers[need]))
+        values = []
+        if offers[need]:
+            values.append((0, u"OFFER"))
+        if wants[need]:
+            values.append((0, u"WANT"))
+        values += [(i + 1, labels[i][need]) for i in range(len(labels))]
+        values += [(len(NEED_ATTRIBUTES) + i, str(statistics[i][need])) for i in range(len(statistics))]
+        output_file.write(u"".join([u'          <attvalue for="%d" value="%s"/>\n' % value for value in values]))
+        output_file.write(u'        </attvalues>\n      </node>\n')
+    output_file.write(u'    </nodes>\n')
 
-    return gexf
+    # write the connections as edges between nodes (needs)
+    output_file.write(u'    <edges>\n')
+    connections = csr_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
+    connections.sort_indices()
+    for need in range(connections.shape[0]):
+        row = connections.indices[connections.indptr[need]:connections.indptr[need + 1]]
+        row = row[(row > need) & (connections.data[connections.indptr[need]:connections.indptr[need + 1]] != 0)]
+        output_file.write(u"".join([u'      <edge id="%d_%d" source="%d" target="%d"/>\n' % (need, x, need, x)
+                                    for x in row]))
+    output_file.write(u'    </edges>\n')
+    output_file.write(u'  </graph>\n</gexf>\n')
 
+# write the gexf graph of the tensor to a file
+def write_gexf_graph_file(filename, tensor, needEvaluationDetailDict=None):
+    output_file = codecs.open(filename, "w", encoding="utf8", buffering=1 << 20)
+    write_gexf_graph(output_file, tensor, needEvaluationDetailDict)
+    output_file.close()
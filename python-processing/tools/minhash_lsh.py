@@ -0,0 +1,133 @@
+__author__ = 'hfriedrich'
+
+import numpy as np
+from tools.tensor_utils import SparseTensor
+from tools.similarity_join import attribute_matrix
+
+# This file contains an approximate candidate generation for need matching based on MinHash signatures and banded
+# locality sensitive hashing (LSH). The binary attribute slices (subject, content, category) of every need are hashed
+# into "bands" buckets, each bucket key made up of "rows" MinHash values. Offers and wants that fall into the same
+# bucket in at least one band are candidates. Only these candidate pairs need to be passed to the exact scorers
+# (cosine, BM25, RESCAL) instead of all offer/want pairs.
+#
+# The probability that two needs with a jaccard similarity s of their attributes become candidates is
+# 1 - (1 - s^rows)^bands, so more bands increase the recall and more rows increase the precision of the candidates.
+
+LSH_SLICES = [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
+
+# mersenne prime used for the universal hash functions of the MinHash signatures
+MINHASH_PRIME = (1 << 31) - 1
+
+# compute the MinHash signatures of the rows of a sparse (binary) matrix
+# parameters:
+# m: csr matrix (rows: needs, columns: attributes)
+# num_hashes: number of hash functions (length of the signature)
+# random_state: numpy RandomState used to draw the hash functions
+# hash_chunk: number of hash functions that are computed at once (restricts memory to nnz x hash_chunk)
+# return: array of shape (rows of m, num_hashes), rows without attributes have the signature value MINHASH_PRIME
+def minhash_signatures(m, num_hashes, random_state, hash_chunk=16):
+    m.sum_duplicates()
+    m.eliminate_zeros()
+    a = random_state.randint(1, MINHASH_PRIME, size=num_hashes).astype(np.int64)
+    b = random_state.randint(0, MINHASH_PRIME, size=num_hashes).astype(np.int64)
+    signatures = np.empty((m.shape[0], num_hashes), dtype=np.int64)
+    signatures.fill(MINHASH_PRIME)
+    nonempty = np.flatnonzero(np.diff(m.indptr) > 0)
+    if len(nonempty) == 0:
+        return signatures
+    cols = m.indices.astype(np.int64)
+    for start in range(0, num_hashes, hash_chunk):
+        end = min(start + hash_chunk, num_hashes)
+        hashes = (np.outer(cols, a[start:end]) + b[start:end]) % MINHASH_PRIME
+        signatures[nonempty, start:end] = np.minimum.reduceat(hashes, m.indptr[nonempty], axis=0)
+    return signatures
+
+# MinHash LSH index of the needs of a tensor that returns offer/want candidate pairs
+#
+# parameters:
+# ============
+# tensor: SparseTensor, the attributes of the needs do not change between the folds of an evaluation so build the
+#   index once from the ground truth
+# bands: number of bands (bucket tables)
+# rows: number of MinHash values per band
+# seed: seed of the hash functions
+class MinHashLSH:
+
+    def __init__(self, tensor, bands, rows, seed=None, slices=LSH_SLICES):
+        self.bands = bands
+        self.rows = rows
+        m = attribute_matrix(tensor, slices)
+        m.data = np.ones(len(m.data))
+        self.signatures = minhash_signatures(m, bands * rows, np.random.RandomState(seed))
+        n = tensor.shape[0]
+        self.offers = np.zeros(n, dtype=bool)
+        self.offers[tensor.getOfferIndices()] = True
+        self.wants = np.zeros(n, dtype=bool)
+        self.wants[tensor.getWantIndices()] = True
+        hashed = np.diff(m.indptr) > 0
+
+        # bucket id of every need in every band (-1 for needs without attributes) and the needs grouped by bucket
+        self.bucket_ids = np.empty((n, bands), dtype=np.int64)
+        self.bucket_order = []
+        self.bucket_starts = []
+        for band in range(bands):
+            keys = self.signatures[:, band * rows:(band + 1) * rows]
+            _, ids = np.unique(keys, axis=0, return_inverse=True)
+            ids = np.asarray(ids).ravel()
+            ids[~hashed] = -1
+            self.bucket_ids[:, band] = ids
+            order = np.argsort(ids, kind='mergesort')
+            order = order[ids[order] >= 0]
+            self.bucket_order.append(order)
+            self.bucket_starts.append(np.searchsorted(ids[order], np.arange(ids.max() + 2)))
+
+    # number of needs in the biggest bucket of all bands
+    def max_bucket_size(self):
+        return max([np.diff(starts).max() if len(starts) > 1 else 0 for starts in self.bucket_starts])
+
+    # return the (sorted) candidate needs of the opposite need type that share a bucket with a need
+    def candidates(self, need):
+        if self.offers[need]:
+            opposite = self.wants
+        elif self.wants[need]:
+            opposite = self.offers
+        else:
+            return np.array([], dtype=np.int64)
+        members = []
+        for band in range(self.bands):
+            bucket = self.bucket_ids[need, band]
+            if bucket >= 0:
+                starts = self.bucket_starts[band]
+                members.append(self.bucket_order[band][starts[bucket]:starts[bucket + 1]])
+        if len(members) == 0:
+            return np.array([], dtype=np.int64)
+        members = np.unique(np.concatenate(members))
+        return members[opposite[members]]
+
+    # return a dictionary with the candidate needs of each of the needs
+    def candidate_dict(self, needs):
+        return dict([(need, self.candidates(need)) for need in needs])
+
+    # return the candidate pairs of the needs as tuple of two index arrays
+    def candidate_pairs(self, needs):
+        candidates = [self.candidates(need) for need in needs]
+        from_needs = np.repeat(np.asarray(needs, dtype=np.int64), [len(c) for c in candidates])
+        to_needs = np.concatenate(candidates) if len(candidates) > 0 else np.array([], dtype=np.int64)
+        return (from_needs, to_needs)
+
+    # return a boolean array that is True for the (need, need) index pairs that are candidate pairs
+    def candidate_mask(self, indices):
+        i0 = np.asarray(indices[0], dtype=np.int64)
+        i1 = np.asarray(indices[1], dtype=np.int64)
+        same_bucket = ((self.bucket_ids[i0] == self.bucket_ids[i1]) & (self.bucket_ids[i0] >= 0)).any(axis=1)
+        opposite_type = (self.offers[i0] & self.wants[i1]) | (self.wants[i0] & self.offers[i1])
+        return same_bucket & opposite_type
+
+# recall of candidate pairs: share of the positive index pairs (e.g. the ground truth connections or the positive
+# predictions of an exhaustive scoring) that are also candidate pairs
+def candidate_recall(candidate_mask, positives):
+    positives = np.asarray(positives) > 0
+    num_positives = np.count_nonzero(positives)
+    if num_positives == 0:
+        return 1.0
+    return np.count_nonzero(candidate_mask & positives) / float(num_positives)
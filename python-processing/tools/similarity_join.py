@@ -0,0 +1,103 @@
+__author__ = 'hfriedrich'
+
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
+from tools.tensor_utils import SparseTensor
+
+# This file contains an inverted index from attributes to needs that is used to compute similarity joins between
+# needs (AllPairs/PPJoin style). Need attribute vectors are very sparse, so instead of comparing every need with every
+# other need only the needs that share enough high-weight attributes with a query need to exceed a threshold are
+# returned as candidates. The candidates are then scored exactly by the caller (e.g. cosine or BM25).
+#
+# How the index works:
+# - attributes are globally ordered by decreasing document frequency
+# - for every need the frequent attributes are left out of the index as long as the sum of their maximum possible
+#   contribution to a score stays below the threshold (prefix filtering). Two needs that do not share an indexed
+#   attribute can therefore never exceed the threshold.
+# - candidates are additionally pruned by length bounds computed from the attribute weight sums and maxima
+
+ATTRIBUTE_SLICES = [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
+
+# tolerance used for the bounds to make sure that rounding errors never remove a candidate
+BOUND_EPSILON = 1e-9
+
+# combine the attribute slices of the tensor in one csr matrix (rows: needs, columns: attributes)
+def attribute_matrix(tensor, slices=ATTRIBUTE_SLICES):
+    m = tensor.getSliceMatrix(slices[0])
+    for slice in slices[1:]:
+        m = m + tensor.getSliceMatrix(slice)
+    m = csr_matrix(m)
+    m.sum_duplicates()
+    return m
+
+# inverted index from attributes to needs
+#
+# parameters:
+# ============
+# bounds: sparse matrix (rows: needs, columns: attributes) with non-negative upper bounds of the contribution of an
+#   attribute of a need to the score per unit of query weight (e.g. the absolute normalized attribute weights for
+#   cosine similarity)
+# threshold: only needs that can have a score higher than threshold are returned as candidates
+# max_query_weights: maximum weight of each attribute in a query, default is the column maximum of "bounds" which
+#   is the right choice if the queries are needs of the index themselves
+# rows: needs (row indices) of "bounds" that are indexed, default is all rows
+class InvertedIndex:
+
+    def __init__(self, bounds, threshold, max_query_weights=None, rows=None):
+        bounds = csr_matrix(bounds, dtype=float)
+        bounds.sum_duplicates()
+        if rows is not None:
+            keep = np.zeros(bounds.shape[0])
+            keep[rows] = 1.0
+            bounds = csr_matrix(bounds.multiply(keep.reshape(-1, 1)))
+        bounds.eliminate_zeros()
+        if max_query_weights is None:
+            max_query_weights = bounds.max(axis=0).toarray().ravel()
+        self.threshold = threshold
+        self.max_query_weights = np.asarray(max_query_weights, dtype=float)
+        self.row_sums = np.asarray(bounds.sum(axis=1)).ravel()
+        self.row_max = bounds.max(axis=1).toarray().ravel()
+        self.rows = np.flatnonzero(self.row_sums > 0)
+
+        # global order of the attributes, frequent attributes first
+        numAttr = bounds.shape[1]
+        df = np.bincount(bounds.indices, minlength=numAttr)
+        rank = np.empty(numAttr, dtype=np.int64)
+        rank[np.argsort(-df, kind='mergesort')] = np.arange(numAttr)
+
+        # cumulative bound of every attribute prefix of each need
+        coo = bounds.tocoo()
+        order = np.lexsort((rank[coo.col], coo.row))
+        row, col = coo.row[order], coo.col[order]
+        cum = np.cumsum(coo.data[order] * self.max_query_weights[col])
+        starts = np.searchsorted(row, row, side='left')
+        prefix = cum - np.concatenate(([0.0], cum))[starts]
+
+        # index only the attributes after the prefix that can not exceed the threshold on its own
+        indexed = prefix >= threshold - self._epsilon()
+        self.postings = csc_matrix((np.ones(np.count_nonzero(indexed)), (row[indexed], col[indexed])),
+                                   shape=bounds.shape)
+
+    def _epsilon(self):
+        return BOUND_EPSILON * max(1.0, abs(self.threshold))
+
+    # number of (attribute, need) entries in the posting lists of the index
+    def size(self):
+        return self.postings.nnz
+
+    # return the (sorted) indexed needs that can have a score higher than the threshold with a query
+    # query_attrs: attributes of the query need
+    # query_weights: non-negative weights of these attributes (same scale as "max_query_weights")
+    def candidates(self, query_attrs, query_weights):
+        if self.threshold < 0:
+            # needs without common attributes have a score of 0 which already exceeds the threshold
+            return self.rows
+        if len(query_attrs) == 0:
+            return np.array([], dtype=self.rows.dtype)
+        p = self.postings
+        cand = np.unique(np.concatenate([p.indices[p.indptr[a]:p.indptr[a + 1]] for a in query_attrs]))
+
+        # length bounds: the score is limited by the maximum weight of one side times the weight sum of the other
+        query_weights = np.asarray(query_weights, dtype=float)
+        bound = np.minimum(query_weights.max() * self.row_sums[cand], query_weights.sum() * self.row_max[cand])
+        return cand[bound >= self.threshold - self._epsilon()]
@@ -4,6 +4,7 @@ __author__ = 'hfriedrich'
 
 import logging
 import codecs
+import hashlib
 import numpy as np
 from scipy.io import mmread
 from scipy.sparse import csr_matrix, lil_matrix
@@ -26,7 +27,7 @@ class SparseTensor:
 
         def __init__(self, headers, offerString="Attr: OFFER", wantString="Attr: WANT"):
             self.shape = (len(headers), len(headers))
-            self.data = [csr_matrix(np.zeros(shape=self.shape))] * 5
+            self.data = [csr_matrix(self.shape)] * 5
             self.headers = list(headers)
             self.offerString = offerString
             self.wantString = wantString
@@ -37,6 +38,14 @@ class SparseTensor:
                 copyTensor.addSliceMatrix(self.data[i], i)
             return copyTensor
 
+        # return a tensor that shares the slice matrices of this tensor. Slices of the view can be replaced
+        # (addSliceMatrix) without changing this tensor, e.g. to mask the connections of a fold without copying
+        # the attribute slices.
+        def view(self):
+            viewTensor = SparseTensor(self.headers, self.offerString, self.wantString)
+            viewTensor.data = list(self.data)
+            return viewTensor
+
         def getSliceMatrix(self, slice):
             return self.data[slice].copy()
 
@@ -53,6 +62,14 @@ class SparseTensor:
         def getHeaders(self):
             return list(self.headers)
 
+        # return a fingerprint of the content of the tensor (headers and all slices), e.g. to check that a fold
+        # specification was created from the same input tensor (see tools/fold_spec.py)
+        def fingerprint(self):
+            arrays = []
+            for slice in self.data:
+                arrays += [slice.indptr, slice.indices, slice.data]
+            return array_fingerprint(np.array(self.headers, dtype='U'), *arrays)
+
         def getArrayFromSliceMatrix(self, slice, indices):
             return matrix_to_array(self.data[slice], indices)
 
@@ -68,19 +85,11 @@ class SparseTensor:
 
         # return a list of indices which refer to rows/columns of needs of type OFFER in the tensor
         def getOfferIndices(self):
-            needs = self.getNeedIndices()
-            offer_attr_idx = self.getHeaders().index(self.offerString)
-            offers = [need for need in needs if
-                      (self.getSliceMatrix(SparseTensor.NEED_TYPE_SLICE)[need, offer_attr_idx] == 1)]
-            return offers
+            return np.flatnonzero(need_mask(self) & need_type_mask(self, self.offerString)).tolist()
 
         # return a list of indices which refer to rows/columns of needs of type WANT in the tensor
         def getWantIndices(self):
-            needs = self.getNeedIndices()
-            want_attr_idx = self.getHeaders().index(self.wantString)
-            wants = [need for need in needs if
-                     (self.getSliceMatrix(SparseTensor.NEED_TYPE_SLICE)[need, want_attr_idx] == 1)]
-            return wants
+            return np.flatnonzero(need_mask(self) & need_type_mask(self, self.wantString)).tolist()
 
         def getNeedLabel(self, need):
             return self.getHeaders()[need][6:]
@@ -128,6 +137,50 @@ def read_input_tensor(headers_filename, data_file_names, tensor_slices, adjustDi
         slice = slice + 1
     return tensor
 
+# return the sum of the connections of each entity (need) as an array
+def need_degrees(tensor):
+    return np.asarray(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).sum(axis=1)).ravel()
+
+# return a boolean array which is True for the needs of the tensor
+def need_mask(tensor):
+    return np.array([header.startswith('Need:') for header in tensor.getHeaders()], dtype=bool)
+
+# return a boolean array (indexed by entity) which is True for the entities of a type (offer or want) in the need type
+# slice
+def need_type_mask(tensor, type_string):
+    column = tensor.data[SparseTensor.NEED_TYPE_SLICE].tocsc()[:, tensor.headers.index(type_string)]
+    return (column.toarray().ravel() == 1)
+
+# return a compacted tensor that only contains the entities (rows/columns of all slices) selected by a boolean
+# array, together with the indices of these entities in the original tensor (new index -> old index)
+def subset_tensor(tensor, keep):
+    ids = np.flatnonzero(keep)
+    headers = tensor.getHeaders()
+    subset = SparseTensor([headers[i] for i in ids], tensor.offerString, tensor.wantString)
+    for slice in range(len(tensor.data)):
+        subset.addSliceMatrix(tensor.data[slice][ids][:, ids], slice)
+    return subset, ids
+
+# remove needs from the tensor, together with the attributes that are only referenced by these needs (the need
+# type attributes are always kept). Return the compacted tensor and the indices of its entities in the original
+# tensor (new index -> old index).
+def remove_needs(tensor, needs):
+    if len(needs) == 0:
+        return tensor, np.arange(tensor.shape[0])
+    needs_mask = need_mask(tensor)
+    kept_needs = needs_mask.copy()
+    kept_needs[np.asarray(needs, dtype=np.int64)] = False
+    referenced = kept_needs.copy()
+    for slice in tensor.data:
+        referenced[slice[kept_needs].nonzero()[1]] = True
+        referenced[slice[:, kept_needs].nonzero()[0]] = True
+    keep = kept_needs | (referenced & ~needs_mask)
+    headers = tensor.getHeaders()
+    for type_string in (tensor.offerString, tensor.wantString):
+        if type_string in headers:
+            keep[headers.index(type_string)] = True
+    return subset_tensor(tensor, keep)
+
 # adjust (increase) the dimension of an mm matrix file
 def adjust_mm_dimension(data_file, dim):
     file = codecs.open(data_file,'r',encoding='utf8')
@@ -210,34 +263,99 @@ def similarity_ranking(A):
 def matrix_to_array(m, indices):
     return np.array(m[indices])[0]
 
-# return the rescal predictions of the connection slice at the specified indices as an numpy array
-def predict_rescal_connections_array(A, R, indices):
-    result = [np.dot(A[indices[0][i],:], np.dot(R[SparseTensor.CONNECTION_SLICE], A[indices[1][i],:])) for i in range(len(indices[0]))]
+# number of (need, need) index pairs that are processed at once when pairs are handled in chunks
+PAIR_CHUNK_SIZE = 1 << 16
+
+# return the index pairs of some needs ("from_needs") to all needs ("to_needs") as tuple of two int32 arrays,
+# ordered by the from needs
+def need_pair_indices(from_needs, to_needs):
+    from_needs = np.asarray(from_needs, dtype=np.int32)
+    to_needs = np.asarray(to_needs, dtype=np.int32)
+    return (np.repeat(from_needs, len(to_needs)), np.tile(to_needs, len(from_needs)))
+
+# iterate over the index pairs in chunks, yield tuples of (from need array, to need array) views with at most
+# chunk_size pairs
+def pair_index_chunks(indices, chunk_size=PAIR_CHUNK_SIZE):
+    from_needs = np.asarray(indices[0])
+    to_needs = np.asarray(indices[1])
+    for start in range(0, len(from_needs), chunk_size):
+        yield (from_needs[start:start + chunk_size], to_needs[start:start + chunk_size])
+
+# return the fold (0 ... folds - 1) of each of the pair numbers for a random partition of the pairs into folds. The
+# fold of a pair is a hash (splitmix64) of the pair number and the seed, so the pairs of a fold can be found without
+# keeping a permutation of all pairs.
+def pair_fold_numbers(pairs, folds, seed):
+    x = np.asarray(pairs, dtype=np.uint64) + np.uint64((int(seed) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return (x ^ (x >> np.uint64(31))) % np.uint64(folds)
+
+# return the pair numbers (0 ... num_pairs - 1) of a fold of the random partition of pair_fold_numbers(). The pair
+# numbers are processed in chunks, so apart from the result only chunk_size values are held in memory.
+def fold_pair_numbers(num_pairs, folds, fold, seed, chunk_size=PAIR_CHUNK_SIZE):
+    dtype = np.int32 if num_pairs <= np.iinfo(np.int32).max else np.int64
+    fold_pairs = []
+    for start in range(0, num_pairs, chunk_size):
+        pairs = np.arange(start, min(start + chunk_size, num_pairs), dtype=dtype)
+        fold_pairs.append(pairs[pair_fold_numbers(pairs, folds, seed) == np.uint64(fold)])
+    return np.concatenate(fold_pairs) if len(fold_pairs) > 0 else np.array([], dtype=dtype)
+
+# return the rescal predictions of the connection slice at the specified indices as an numpy array. The pairs are
+# scored in chunks, so apart from the result only chunk_size x rank values are held in memory.
+def predict_rescal_connections_array(A, R, indices, chunk_size=PAIR_CHUNK_SIZE):
+    result = np.zeros(len(indices[0]))
+    start = 0
+    for from_needs, to_needs in pair_index_chunks(indices, chunk_size):
+        # need vectors R * A[from_need] of the chunk
+        need_vectors = np.dot(A[from_needs, :], R[SparseTensor.CONNECTION_SLICE].T)
+        result[start:start + len(from_needs)] = np.einsum('ij,ij->i', A[to_needs, :], need_vectors)
+        start += len(from_needs)
     return result
 
-# return the rescal predictions of the connection slice at the specified indices as an numpy array
-def predict_rescal_connections_array(A, R, indices):
-    # result = [np.dot(A[indices[0][i],:], np.dot(R[SparseTensor.CONNECTION_SLICE], A[indices[1][i],:]))
-    #           for i in range(len(indices[0]))]
-    # due to performance reasons choose this implementation, not the above one
-    sorted_idx = np.argsort(indices[0])
-    from_needs = [indices[0][i] for i in sorted_idx]
-    to_needs = [indices[1][i] for i in sorted_idx]
-    result = np.zeros(len(sorted_idx))
-    need = None
-    need_vector = None
-    for i in range(len(from_needs)):
-        if (need != from_needs[i]):
-            need = from_needs[i]
-            need_vector = np.dot(R[SparseTensor.CONNECTION_SLICE], A[need,:])
-        result[sorted_idx[i]] = np.dot(A[to_needs[i],:], need_vector)
-    return result
+# return a fingerprint (sha1 hex digest) of the content of numpy arrays (e.g. test needs or index pairs)
+def array_fingerprint(*arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update((str(array.dtype) + str(array.shape)).encode('ascii'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+# return the index pairs of the test needs to all needs of the opposite type (offers to all wants, wants to all
+# offers) as tuple of two int32 arrays. Test needs that are offers and wants are only paired with the wants, test needs
+# without type are left out (as in predict_rescal_connections_by_threshold())
+def offer_want_pair_indices(all_offers, all_wants, test_needs):
+    test_needs = np.asarray(test_needs, dtype=np.int32)
+    is_offer = np.isin(test_needs, all_offers)
+    is_want = np.isin(test_needs, all_wants) & ~is_offer
+    offer_indices = need_pair_indices(test_needs[is_offer], all_wants)
+    want_indices = need_pair_indices(test_needs[is_want], all_offers)
+    return (np.concatenate((offer_indices[0], want_indices[0])),
+            np.concatenate((offer_indices[1], want_indices[1])))
+
+# return the connections of the index pairs with a score higher or equal to a threshold as csr matrix
+def threshold_prediction(indices, scores, threshold, shape):
+    positive = np.flatnonzero(np.asarray(scores) >= threshold)
+    return csr_matrix((np.ones(len(positive)), (np.asarray(indices[0])[positive], np.asarray(indices[1])[positive])),
+                      shape=shape)
+
+# return the scores of (unique) index pairs at other index pairs (e.g. the test index pairs of a fold) as numpy array,
+# the pairs without score get the fill value. The predictions of any threshold at the other pairs are comparisons of
+# this array with the threshold (as threshold_prediction() followed by matrix_to_array()).
+def pair_scores(indices, scores, other_indices, fill, shape):
+    positions = csr_matrix((np.arange(1, len(indices[0]) + 1), (indices[0], indices[1])), shape=shape)
+    # position 0 (no score) selects the appended fill value
+    return np.append(np.asarray(scores, dtype=float), fill)[matrix_to_array(positions, other_indices) - 1]
 
 # for rescal algorithm output predict connections by fixed threshold (higher threshold means higher precision)
-def predict_rescal_connections_by_threshold(A, R, threshold, all_offers, all_wants, test_needs):
+# if a dictionary of candidates (need -> candidate needs, e.g. from tools/minhash_lsh.py) is given only the candidates
+# of each test need are scored
+def predict_rescal_connections_by_threshold(A, R, threshold, all_offers, all_wants, test_needs, candidates=None):
     binary_prediction = lil_matrix(np.zeros(shape=(A.shape[0],A.shape[0])))
     for need in test_needs:
-        if need in all_offers:
+        if candidates is not None:
+            all_needs = candidates.get(need, [])
+        elif need in all_offers:
             all_needs = all_wants
         elif need in all_wants:
             all_needs = all_offers
@@ -273,6 +391,6 @@ def extend_next_hop_transitive_connections(tensor):
     con = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)
     con = con + con * con
     con.data = np.array([1.] * len(con.data))
-    newTensor = tensor.copy()
+    newTensor = tensor.view()
     newTensor.addSliceMatrix(con, SparseTensor.CONNECTION_SLICE)
     return newTensor
\ No newline at end of file